@@ -1,13 +1,258 @@
 from flask import Blueprint, request, jsonify
-import requests
+import asyncio
+import httpx
+import math
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 
+try:
+    from metrics import record_upstream
+except ImportError:
+    # Running without the API server's metrics module on the path
+    def record_upstream(service, target, seconds):
+        pass
+
 load_dotenv()
 
 emergency_bp = Blueprint('emergency', __name__)
 GOOGLE_MAPS_API_KEY = os.getenv('GOOGLE_MAPS_API_KEY')
 
+# Point this at a local stand-in server for tests and benchmarks
+PLACES_API_URL = os.getenv('PLACES_API_URL', 'https://maps.googleapis.com/maps/api/place/nearbysearch/json')
+# Precision 6 cells are roughly 1.2km x 0.6km
+PLACES_GEOHASH_PRECISION = int(os.getenv('PLACES_GEOHASH_PRECISION', 6))
+PLACES_CACHE_SIZE = int(os.getenv('PLACES_CACHE_SIZE', 2048))
+PLACES_CACHE_TTL = float(os.getenv('PLACES_CACHE_TTL', 6 * 3600))
+# Entries older than the TTL are still served (and refreshed in the
+# background) until they reach this age
+PLACES_CACHE_STALE_TTL = float(os.getenv('PLACES_CACHE_STALE_TTL', 24 * 3600))
+PLACES_CONNECT_TIMEOUT = float(os.getenv('PLACES_CONNECT_TIMEOUT', 2))
+PLACES_READ_TIMEOUT = float(os.getenv('PLACES_READ_TIMEOUT', 5))
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def geohash_encode(lat, lng, precision):
+    lat_range = [-90.0, 90.0]
+    lng_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        target, value = (lng_range, lng) if even else (lat_range, lat)
+        mid = (target[0] + target[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            target[0] = mid
+        else:
+            target[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars), (sum(lat_range) / 2, sum(lng_range) / 2)
+
+
+http_client = httpx.Client(
+    timeout=httpx.Timeout(PLACES_READ_TIMEOUT, connect=PLACES_CONNECT_TIMEOUT),
+    limits=httpx.Limits(max_keepalive_connections=10, max_connections=20)
+)
+
+
+class PlacesCache:
+    def __init__(self, max_entries=PLACES_CACHE_SIZE, ttl=PLACES_CACHE_TTL, stale_ttl=PLACES_CACHE_STALE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = OrderedDict()
+        self._refreshing = set()
+        self._tasks = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='places-refresh')
+        self._stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'upstream_errors': 0, 'evictions': 0}
+
+    def get(self, key, fetch):
+        data, entry, refresh = self._lookup(key)
+        if refresh:
+            self._executor.submit(self._refresh, key, fetch)
+        if data is not None:
+            return data
+
+        try:
+            data = fetch()
+        except httpx.HTTPError:
+            return self._upstream_failed(entry)
+        self._store(key, data)
+        return data
+
+    async def aget(self, key, fetch):
+        # Same as get() for an async fetch; refreshes run as tasks on the loop
+        data, entry, refresh = self._lookup(key)
+        if refresh:
+            task = asyncio.create_task(self._arefresh(key, fetch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        if data is not None:
+            return data
+
+        try:
+            data = await fetch()
+        except httpx.HTTPError:
+            return self._upstream_failed(entry)
+        self._store(key, data)
+        return data
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+        return stats
+
+    def _lookup(self, key):
+        # Returns (data to serve or None, the entry, whether to refresh it)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                age = now - entry[0]
+                if age <= self.ttl:
+                    self._stats['hits'] += 1
+                    return entry[1], entry, False
+                if age <= self.stale_ttl:
+                    self._stats['stale_hits'] += 1
+                    refresh = key not in self._refreshing
+                    self._refreshing.add(key)
+                    return entry[1], entry, refresh
+            self._stats['misses'] += 1
+        return None, entry, False
+
+    def _upstream_failed(self, entry):
+        with self._lock:
+            self._stats['upstream_errors'] += 1
+        # In an emergency an old answer beats no answer; otherwise re-raise
+        # the HTTPError being handled by the caller
+        if entry is not None:
+            return entry[1]
+        raise
+
+    def _refresh(self, key, fetch):
+        try:
+            self._store(key, fetch())
+            with self._lock:
+                self._stats['refreshes'] += 1
+        except httpx.HTTPError:
+            with self._lock:
+                self._stats['upstream_errors'] += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    async def _arefresh(self, key, fetch):
+        try:
+            self._store(key, await fetch())
+            with self._lock:
+                self._stats['refreshes'] += 1
+        except httpx.HTTPError:
+            with self._lock:
+                self._stats['upstream_errors'] += 1
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def _store(self, key, data):
+        # Only cache answers that describe the area, not upstream failures
+        if data.get('status') not in ('OK', 'ZERO_RESULTS'):
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+
+places_cache = PlacesCache()
+
+
+def places_params(lat, lng, place_type):
+    params = {
+        'location': f'{lat},{lng}',
+        'radius': '5000',  # 5km radius
+        'type': place_type,
+        'rankby': 'distance',
+        'key': GOOGLE_MAPS_API_KEY
+    }
+    # requests used to drop None values; httpx would send an empty key=
+    return {k: v for k, v in params.items() if v is not None}
+
+
+def fetch_places(lat, lng, place_type):
+    started = time.monotonic()
+    try:
+        response = http_client.get(PLACES_API_URL, params=places_params(lat, lng, place_type))
+    finally:
+        record_upstream('places', place_type, time.monotonic() - started)
+    response.raise_for_status()
+    return response.json()
+
+
+async def afetch_places(client, lat, lng, place_type):
+    # For asgi.py, with its httpx.AsyncClient
+    started = time.monotonic()
+    try:
+        response = await client.get(PLACES_API_URL, params=places_params(lat, lng, place_type))
+    finally:
+        record_upstream('places', place_type, time.monotonic() - started)
+    response.raise_for_status()
+    return response.json()
+
+
+def place_cell(lat, lng, place_type):
+    # Every point in a geohash cell shares one upstream lookup made from the
+    # cell centre. Returns the cache key and the centre.
+    cell, (cell_lat, cell_lng) = geohash_encode(float(lat), float(lng), PLACES_GEOHASH_PRECISION)
+    return (cell, place_type), (round(cell_lat, 6), round(cell_lng, 6))
+
+
+def distance_m(lat1, lng1, lat2, lng2):
+    # Haversine
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371008.8 * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def nearest_place(data, lat, lng):
+    # (body, status) for a Places answer. The lookup was made from the
+    # cell centre, so its order can be off by up to a cell for the caller.
+    results = [r for r in data.get('results') or [] if r.get('geometry', {}).get('location')]
+    if data.get('status') == 'OK' and results:
+        lat, lng = float(lat), float(lng)
+        nearest = min(results, key=lambda r: distance_m(
+            lat, lng, r['geometry']['location']['lat'], r['geometry']['location']['lng']))
+        return {
+            'status': 'success',
+            'data': {
+                'name': nearest['name'],
+                'address': nearest['vicinity'],
+                'location': nearest['geometry']['location'],
+                'place_id': nearest.get('place_id')
+            }
+        }, 200
+    return {
+        'status': 'error',
+        'message': 'No places found nearby'
+    }, 404
+
+
 @emergency_bp.route('/api/nearby-places', methods=['GET'])
 def get_nearby_places():
     try:
@@ -22,39 +267,21 @@ def get_nearby_places():
                 'message': 'Missing required parameters'
             }), 400
 
-        # Call Google Places API
-        url = 'https://maps.googleapis.com/maps/api/place/nearbysearch/json'
-        params = {
-            'location': f'{lat},{lng}',
-            'radius': '5000',  # 5km radius
-            'type': place_type,
-            'rankby': 'distance',
-            'key': GOOGLE_MAPS_API_KEY
-        }
-
-        response = requests.get(url, params=params)
-        data = response.json()
-
-        if data.get('status') == 'OK' and data.get('results'):
-            # Get the nearest place
-            nearest = data['results'][0]
-            return jsonify({
-                'status': 'success',
-                'data': {
-                    'name': nearest['name'],
-                    'address': nearest['vicinity'],
-                    'location': nearest['geometry']['location'],
-                    'place_id': nearest.get('place_id')
-                }
-            })
-        else:
-            return jsonify({
-                'status': 'error',
-                'message': 'No places found nearby'
-            }), 404
+        key, (cell_lat, cell_lng) = place_cell(lat, lng, place_type)
+        data = places_cache.get(key, lambda: fetch_places(cell_lat, cell_lng, place_type))
+        body, status = nearest_place(data, lat, lng)
+        return jsonify(body), status
 
     except Exception as e:
         return jsonify({
             'status': 'error',
             'message': str(e)
-        }), 500 
\ No newline at end of file
+        }), 500
+
+
+@emergency_bp.route('/api/nearby-places/stats', methods=['GET'])
+def get_nearby_places_stats():
+    return jsonify({
+        'status': 'success',
+        'data': places_cache.stats()
+    })
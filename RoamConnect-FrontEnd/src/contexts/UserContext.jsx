@@ -5,6 +5,7 @@ const UserContext = createContext();
 
 export function UserProvider({ children }) {
   const [userData, setUserData] = useState({
+    id: null,
     name: '',
     email: '',
     phone: '',
@@ -24,6 +25,7 @@ export function UserProvider({ children }) {
         if (response.status === 'success' && response.data.length > 0) {
           const user = response.data[0];
           setUserData({
+            id: user.id,
             name: user.name,
             email: user.email,
             phone: '', // Not provided by API
@@ -18,7 +18,7 @@ function Profile() {
 
   useEffect(() => {
     async function fetchPosts() {
-      if (!userData?.email) {
+      if (!userData?.id) {
         setLoadingPosts(false);
         return;
       }
@@ -27,21 +27,12 @@ function Profile() {
       setPostsError(null);
       
       try {
-        const response = await fetch('https://roamconnect.onrender.com/posts');
+        // Only this author's posts, newest first, instead of the whole feed
+        const response = await fetch(`https://roamconnect.onrender.com/tourists/${userData.id}/posts`);
         const data = await response.json();
-        
-        console.log('API Response:', data);
-        console.log('User Data:', userData);
 
         if (data.status === 'success' && Array.isArray(data.data)) {
-          // Filter posts by matching creator_name with user's name
-          const userPosts = data.data.filter(post => 
-            post.creator_name === userData.name || 
-            post.created_by === userData.id ||
-            post.email === userData.email
-          );
-          console.log('Filtered posts:', userPosts);
-          setPosts(userPosts);
+          setPosts(data.data);
         } else {
           setPosts([]);
         }
@@ -0,0 +1,248 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
+# Itineraries generated at once per process, and how many more may wait
+ITINERARY_MAX_CONCURRENT = int(os.getenv('ITINERARY_MAX_CONCURRENT', 8))
+ITINERARY_MAX_WAITING = int(os.getenv('ITINERARY_MAX_WAITING', 16))
+# Seconds a request waits for a slot before it gets a 503
+ITINERARY_MAX_WAIT = float(os.getenv('ITINERARY_MAX_WAIT', 15))
+# Token buckets: requests per second and burst size, for the whole process
+# and per client. A rate of 0 turns that limit off.
+ITINERARY_RATE = float(os.getenv('ITINERARY_RATE', 2))
+ITINERARY_BURST = float(os.getenv('ITINERARY_BURST', 20))
+ITINERARY_CLIENT_RATE = float(os.getenv('ITINERARY_CLIENT_RATE', 0.1))
+ITINERARY_CLIENT_BURST = float(os.getenv('ITINERARY_CLIENT_BURST', 5))
+# Client buckets kept; the least recently seen are dropped (a dropped
+# client starts again with a full bucket)
+ITINERARY_CLIENT_BUCKETS = int(os.getenv('ITINERARY_CLIENT_BUCKETS', 10000))
+# Take the client from X-Forwarded-For; only behind a proxy that sets it
+TRUST_FORWARDED_FOR = os.getenv('TRUST_FORWARDED_FOR') == '1'
+
+
+def client_key(headers, remote_addr):
+    if TRUST_FORWARDED_FOR and headers.get('X-Forwarded-For'):
+        return headers['X-Forwarded-For'].split(',')[0].strip()
+    return remote_addr or 'unknown'
+
+
+class Rejected(Exception):
+    def __init__(self, message, status, retry_after, client=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.client = client
+
+    def headers(self):
+        return {'Retry-After': str(self.retry_after)}
+
+    def seen_by(self, client):
+        # Coalesced requests share their leader's rejection; another
+        # client's rate limit says nothing about this one
+        if self.status == 429 and self.client != client:
+            return Rejected('Too many itinerary requests in progress, try again shortly', 503, self.retry_after)
+        return self
+
+
+class TokenBucket:
+    # Callers hold the controller's lock
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return self.tokens
+
+    def wait_time(self):
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """Decides which itinerary requests run now, wait, or are turned away.
+
+    Rate limits are checked first and answer at once: 429 when the client
+    is over its own rate, 503 when the whole process is. Admitted requests
+    then take one of max_concurrent slots, or wait in FIFO order for up to
+    max_wait seconds if fewer than max_waiting are already waiting. All of
+    it is per process.
+    """
+
+    def __init__(self, max_concurrent=ITINERARY_MAX_CONCURRENT, max_waiting=ITINERARY_MAX_WAITING,
+                 max_wait=ITINERARY_MAX_WAIT, rate=ITINERARY_RATE, burst=ITINERARY_BURST,
+                 client_rate=ITINERARY_CLIENT_RATE, client_burst=ITINERARY_CLIENT_BURST,
+                 client_buckets=ITINERARY_CLIENT_BUCKETS):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.client_buckets = client_buckets
+        self._lock = threading.Lock()
+        self._bucket = TokenBucket(rate, burst, time.monotonic()) if rate > 0 else None
+        self._clients = OrderedDict()
+        self._active = 0
+        self._waiters = deque()
+        # Moving average of how long a slot is held, for Retry-After
+        self._hold_seconds = None
+        self._stats = {
+            'admitted': 0,
+            'queued': 0,
+            'rejected_client_rate': 0,
+            'rejected_global_rate': 0,
+            'rejected_queue_full': 0,
+            'rejected_wait_timeout': 0,
+        }
+
+    def check_rate(self, client):
+        # Takes a token from both buckets or raises Rejected without taking any
+        now = time.monotonic()
+        with self._lock:
+            self._take_tokens(client, now)
+
+    def refund(self, client):
+        # Gives back the tokens check_rate took, for a request that was
+        # turned away further on
+        now = time.monotonic()
+        with self._lock:
+            for bucket in (self._clients.get(client), self._bucket):
+                if bucket is not None:
+                    bucket.refill(now)
+                    bucket.tokens = min(bucket.burst, bucket.tokens + 1)
+
+    def acquire(self, client):
+        # Returns a token for release(); for slots held past the handler,
+        # like a streamed response
+        waiter = self._enter(client)
+        if waiter is not None:
+            self._wait(waiter, waiter.wait(self.max_wait))
+        return time.monotonic()
+
+    async def aacquire(self, client):
+        # For asgi.py. A waiting request parks a worker thread, at most
+        # max_waiting of them.
+        waiter = self._enter(client)
+        if waiter is not None:
+            try:
+                handed_slot = await asyncio.to_thread(waiter.wait, self.max_wait)
+            except asyncio.CancelledError:
+                self._abandon(waiter)
+                raise
+            self._wait(waiter, handed_slot)
+        return time.monotonic()
+
+    def release(self, started):
+        self._release(time.monotonic() - started)
+
+    @contextmanager
+    def admit(self, client):
+        started = self.acquire(client)
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    @asynccontextmanager
+    async def aadmit(self, client):
+        started = await self.aacquire(client)
+        try:
+            yield
+        finally:
+            self.release(started)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                'active': self._active,
+                'waiting': len(self._waiters),
+                'max_concurrent': self.max_concurrent,
+                'max_waiting': self.max_waiting,
+                'clients': len(self._clients),
+                'global_tokens': round(self._bucket.refill(time.monotonic()), 2) if self._bucket else None,
+                'avg_hold_seconds': round(self._hold_seconds, 3) if self._hold_seconds is not None else None,
+            }
+
+    def _enter(self, client):
+        # Returns None with a slot taken, or an Event to wait on
+        now = time.monotonic()
+        with self._lock:
+            self._take_tokens(client, now)
+            if self._active < self.max_concurrent and not self._waiters:
+                self._active += 1
+                self._stats['admitted'] += 1
+                return None
+            if len(self._waiters) >= self.max_waiting:
+                self._stats['rejected_queue_full'] += 1
+                raise Rejected('Too many itinerary requests in progress, try again shortly', 503,
+                               self._retry_after(len(self._waiters) + 1))
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+            self._stats['queued'] += 1
+            return waiter
+
+    def _wait(self, waiter, handed_slot):
+        if handed_slot:
+            return
+        with self._lock:
+            # The slot may have been handed over just as the wait timed out
+            if waiter.is_set():
+                return
+            self._waiters.remove(waiter)
+            self._stats['rejected_wait_timeout'] += 1
+            retry_after = self._retry_after(len(self._waiters) + 1)
+        raise Rejected(f'No itinerary slot became free within {self.max_wait:g}s, try again shortly', 503, retry_after)
+
+    def _abandon(self, waiter):
+        # A waiting request went away; give back a slot it was handed
+        with self._lock:
+            if not waiter.is_set():
+                self._waiters.remove(waiter)
+                return
+        self._release(None)
+
+    def _release(self, held):
+        with self._lock:
+            if held is not None:
+                previous = self._hold_seconds
+                self._hold_seconds = held if previous is None else 0.9 * previous + 0.1 * held
+            if self._waiters:
+                # The slot passes straight to the oldest waiter
+                self._waiters.popleft().set()
+                self._stats['admitted'] += 1
+            else:
+                self._active -= 1
+
+    def _take_tokens(self, client, now):
+        bucket = None
+        if self.client_rate > 0:
+            bucket = self._clients.get(client)
+            if bucket is None:
+                bucket = self._clients[client] = TokenBucket(self.client_rate, self.client_burst, now)
+                while len(self._clients) > self.client_buckets:
+                    self._clients.popitem(last=False)
+            self._clients.move_to_end(client)
+            if bucket.refill(now) < 1:
+                self._stats['rejected_client_rate'] += 1
+                raise Rejected('Too many itinerary requests from this client', 429, math.ceil(bucket.wait_time()),
+                               client)
+        if self._bucket is not None and self._bucket.refill(now) < 1:
+            self._stats['rejected_global_rate'] += 1
+            raise Rejected('Itinerary service is over its request rate, try again shortly', 503,
+                           math.ceil(self._bucket.wait_time()))
+        if bucket is not None:
+            bucket.tokens -= 1
+        if self._bucket is not None:
+            self._bucket.tokens -= 1
+
+    def _retry_after(self, position):
+        # Roughly when a slot frees up for a request joining at position
+        hold = self._hold_seconds or 1.0
+        return max(1, math.ceil(hold * position / self.max_concurrent))
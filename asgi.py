@@ -0,0 +1,324 @@
+"""Async entry point: uvicorn asgi:app --workers 4
+
+The routes that spend their time waiting on OpenAI, Places or MySQL run
+as coroutines on an aiomysql pool and httpx.AsyncClient, so a process can
+hold hundreds of them without a thread each. Every other route goes to the
+Flask app from server.py on a thread pool, unchanged. The native routes
+return the same status codes and JSON bodies as their Flask versions.
+"""
+import asyncio
+import os
+import sys
+import time
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from dotenv import load_dotenv
+from flask.json.provider import DefaultJSONProvider
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Match, Route
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'RoamConnect-FrontEnd', 'backend'))
+# Settings are read at import time, see server.py
+load_dotenv()
+
+import metrics  # noqa: E402
+from admission import Rejected, client_key  # noqa: E402
+import server  # noqa: E402
+from changes import ensure_table  # noqa: E402
+from db_async import AsyncDB  # noqa: E402
+from itinerary_ai import TRIP_FIELDS, agenerate_itinerary, astore_itinerary, astream_itinerary, parse_trip  # noqa: E402
+from itinerary_cache import cache_key  # noqa: E402
+from itinerary_responses import (  # noqa: E402
+    ItineraryEventStream, accepted_job, created_body, error_response, itinerary_events
+)
+from listing import LOOKUP_QUERIES, serialize_itinerary  # noqa: E402
+from routes.emergency_routes import (  # noqa: E402
+    PLACES_CONNECT_TIMEOUT, PLACES_READ_TIMEOUT, afetch_places, emergency_bp, nearest_place, place_cell, places_cache
+)
+from singleflight import AsyncSingleFlight  # noqa: E402
+
+# Threads for the routes served by Flask
+ASGI_WSGI_THREADS = int(os.getenv('ASGI_WSGI_THREADS', 16))
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 120))
+# Concurrent upstream connections per client and process
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv('ASYNC_HTTP_MAX_CONNECTIONS', 200))
+
+CORS_OPTIONS = {
+    'allow_origins': ['*'],
+    'allow_methods': ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
+    'allow_headers': ['Content-Type', 'Authorization', 'X-Profile'],
+    'expose_headers': ['Content-Type', 'Authorization'],
+    'allow_credentials': True,
+    'max_age': 3600,
+}
+
+db = AsyncDB()
+itinerary_flights = AsyncSingleFlight()
+http_clients = {}
+
+# Flask's encoder without the serialize timing, which needs a Flask request
+json_provider = DefaultJSONProvider(server.app)
+
+server.app.register_blueprint(emergency_bp)
+# Served by the Flask /stats/<name> route and included in /metrics
+server.STATS_SOURCES['async-db-pool'] = db.stats
+server.STATS_SOURCES['async-itinerary-coalescing'] = itinerary_flights.stats
+
+
+def json_response(body, status=200, headers=None):
+    # Same body as jsonify
+    return Response(json_provider.dumps(body) + '\n', status_code=status, headers=headers,
+                    media_type='application/json')
+
+
+class AdmittedStream(StreamingResponse):
+    # Holds an itinerary admission slot until the response is finished,
+    # however it ends
+
+    def __init__(self, content, started, **kwargs):
+        super().__init__(content, **kwargs)
+        self.started = started
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if self.started is not None:
+                server.itinerary_admission.release(self.started)
+
+
+async def save_itinerary(trip, itinerary):
+    itinerary_id = await astore_itinerary(db, trip, itinerary)
+    server.itinerary_cache.put(trip, itinerary_id, itinerary)
+    server.itinerary_index.add(itinerary_id, trip)
+    return itinerary_id
+
+
+async def produce_itinerary(trip, client):
+    cached = await server.itinerary_cache.aget(trip, db.fetchall)
+    if cached:
+        itinerary_id, itinerary = cached
+        print(f"Itinerary cache hit: {trip['source']} to {trip['destination']} ({trip['days']} days)")
+        return itinerary_id, itinerary, True
+
+    async def generate_and_store():
+        # Reuse can refresh the similarity index and extend a plan, both
+        # through the sync code, so it runs on a thread and takes its
+        # admission slot there
+        itinerary = await asyncio.to_thread(server.reuse_similar_itinerary, trip, client)
+        if itinerary is None:
+            async with server.itinerary_admission.aadmit(client):
+                itinerary = await agenerate_itinerary(http_clients['openai'], trip)
+        return await save_itinerary(trip, itinerary), itinerary
+
+    try:
+        (itinerary_id, itinerary), coalesced = await itinerary_flights.do(cache_key(trip), generate_and_store)
+    except Rejected as e:
+        raise e.seen_by(client)
+    return itinerary_id, itinerary, coalesced
+
+
+async def create_ai_itinerary(request):
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or not all(k in data for k in TRIP_FIELDS):
+        return json_response({'error': 'Missing required fields'}, 400)
+
+    try:
+        trip = parse_trip(data)
+        client = client_key(request.headers, request.client.host if request.client else None)
+
+        if request.query_params.get('async') == '1':
+            body, headers = accepted_job(server.submit_itinerary_job(trip, client))
+            return json_response(body, 202, headers)
+
+        return json_response(created_body(*await produce_itinerary(trip, client)))
+    except Exception as e:
+        return json_response(*error_response(e))
+
+
+async def stream_ai_itinerary(request):
+    data = dict(request.query_params)
+    if 'preferences' in data:
+        data['preferences'] = [p.strip() for p in ','.join(request.query_params.getlist('preferences')).split(',') if p.strip()]
+    if not all(k in data for k in TRIP_FIELDS):
+        return json_response({'error': 'Missing required fields'}, 400)
+
+    try:
+        trip = parse_trip(data)
+    except ValueError as e:
+        return json_response({'error': f'Invalid input: {str(e)}'}, 400)
+
+    # Decided before the response starts so a rejection keeps its status
+    try:
+        cached = await server.itinerary_cache.aget(trip, db.fetchall)
+        client = client_key(request.headers, request.client.host if request.client else None)
+        started = None if cached else await server.itinerary_admission.aacquire(client)
+    except Rejected as e:
+        return json_response({'error': str(e)}, e.status, e.headers())
+    except Exception as e:
+        print("Unexpected Error:", str(e))
+        return json_response({'error': str(e)}, 500)
+
+    async def generate():
+        stream = ItineraryEventStream(json_provider.dumps)
+        try:
+            if cached:
+                itinerary_id, itinerary = cached
+                events = itinerary_events(itinerary)
+            else:
+                itinerary_id = None
+                events = astream_itinerary(http_clients['openai'], trip)
+
+            async for event in _aiter(events):
+                frame = stream.on_event(*event)
+                if frame:
+                    yield frame
+            for frame in stream.unsent_days():
+                yield frame
+
+            if itinerary_id is None:
+                itinerary_id = await save_itinerary(trip, stream.itinerary)
+            yield stream.done(itinerary_id, cached is not None)
+        except Exception as e:
+            yield stream.error(e)
+
+    return AdmittedStream(generate(), started, media_type='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+async def _aiter(events):
+    # Cached itineraries replay through a plain generator
+    if hasattr(events, '__aiter__'):
+        async for event in events:
+            yield event
+    else:
+        for event in events:
+            yield event
+
+
+async def get_itinerary(request):
+    itinerary = await db.fetchone(LOOKUP_QUERIES['itinerary'], (request.path_params['itinerary_id'],))
+    if not itinerary:
+        return json_response({'error': 'Itinerary not found'}, 404)
+
+    return json_response({
+        'status': 'success',
+        'data': serialize_itinerary(itinerary)
+    })
+
+
+async def get_nearby_places(request):
+    try:
+        lat = request.query_params.get('lat')
+        lng = request.query_params.get('lng')
+        place_type = request.query_params.get('type')
+
+        if not all([lat, lng, place_type]):
+            return json_response({
+                'status': 'error',
+                'message': 'Missing required parameters'
+            }, 400)
+
+        key, (cell_lat, cell_lng) = place_cell(lat, lng, place_type)
+        data = await places_cache.aget(key, lambda: afetch_places(http_clients['places'], cell_lat, cell_lng, place_type))
+        body, status = nearest_place(data, lat, lng)
+        return json_response(body, status)
+
+    except Exception as e:
+        return json_response({
+            'status': 'error',
+            'message': str(e)
+        }, 500)
+
+
+# Names are the Flask rules, so /metrics labels match in both modes
+NATIVE_ROUTES = [
+    Route('/itinerary', create_ai_itinerary, methods=['POST'], name='/itinerary'),
+    Route('/itinerary/stream', stream_ai_itinerary, methods=['GET'], name='/itinerary/stream'),
+    Route('/itinerary/{itinerary_id:int}', get_itinerary, methods=['GET'], name='/itinerary/<int:itinerary_id>'),
+    Route('/api/nearby-places', get_nearby_places, methods=['GET'], name='/api/nearby-places'),
+]
+
+
+async def startup():
+    await db.start()
+    # astore_itinerary writes to the change log
+    await asyncio.to_thread(ensure_table)
+    server.itinerary_index.start()
+    limits = httpx.Limits(max_connections=ASYNC_HTTP_MAX_CONNECTIONS, max_keepalive_connections=20)
+    http_clients['openai'] = httpx.AsyncClient(timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=10), limits=limits)
+    http_clients['places'] = httpx.AsyncClient(
+        timeout=httpx.Timeout(PLACES_READ_TIMEOUT, connect=PLACES_CONNECT_TIMEOUT), limits=limits
+    )
+
+
+async def shutdown():
+    for client in http_clients.values():
+        await client.aclose()
+    http_clients.clear()
+    await db.close()
+
+
+class AsyncApp:
+    """Sends NATIVE_ROUTES to their coroutines and everything else to Flask.
+
+    A route only takes a request whose path and method both match, so e.g.
+    GET /itinerary and CORS preflights still reach the Flask app.
+    """
+
+    def __init__(self, routes, fallback):
+        self.routes = routes
+        self.fallback = fallback
+        self.native = CORSMiddleware(self._handle, **CORS_OPTIONS)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] == 'http':
+            for route in self.routes:
+                match, child_scope = route.matches(scope)
+                if match == Match.FULL:
+                    await self.native({**scope, **child_scope, 'native_route': route}, receive, send)
+                    return
+        await self.fallback(scope, receive, send)
+
+    async def _handle(self, scope, receive, send):
+        route = scope['native_route']
+        started = time.perf_counter()
+        status = []
+
+        async def send_and_record(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+            await send(message)
+
+        try:
+            with metrics.route_phases(route.name):
+                await route.handle(scope, receive, send_and_record)
+        finally:
+            metrics.request_seconds.observe(
+                time.perf_counter() - started, scope['method'], route.name, str(status[0] if status else 500)
+            )
+
+    async def _lifespan(self, receive, send):
+        await receive()
+        try:
+            await startup()
+        except Exception as e:
+            await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+            return
+        await send({'type': 'lifespan.startup.complete'})
+        await receive()
+        await shutdown()
+        await send({'type': 'lifespan.shutdown.complete'})
+
+
+app = AsyncApp(NATIVE_ROUTES, WSGIMiddleware(server.app, workers=ASGI_WSGI_THREADS))
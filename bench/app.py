@@ -0,0 +1,16 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'RoamConnect-FrontEnd', 'backend'))
+
+from routes.emergency_routes import emergency_bp  # noqa: E402
+from server import app  # noqa: E402
+
+# The nearby-places blueprint is served separately in production; the
+# benchmark mounts it on the API app so one process covers every route
+app.register_blueprint(emergency_bp)
+
+if __name__ == '__main__':
+    app.run(host='127.0.0.1', port=int(os.environ.get('PORT', 5000)), threaded=True)
@@ -0,0 +1,60 @@
+import argparse
+import json
+import sys
+
+
+def _change(before, after):
+    if before in (None, 0) or after is None:
+        return None
+    return (after - before) / before * 100
+
+
+def compare(base, head, threshold):
+    # Returns table rows and the scenarios whose p95 or throughput got worse
+    # by more than threshold percent
+    rows = []
+    regressions = []
+    for name, result in head['scenarios'].items():
+        before = base['scenarios'].get(name)
+        if before is None:
+            rows.append((name, None, result['throughput_rps'], None, None, result['latency_ms']['p95'], None))
+            continue
+        rps_change = _change(before['throughput_rps'], result['throughput_rps'])
+        p95_change = _change(before['latency_ms']['p95'], result['latency_ms']['p95'])
+        rows.append((name, before['throughput_rps'], result['throughput_rps'], rps_change,
+                     before['latency_ms']['p95'], result['latency_ms']['p95'], p95_change))
+        if (rps_change is not None and rps_change < -threshold) or (p95_change is not None and p95_change > threshold):
+            regressions.append(name)
+    return rows, regressions
+
+
+def _fmt(value, suffix=''):
+    if value is None:
+        return '-'
+    return f'{value:+.1f}{suffix}' if suffix else f'{value:.1f}'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare two bench.run result files.')
+    parser.add_argument('base')
+    parser.add_argument('head')
+    parser.add_argument('--threshold', type=float, default=10, help='Percent change that counts as a regression')
+    args = parser.parse_args()
+
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.head) as f:
+        head = json.load(f)
+
+    if base['config'] != head['config']:
+        print('Warning: the runs used different configurations', file=sys.stderr)
+
+    rows, regressions = compare(base, head, args.threshold)
+    print(f"{'scenario':<34} {'req/s':>9} {'->':>9} {'change':>8}   {'p95 ms':>9} {'->':>9} {'change':>8}")
+    for name, rps_before, rps_after, rps_change, p95_before, p95_after, p95_change in rows:
+        print(f'{name:<34} {_fmt(rps_before):>9} {_fmt(rps_after):>9} {_fmt(rps_change, "%"):>8}   '
+              f'{_fmt(p95_before):>9} {_fmt(p95_after):>9} {_fmt(p95_change, "%"):>8}')
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) over {args.threshold:g}%: {', '.join(regressions)}")
+        sys.exit(1)
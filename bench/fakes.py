@@ -0,0 +1,160 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+CHUNK_DAYS_RE = re.compile(r'Plan ONLY days (\d+) to (\d+)')
+TRIP_DAYS_RE = re.compile(r'Create a detailed (\d+)-day')
+BUDGET_RE = re.compile(r'budget of ₹(\d+(?:\.\d+)?)')
+
+ACTIVITY_NAMES = ('Old town walk', 'Museum visit', 'Street food tour', 'Sunset point', 'Local market',
+                  'Temple visit', 'Boat ride', 'Cooking class', 'Hike', 'Beach time')
+PLACE_NAMES = ('City Hospital', 'Central Police Station', 'Community Clinic', 'Fire Station No. 3')
+
+
+class Latency:
+    """Uniform latency around `mean` seconds, +/- `jitter` seconds."""
+
+    def __init__(self, mean=0.0, jitter=0.0):
+        self.mean = mean
+        self.jitter = jitter
+
+    def sleep(self):
+        delay = self.mean + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def fake_itinerary(first_day, last_day, budget):
+    days = last_day - first_day + 1
+    rng = random.Random(f'{first_day}-{last_day}-{budget}')
+    categories = ('transportation', 'accommodation', 'activities', 'food', 'miscellaneous')
+    return {
+        'summary': f'A {days}-day trip generated by the benchmark stand-in.',
+        'budget_breakdown': {
+            'total': budget,
+            'categories': [
+                {'category': c, 'amount': round(budget / len(categories), 2), 'percentage': 20} for c in categories
+            ],
+        },
+        'daily_itinerary': [
+            {
+                'day': day,
+                'activities': [
+                    {
+                        'time': f'{hour:02d}:00',
+                        'activity': rng.choice(ACTIVITY_NAMES),
+                        'duration': '2 hours',
+                        'cost': rng.randint(100, 2000),
+                        'description': 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 3,
+                    }
+                    for hour in (9, 12, 15, 19)
+                ],
+            }
+            for day in range(first_day, last_day + 1)
+        ],
+        'restaurant_recommendations': [{'name': f'Restaurant {i}', 'cuisine': 'Local', 'price_range': '$$'} for i in range(5)],
+        'transportation_details': [{'mode': 'Train', 'details': 'Overnight sleeper', 'cost': 1500}],
+        'emergency_info': {'police': '100', 'ambulance': '102', 'fire': '101', 'embassy': 'n/a', 'hospital': 'City Hospital'},
+        'local_tips': ['Carry cash', 'Start early'],
+        'cultural_notes': ['Dress modestly at temples'],
+    }
+
+
+def itinerary_for_prompt(prompt):
+    budget_match = BUDGET_RE.search(prompt)
+    budget = float(budget_match.group(1)) if budget_match else 10000.0
+    chunk = CHUNK_DAYS_RE.search(prompt)
+    if chunk:
+        return fake_itinerary(int(chunk.group(1)), int(chunk.group(2)), budget)
+    trip = TRIP_DAYS_RE.search(prompt)
+    return fake_itinerary(1, int(trip.group(1)) if trip else 3, budget)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    latency = Latency()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class OpenAIHandler(_Handler):
+    """Enough of POST /v1/chat/completions for openai 0.28, streaming included."""
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        prompt = request.get('messages', [{}])[-1].get('content', '')
+        content = json.dumps(itinerary_for_prompt(prompt))
+        self.latency.sleep()
+
+        if not request.get('stream'):
+            prompt_tokens = len(prompt) // 4
+            completion_tokens = len(content) // 4
+            self._send_json(200, {
+                'id': 'chatcmpl-bench',
+                'object': 'chat.completion',
+                'created': int(time.time()),
+                'model': request.get('model'),
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                          'total_tokens': prompt_tokens + completion_tokens},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for start in range(0, len(content), 64):
+            chunk = {
+                'id': 'chatcmpl-bench',
+                'object': 'chat.completion.chunk',
+                'model': request.get('model'),
+                'choices': [{'index': 0, 'delta': {'content': content[start:start + 64]}, 'finish_reason': None}],
+            }
+            self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.close_connection = True
+
+
+class PlacesHandler(_Handler):
+    """GET .../place/nearbysearch/json returning a few places near the query."""
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        lat, lng = (float(v) for v in params.get('location', ['0,0'])[0].split(','))
+        self.latency.sleep()
+        rng = random.Random(f'{lat:.3f},{lng:.3f}')
+        self._send_json(200, {
+            'status': 'OK',
+            'results': [
+                {
+                    'name': rng.choice(PLACE_NAMES),
+                    'vicinity': f'{rng.randint(1, 200)} Main Road',
+                    'geometry': {'location': {'lat': lat + rng.uniform(-0.01, 0.01), 'lng': lng + rng.uniform(-0.01, 0.01)}},
+                    'place_id': f'bench-{rng.getrandbits(32):08x}',
+                }
+                for _ in range(5)
+            ],
+        })
+
+
+def start_server(handler, latency, host='127.0.0.1', port=0):
+    # Returns (server, base_url); the server runs on a daemon thread
+    handler_class = type(handler.__name__, (handler,), {'latency': latency})
+    server = ThreadingHTTPServer((host, port), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name=handler.__name__, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}'
@@ -0,0 +1,42 @@
+"""Runs bench.run against the WSGI app and asgi.py with the same settings.
+
+    python -m bench.modes --concurrency 200 --duration 30
+
+Extra arguments go to bench.run. Without --scenario only the routes that
+asgi.py serves natively are run, since the rest is the same Flask code in
+both modes.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from bench.compare import compare
+
+ASYNC_SCENARIOS = ('POST /itinerary', 'GET /itinerary/stream', 'GET /itinerary/<id>', 'GET /api/nearby-places')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare WSGI and ASGI serving modes.')
+    parser.add_argument('--wsgi', choices=['auto', 'gunicorn', 'werkzeug'], default='auto')
+    parser.add_argument('--output-dir', default='bench-results')
+    args, run_args = parser.parse_known_args()
+
+    if '--scenario' not in run_args:
+        for name in ASYNC_SCENARIOS:
+            run_args += ['--scenario', name]
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    results = {}
+    for mode, server in (('wsgi', args.wsgi), ('asgi', 'asgi')):
+        output = os.path.join(args.output_dir, f'{mode}.json')
+        subprocess.run([sys.executable, '-m', 'bench.run', '--server', server, '--output', output, *run_args], check=True)
+        with open(output) as f:
+            results[mode] = json.load(f)
+
+    print(f"{'scenario':<34} {'wsgi req/s':>11} {'asgi req/s':>11}   {'wsgi p95':>9} {'asgi p95':>9}  errors")
+    rows, _ = compare(results['wsgi'], results['asgi'], threshold=0)
+    for name, wsgi_rps, asgi_rps, _, wsgi_p95, asgi_p95, _ in rows:
+        errors = f"{results['wsgi']['scenarios'][name]['errors']}/{results['asgi']['scenarios'][name]['errors']}"
+        print(f'{name:<34} {str(wsgi_rps):>11} {str(asgi_rps):>11}   {str(wsgi_p95):>9} {str(asgi_p95):>9}  {errors}')
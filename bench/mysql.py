@@ -0,0 +1,153 @@
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+import pymysql
+
+BENCH_DB_NAME = 'roamconnect_bench'
+DOCKER_IMAGE = os.getenv('BENCH_MYSQL_IMAGE', 'mysql:8.0')
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class LocalMySQL:
+    """A throwaway MySQL for benchmarks.
+
+    Uses a local mysqld/mariadbd binary on a temporary data directory when
+    one is installed and falls back to a docker container. Pass host/port to
+    use a server that is already running instead.
+    """
+
+    def __init__(self, host=None, port=None, user='root', password='', database=BENCH_DB_NAME):
+        self.external = host is not None
+        self.host = host or '127.0.0.1'
+        self.port = port or free_port()
+        self.user = user
+        self.password = password
+        self.database = database
+        self._process = None
+        self._container = None
+        self._datadir = None
+
+    def env(self):
+        # What db.py reads; SSL is off for the local server
+        return {
+            'DB_HOST': self.host,
+            'DB_PORT': str(self.port),
+            'DB_USER': self.user,
+            'DB_PASSWORD': self.password,
+            'DB_NAME': self.database,
+            'DB_SSL': '0',
+        }
+
+    def start(self):
+        if not self.external:
+            mysqld = shutil.which('mysqld') or shutil.which('mariadbd')
+            if mysqld:
+                self._start_local(mysqld)
+            elif shutil.which('docker'):
+                self._start_docker()
+            else:
+                raise RuntimeError('No mysqld, mariadbd or docker found; pass --db-host to use an existing server')
+        self._wait_ready()
+        self._create_database()
+        return self
+
+    def _start_local(self, mysqld):
+        self._datadir = tempfile.mkdtemp(prefix='roamconnect-bench-mysql-')
+        data = os.path.join(self._datadir, 'data')
+        if os.path.basename(mysqld) == 'mariadbd':
+            install = shutil.which('mariadb-install-db') or shutil.which('mysql_install_db')
+            subprocess.run([install, f'--datadir={data}', '--auth-root-authentication-method=normal'],
+                           check=True, capture_output=True)
+        else:
+            subprocess.run([mysqld, '--initialize-insecure', f'--datadir={data}'], check=True, capture_output=True)
+        args = [
+            mysqld,
+            f'--datadir={data}',
+            f'--port={self.port}',
+            '--bind-address=127.0.0.1',
+            f'--socket={os.path.join(self._datadir, "mysqld.sock")}',
+            f'--pid-file={os.path.join(self._datadir, "mysqld.pid")}',
+            '--max-connections=500',
+            # Durability is not what is being measured
+            '--innodb-flush-log-at-trx-commit=2',
+        ]
+        if os.path.basename(mysqld) == 'mysqld':
+            args += ['--mysqlx=OFF', '--skip-log-bin']
+        self._process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def _start_docker(self):
+        self._container = f'roamconnect-bench-{self.port}'
+        subprocess.run(
+            [
+                'docker', 'run', '-d', '--rm', '--name', self._container,
+                '-e', 'MYSQL_ALLOW_EMPTY_PASSWORD=yes',
+                '-p', f'127.0.0.1:{self.port}:3306',
+                DOCKER_IMAGE,
+                '--max-connections=500', '--innodb-flush-log-at-trx-commit=2', '--skip-log-bin',
+            ],
+            check=True,
+            capture_output=True,
+        )
+
+    def _connect(self, database=None):
+        return pymysql.connect(
+            host=self.host, port=self.port, user=self.user, password=self.password,
+            database=database, connect_timeout=2, cursorclass=pymysql.cursors.DictCursor
+        )
+
+    def _wait_ready(self, timeout=120):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                self._connect().close()
+                return
+            except pymysql.err.OperationalError:
+                if self._process and self._process.poll() is not None:
+                    raise RuntimeError(f'mysqld exited with code {self._process.returncode}')
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f'MySQL on port {self.port} did not start within {timeout}s')
+                time.sleep(0.5)
+
+    def _create_database(self):
+        conn = self._connect()
+        try:
+            with conn.cursor() as cursor:
+                if not self.external:
+                    cursor.execute(f'DROP DATABASE IF EXISTS {self.database}')
+                cursor.execute(f'CREATE DATABASE IF NOT EXISTS {self.database}')
+            conn.commit()
+        finally:
+            conn.close()
+
+    def connect(self):
+        return self._connect(self.database)
+
+    def stop(self):
+        if self._process:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+            self._process = None
+        if self._container:
+            subprocess.run(['docker', 'stop', self._container], capture_output=True)
+            self._container = None
+        if self._datadir:
+            shutil.rmtree(self._datadir, ignore_errors=True)
+            self._datadir = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
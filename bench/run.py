@@ -0,0 +1,383 @@
+"""Offline load test for the API.
+
+Starts a throwaway MySQL seeded with a fixed data set, stand-ins for the
+OpenAI and Places APIs, and the app itself, then drives every route at a
+fixed concurrency and writes throughput and latency percentiles as JSON:
+
+    python -m bench.run --concurrency 16 --duration 20 --output results/HEAD.json
+    python -m bench.compare results/base.json results/HEAD.json
+
+--server asgi runs asgi.py under uvicorn instead; bench.modes runs both and
+compares them.
+"""
+import argparse
+import io
+import itertools
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fakes import Latency, OpenAIHandler, PlacesHandler, start_server  # noqa: E402
+from bench.mysql import LocalMySQL, free_port  # noqa: E402
+from bench.seed import CITIES, PREFERENCES, seed  # noqa: E402
+
+
+class Context:
+    """What scenarios share: seeded row counts and ids handed out once."""
+
+    def __init__(self, volumes):
+        self.volumes = volumes
+        self.upload_url = None
+        self.etags = {}
+        self.job_ids = []
+        self._lock = threading.Lock()
+        self._counter = itertools.count(1)
+        # Deletes walk down from the highest seeded id so each row is
+        # deleted once
+        self._delete_ids = {table: itertools.count(count, -1) for table, count in volumes.items()}
+
+    def unique(self):
+        with self._lock:
+            return next(self._counter)
+
+    def delete_id(self, table):
+        with self._lock:
+            return next(self._delete_ids[table])
+
+    def add_job(self, job_id):
+        with self._lock:
+            self.job_ids.append(job_id)
+
+    def job_id(self, rng):
+        with self._lock:
+            return rng.choice(self.job_ids) if self.job_ids else 'missing'
+
+
+def _trip(rng, fixed=False):
+    if fixed:
+        return {'source': 'Delhi', 'destination': 'Goa', 'days': 3, 'budget': 20000,
+                'preferences': ['food', 'beaches', 'nightlife']}
+    source, destination = rng.sample(CITIES, 2)
+    return {
+        'source': source[0],
+        'destination': destination[0],
+        'days': rng.randint(2, 10),
+        'budget': rng.randrange(5000, 100000, 500),
+        'preferences': rng.sample(PREFERENCES, 3),
+    }
+
+
+def _point(rng):
+    _, lat, lng = rng.choice(CITIES)
+    return lat + rng.uniform(-0.2, 0.2), lng + rng.uniform(-0.2, 0.2)
+
+
+def _post_form(ctx, rng):
+    return {
+        'created_by': str(rng.randint(1, ctx.volumes['tourists'] // 2)),
+        'content': 'Benchmark post ' * 20,
+        'loc_link': 'https://maps.google.com/?q=Goa',
+        'title': f'Bench post {ctx.unique()}',
+    }
+
+
+def _contact(ctx, rng):
+    lat, lng = _point(rng)
+    return {
+        'name': f'Bench contact {ctx.unique()}',
+        'phno': '+919999999999',
+        'loc': 'Bench',
+        'created_by': rng.randint(1, ctx.volumes['tourists'] // 2),
+        'latitude': round(lat, 6),
+        'longitude': round(lng, 6),
+    }
+
+
+def _submit_job(ctx, client, rng):
+    response = client.post('/itinerary?async=1', json=_trip(rng))
+    if response.status_code == 202:
+        ctx.add_job(response.json()['job_id'])
+    return response
+
+
+def _stream(client, url, **kwargs):
+    # Latency covers the whole event stream, not just the headers
+    with client.stream('GET', url, **kwargs) as response:
+        for _ in response.iter_bytes():
+            pass
+    return response
+
+
+def _random_tourist(ctx, rng):
+    # The upper half of seeded tourists is left for the delete scenario
+    return rng.randint(1, ctx.volumes['tourists'] // 2)
+
+
+# (name, expected statuses, request). Writes run after reads and deletes run
+# last since they remove seeded rows (and, for tourists, their posts).
+SCENARIOS = [
+    ('GET /tourists', {200}, lambda ctx, c, rng: c.get('/tourists')),
+    ('GET /tourists?limit=50', {200}, lambda ctx, c, rng: c.get('/tourists', params={'limit': 50, 'after': rng.randint(0, ctx.volumes['tourists'])})),
+    ('GET /tourists (stream)', {200}, lambda ctx, c, rng: _stream(c, '/tourists', params={'stream': 1})),
+    ('GET /tourists (If-None-Match)', {304}, lambda ctx, c, rng: c.get('/tourists?limit=50', headers={'If-None-Match': ctx.etags['tourists']})),
+    ('GET /posts?limit=50', {200}, lambda ctx, c, rng: c.get('/posts', params={'limit': 50, 'after': rng.randint(0, ctx.volumes['posts'])})),
+    ('GET /posts?fields=id,title', {200}, lambda ctx, c, rng: c.get('/posts', params={'fields': 'id,title', 'limit': 500})),
+    ('GET /posts?since', {200}, lambda ctx, c, rng: c.get('/posts', params={'since': 0})),
+    ('GET /tourists/<id>/posts', {200}, lambda ctx, c, rng: c.get(f'/tourists/{_random_tourist(ctx, rng)}/posts')),
+    ('GET /itinerary?limit=50', {200}, lambda ctx, c, rng: c.get('/itinerary', params={'limit': 50, 'after': rng.randint(0, ctx.volumes['itineraries'])})),
+    ('GET /itinerary/<id>', {200}, lambda ctx, c, rng: c.get(f"/itinerary/{rng.randint(1, ctx.volumes['itineraries'])}")),
+    ('GET /er-cont?limit=50', {200}, lambda ctx, c, rng: c.get('/er-cont', params={'limit': 50, 'after': rng.randint(0, ctx.volumes['er'])})),
+    ('GET /er-cont/nearby', {200}, lambda ctx, c, rng: c.get('/er-cont/nearby', params=dict(zip(('lat', 'lng'), _point(rng))))),
+    ('GET /api/nearby-places', {200}, lambda ctx, c, rng: c.get('/api/nearby-places', params={**dict(zip(('lat', 'lng'), _point(rng))), 'type': 'hospital'})),
+    ('GET /uploads/<file>', {200}, lambda ctx, c, rng: c.get(ctx.upload_url)),
+    ('GET /metrics', {200}, lambda ctx, c, rng: c.get('/metrics')),
+    ('GET /stats/db-pool', {200}, lambda ctx, c, rng: c.get('/stats/db-pool')),
+    ('POST /itinerary (repeat trip)', {200}, lambda ctx, c, rng: c.post('/itinerary', json=_trip(rng, fixed=True))),
+    ('POST /itinerary (new trip)', {200}, lambda ctx, c, rng: c.post('/itinerary', json=_trip(rng))),
+    ('POST /itinerary?async=1', {202, 503}, _submit_job),
+    ('GET /itinerary/jobs/<id>', {200}, lambda ctx, c, rng: c.get(f'/itinerary/jobs/{ctx.job_id(rng)}')),
+    ('GET /itinerary/stream', {200}, lambda ctx, c, rng: _stream(c, '/itinerary/stream', params={**_trip(rng), 'preferences': ','.join(rng.sample(PREFERENCES, 3))})),
+    ('POST /tourists', {201}, lambda ctx, c, rng: c.post('/tourists', data={'name': 'Bench', 'email': f'bench{ctx.unique()}@bench.local', 'pwd': 'x', 'badge': 'lvl0'})),
+    ('PUT /tourists/<id>', {200}, lambda ctx, c, rng: c.put(f'/tourists/{_random_tourist(ctx, rng)}', data={'bio': f'Updated {ctx.unique()}'})),
+    ('POST /posts', {201}, lambda ctx, c, rng: c.post('/posts', data=_post_form(ctx, rng))),
+    ('PUT /posts/<id>', {200}, lambda ctx, c, rng: c.put(f"/posts/{rng.randint(1, ctx.volumes['posts'] // 2)}", data={'title': f'Edited {ctx.unique()}'})),
+    ('POST /posts/bulk', {201}, lambda ctx, c, rng: c.post('/posts/bulk', json=[_post_form(ctx, rng) for _ in range(100)])),
+    ('POST /er-cont', {201}, lambda ctx, c, rng: c.post('/er-cont', json=_contact(ctx, rng))),
+    ('PUT /er-cont/<id>', {200}, lambda ctx, c, rng: c.put(f"/er-cont/{rng.randint(1, ctx.volumes['er'] // 2)}", json={'phno': '+918888888888'})),
+    ('POST /er-cont/bulk', {201}, lambda ctx, c, rng: c.post('/er-cont/bulk', json=[_contact(ctx, rng) for _ in range(100)])),
+    ('DELETE /posts/<id>', {200, 404}, lambda ctx, c, rng: c.delete(f"/posts/{ctx.delete_id('posts')}")),
+    ('DELETE /er-cont/<id>', {200, 404}, lambda ctx, c, rng: c.delete(f"/er-cont/{ctx.delete_id('er')}")),
+    ('DELETE /tourists/<id>', {200, 404}, lambda ctx, c, rng: c.delete(f"/tourists/{ctx.delete_id('tourists')}")),
+]
+
+
+def _png():
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new('RGB', (1200, 800), (200, 120, 40)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def prepare(ctx, client):
+    # Things a few scenarios need from the running app
+    response = client.post('/posts', data=_post_form(ctx, random.Random(0)),
+                           files={'image': ('bench.png', _png(), 'image/png')})
+    response.raise_for_status()
+    ctx.upload_url = response.json()['image_url']
+    ctx.etags = {'tourists': client.get('/tourists?limit=50').headers.get('ETag', '')}
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    # Nearest rank
+    return sorted_values[max(0, math.ceil(p / 100 * len(sorted_values)) - 1)]
+
+
+def run_scenario(base_url, ctx, name, expected, call, concurrency, duration, seed_value):
+    latencies = []
+    statuses = Counter()
+    errors = Counter()
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(index):
+        rng = random.Random(f'{seed_value}:{name}:{index}')
+        mine = []
+        my_statuses = Counter()
+        my_errors = Counter()
+        with httpx.Client(base_url=base_url, timeout=120) as client:
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                try:
+                    response = call(ctx, client, rng)
+                    status = response.status_code
+                except httpx.HTTPError as e:
+                    my_errors[type(e).__name__] += 1
+                    continue
+                mine.append(time.perf_counter() - started)
+                my_statuses[str(status)] += 1
+                if status not in expected:
+                    my_errors[f'status {status}'] += 1
+        with lock:
+            latencies.extend(mine)
+            statuses.update(my_statuses)
+            errors.update(my_errors)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda value: None if value is None else round(value * 1000, 3)  # noqa: E731
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors.values()),
+        'error_kinds': dict(errors),
+        'statuses': dict(statuses),
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0,
+        'latency_ms': {
+            'mean': ms(sum(latencies) / len(latencies)) if latencies else None,
+            'p50': ms(percentile(latencies, 50)),
+            'p95': ms(percentile(latencies, 95)),
+            'p99': ms(percentile(latencies, 99)),
+            'max': ms(latencies[-1] if latencies else None),
+        },
+    }
+
+
+def start_app(env, server, workers, threads):
+    port = free_port()
+    env = {**os.environ, **env, 'PORT': str(port), 'PYTHONPATH': ROOT}
+    # The app writes uploads relative to its working directory
+    workdir = tempfile.mkdtemp(prefix='roamconnect-bench-app-')
+    if server == 'auto':
+        server = 'gunicorn' if shutil.which('gunicorn') else 'werkzeug'
+    if server == 'asgi':
+        command = [sys.executable, '-m', 'uvicorn', 'asgi:app', '--host', '127.0.0.1', '--port', str(port),
+                   '--workers', str(workers), '--log-level', 'warning']
+    elif server == 'gunicorn':
+        command = ['gunicorn', '--pythonpath', ROOT, '-w', str(workers), '--threads', str(threads),
+                   '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'bench.app:app']
+    else:
+        command = [sys.executable, '-m', 'bench.app']
+    process = subprocess.Popen(command, cwd=workdir, env=env)
+
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            httpx.get(f'{base_url}/stats/db-pool', timeout=2)
+            return process, base_url, workdir, server
+        except httpx.HTTPError:
+            if process.poll() is not None or time.monotonic() > deadline:
+                process.kill()
+                raise RuntimeError('The app did not start')
+            time.sleep(0.25)
+
+
+def git_revision():
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    return {'commit': git('rev-parse', 'HEAD'), 'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load test for every API route.')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10, help='Seconds per scenario')
+    parser.add_argument('--scenario', action='append', default=[],
+                        help='Only run scenarios whose name contains this (repeatable)')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplier on the seeded row counts')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--openai-latency', type=float, default=1.0, help='Mean seconds per completion')
+    parser.add_argument('--openai-jitter', type=float, default=0.2)
+    parser.add_argument('--places-latency', type=float, default=0.15)
+    parser.add_argument('--places-jitter', type=float, default=0.05)
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'werkzeug', 'asgi'], default='auto')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn or uvicorn worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='gunicorn threads per worker')
+    parser.add_argument('--db-host', help='Use this MySQL instead of starting one')
+    parser.add_argument('--db-port', type=int)
+    parser.add_argument('--db-user', default='root')
+    parser.add_argument('--db-password', default='')
+    parser.add_argument('--output', help='Write results here instead of stdout')
+    args = parser.parse_args()
+
+    scenarios = [s for s in SCENARIOS if not args.scenario or any(f in s[0] for f in args.scenario)]
+    openai_server, openai_url = start_server(OpenAIHandler, Latency(args.openai_latency, args.openai_jitter))
+    places_server, places_url = start_server(PlacesHandler, Latency(args.places_latency, args.places_jitter))
+    database = LocalMySQL(args.db_host, args.db_port, args.db_user, args.db_password)
+
+    app = workdir = None
+    try:
+        database.start()
+        conn = database.connect()
+        try:
+            print('Seeding...', file=sys.stderr)
+            volumes = seed(conn, args.scale, args.seed)
+        finally:
+            conn.close()
+
+        app, base_url, workdir, server = start_app({
+            **database.env(),
+            'OPENAI_API_BASE': f'{openai_url}/v1',
+            'OPENAI_API_KEY': 'bench',
+            'PLACES_API_URL': f'{places_url}/maps/api/place/nearbysearch/json',
+            'GOOGLE_MAPS_API_KEY': 'bench',
+            # Every request comes from one address; measure the routes, not
+            # the admission limits
+            'ITINERARY_RATE': '0',
+            'ITINERARY_CLIENT_RATE': '0',
+            'ITINERARY_MAX_CONCURRENT': str(args.concurrency),
+            'ITINERARY_MAX_WAITING': str(args.concurrency),
+        }, args.server, args.workers, args.threads)
+
+        ctx = Context(volumes)
+        with httpx.Client(base_url=base_url, timeout=60) as client:
+            prepare(ctx, client)
+
+        results = {}
+        for name, expected, call in scenarios:
+            print(f'{name} ...', file=sys.stderr)
+            results[name] = run_scenario(base_url, ctx, name, expected, call, args.concurrency, args.duration, args.seed)
+            summary = results[name]
+            print(f"  {summary['throughput_rps']} req/s, p50 {summary['latency_ms']['p50']} ms, "
+                  f"p99 {summary['latency_ms']['p99']} ms, {summary['errors']} errors", file=sys.stderr)
+
+        report = {
+            **git_revision(),
+            'finished_at': datetime.now(timezone.utc).isoformat(),
+            'config': {
+                'concurrency': args.concurrency,
+                'duration_s': args.duration,
+                'server': server,
+                'workers': args.workers if server in ('gunicorn', 'asgi') else 1,
+                'threads': args.threads if server == 'gunicorn' else None,
+                'seed': args.seed,
+                'volumes': volumes,
+                'openai_latency_s': [args.openai_latency, args.openai_jitter],
+                'places_latency_s': [args.places_latency, args.places_jitter],
+            },
+            'scenarios': results,
+        }
+        output = json.dumps(report, indent=2)
+        if args.output:
+            os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+            with open(args.output, 'w') as f:
+                f.write(output + '\n')
+        else:
+            print(output)
+    finally:
+        if app:
+            app.terminate()
+            app.wait(timeout=30)
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+        database.stop()
+        openai_server.shutdown()
+        places_server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
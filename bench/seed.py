@@ -0,0 +1,84 @@
+import json
+import random
+
+from bench.fakes import fake_itinerary
+from migrations import migrate
+
+# Rows per table at scale 1
+SEED_VOLUMES = {
+    'tourists': 2000,
+    'posts': 20000,
+    'itineraries': 2000,
+    'er': 5000,
+}
+SEED_CHUNK_ROWS = 1000
+
+CITIES = (
+    ('Delhi', 28.6139, 77.2090), ('Mumbai', 19.0760, 72.8777), ('Bengaluru', 12.9716, 77.5946),
+    ('Goa', 15.2993, 74.1240), ('Jaipur', 26.9124, 75.7873), ('Kochi', 9.9312, 76.2673),
+    ('Varanasi', 25.3176, 82.9739), ('Manali', 32.2432, 77.1892), ('Udaipur', 24.5854, 73.7125),
+    ('Chennai', 13.0827, 80.2707),
+)
+PREFERENCES = ('food', 'history', 'nature', 'adventure', 'shopping', 'nightlife', 'culture', 'beaches')
+BADGES = ('lvl0', 'lvl1', 'lvl2', 'lvl3')
+WORDS = ('trip', 'view', 'river', 'fort', 'market', 'sunset', 'chai', 'trail', 'temple', 'beach', 'train', 'hills')
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def _insert(cursor, conn, query, rows):
+    for start in range(0, len(rows), SEED_CHUNK_ROWS):
+        cursor.executemany(query, rows[start:start + SEED_CHUNK_ROWS])
+        conn.commit()
+
+
+def seed(conn, scale=1.0, seed=42):
+    # The same scale and seed always give the same rows, so results from
+    # different commits are comparable
+    rng = random.Random(seed)
+    volumes = {table: max(1, int(count * scale)) for table, count in SEED_VOLUMES.items()}
+    migrate(conn)
+
+    with conn.cursor() as cursor:
+        _insert(cursor, conn,
+                'INSERT INTO tourists (name, email, pwd, badge, bio) VALUES (%s, %s, %s, %s, %s)',
+                [
+                    (f'Tourist {i}', f'tourist{i}@bench.local', 'x' * 60, rng.choice(BADGES), _sentence(rng, 12))
+                    for i in range(1, volumes['tourists'] + 1)
+                ])
+
+        _insert(cursor, conn,
+                'INSERT INTO posts (created_by, content, loc_link, title) VALUES (%s, %s, %s, %s)',
+                [
+                    (rng.randint(1, volumes['tourists']), _sentence(rng, 60),
+                     'https://maps.google.com/?q=' + rng.choice(CITIES)[0], _sentence(rng, 4))
+                    for _ in range(volumes['posts'])
+                ])
+
+        itineraries = []
+        for _ in range(volumes['itineraries']):
+            source, destination = rng.sample(CITIES, 2)
+            days = rng.randint(2, 10)
+            budget = rng.randrange(5000, 100000, 500)
+            itineraries.append((
+                budget, source[0], destination[0], days,
+                json.dumps(rng.sample(PREFERENCES, 3)),
+                json.dumps(fake_itinerary(1, days, budget)),
+            ))
+        _insert(cursor, conn,
+                'INSERT INTO itineraries (budget, source, destination, days, preferences, itinerary_data) VALUES (%s, %s, %s, %s, %s, %s)',
+                itineraries)
+
+        contacts = []
+        for i in range(volumes['er']):
+            city, lat, lng = rng.choice(CITIES)
+            contacts.append((
+                f'Contact {i}', f'+91{rng.randint(7000000000, 9999999999)}', city, rng.randint(1, volumes['tourists']),
+                round(lat + rng.uniform(-0.2, 0.2), 6), round(lng + rng.uniform(-0.2, 0.2), 6), None,
+            ))
+        _insert(cursor, conn,
+                'INSERT INTO er (name, phno, loc, created_by, latitude, longitude, link) VALUES (%s, %s, %s, %s, %s, %s, %s)',
+                contacts)
+    return volumes
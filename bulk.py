@@ -0,0 +1,202 @@
+import json
+import os
+
+import pymysql
+
+from changes import record_changes
+from storage import upload_path
+
+BULK_MAX_ROWS = int(os.getenv('BULK_MAX_ROWS', 10000))
+BULK_CHUNK_ROWS = int(os.getenv('BULK_CHUNK_ROWS', 500))
+# pymysql splits an executemany() whose SQL would pass max_stmt_length
+# (~1MB) into several statements, and then lastrowid only covers the last
+# one. Chunks stay well under that so each is one multi-row INSERT.
+BULK_CHUNK_BYTES = 256 * 1024
+
+
+def _text(value):
+    return isinstance(value, str) and value.strip() != ''
+
+
+def _coordinate(limit):
+    def check(value):
+        if value is None:
+            return True
+        try:
+            return -limit <= float(value) <= limit
+        except (TypeError, ValueError):
+            return False
+    return check
+
+
+def _upload(value):
+    return value is None or (upload_path(value) is not None and os.path.exists(upload_path(value)))
+
+
+def _creator(value):
+    return isinstance(value, int) or (isinstance(value, str) and value.isdigit())
+
+
+# Column order matches the INSERT; each column has a validator and whether
+# it must be present
+BULK_SPECS = {
+    'er': {
+        'table': 'er',
+        'columns': (
+            ('name', True, _text),
+            ('phno', True, _text),
+            ('loc', True, _text),
+            ('created_by', True, _creator),
+            ('latitude', False, _coordinate(90)),
+            ('longitude', False, _coordinate(180)),
+            ('link', False, lambda v: v is None or isinstance(v, str)),
+        ),
+    },
+    'posts': {
+        'table': 'posts',
+        'columns': (
+            ('created_by', True, _creator),
+            ('content', True, _text),
+            ('loc_link', True, _text),
+            ('title', True, _text),
+            # Bulk imports carry no files; they may point at existing uploads
+            ('image_url', False, _upload),
+        ),
+    },
+}
+
+
+def read_bulk_rows(request):
+    # NDJSON bodies are read line by line so large imports are never held
+    # as one JSON document. Yields (row or None, error or None).
+    if request.mimetype == 'application/x-ndjson':
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line), None
+            except ValueError:
+                yield None, 'Invalid JSON'
+        return
+
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('rows')
+    if not isinstance(data, list):
+        raise ValueError('Body must be a JSON array, {"rows": [...]}, or NDJSON')
+    for row in data:
+        yield row, None
+
+
+def validate_rows(resource, rows):
+    # Returns (valid, results): valid holds (index, values) tuples ready for
+    # the INSERT and results has one entry per input row
+    spec = BULK_SPECS[resource]
+    valid = []
+    results = []
+    for index, (row, error) in enumerate(rows):
+        if index >= BULK_MAX_ROWS:
+            raise ValueError(f'At most {BULK_MAX_ROWS} rows per request')
+        if error is None and not isinstance(row, dict):
+            error = 'Row must be an object'
+        if error is None:
+            missing = [name for name, required, _ in spec['columns'] if required and name not in row]
+            invalid = [name for name, _, check in spec['columns'] if name in row and not check(row[name])]
+            if missing:
+                error = f'Missing required fields: {", ".join(missing)}'
+            elif invalid:
+                error = f'Invalid fields: {", ".join(invalid)}'
+        if error:
+            results.append({'index': index, 'status': 'error', 'error': error})
+            continue
+        valid.append((index, tuple(row.get(name) for name, _, _ in spec['columns'])))
+        results.append({'index': index, 'status': 'pending'})
+    return valid, results
+
+
+def check_creators(cursor, valid, results, creator_position):
+    # One lookup for every distinct created_by instead of an FK failure
+    # taking down a whole chunk
+    creators = {int(values[creator_position]) for _, values in valid}
+    if not creators:
+        return valid
+    cursor.execute(*build_creator_check_query(creators))
+    existing = {row['id'] for row in cursor.fetchall()}
+    kept = []
+    for index, values in valid:
+        if int(values[creator_position]) in existing:
+            kept.append((index, values))
+        else:
+            results[index] = {'index': index, 'status': 'error', 'error': 'Invalid created_by ID'}
+    return kept
+
+
+def build_creator_check_query(creators):
+    placeholders = ', '.join(['%s'] * len(creators))
+    return f'SELECT id FROM tourists WHERE id IN ({placeholders})', list(creators)
+
+
+def chunked(valid):
+    chunk = []
+    size = 0
+    for item in valid:
+        row_size = sum(len(str(v)) * 2 + 4 for v in item[1])
+        if chunk and (len(chunk) >= BULK_CHUNK_ROWS or size + row_size > BULK_CHUNK_BYTES):
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(item)
+        size += row_size
+    if chunk:
+        yield chunk
+
+
+def id_step(cursor):
+    # A multi-row INSERT gets ids lastrowid, lastrowid + step, ... only when
+    # InnoDB reserves them for the whole statement at once. Interleaved lock
+    # mode (2, the MySQL 8 default) makes no such promise, so there each row
+    # is inserted on its own and reports its id. Returns None in that case.
+    try:
+        cursor.execute('SELECT @@auto_increment_increment AS step, @@innodb_autoinc_lock_mode AS lock_mode')
+        row = cursor.fetchone()
+    except pymysql.err.MySQLError:
+        return None
+    if row['lock_mode'] is None or int(row['lock_mode']) == 2:
+        return None
+    return int(row['step'])
+
+
+def insert_chunk(cursor, query, chunk, step):
+    if step is not None:
+        cursor.executemany(query, [values for _, values in chunk])
+        return list(range(cursor.lastrowid, cursor.lastrowid + step * len(chunk), step))
+    ids = []
+    for _, values in chunk:
+        cursor.execute(query, values)
+        ids.append(cursor.lastrowid)
+    return ids
+
+
+def insert_rows(conn, resource, valid, results):
+    spec = BULK_SPECS[resource]
+    names = [name for name, _, _ in spec['columns']]
+    query = f"INSERT INTO {spec['table']} ({', '.join(names)}) VALUES ({', '.join(['%s'] * len(names))})"
+    created = []
+    with conn.cursor() as cursor:
+        valid = check_creators(cursor, valid, results, names.index('created_by'))
+        step = id_step(cursor)
+        for chunk in chunked(valid):
+            try:
+                ids = insert_chunk(cursor, query, chunk, step)
+                record_changes(cursor, resource, ids)
+                conn.commit()
+            except pymysql.err.MySQLError as e:
+                conn.rollback()
+                for index, _ in chunk:
+                    results[index] = {'index': index, 'status': 'error', 'error': str(e)}
+                continue
+            for (index, _), row_id in zip(chunk, ids):
+                results[index] = {'index': index, 'status': 'created', 'id': row_id}
+            created.extend(ids)
+    return created
@@ -0,0 +1,184 @@
+import hashlib
+import os
+import threading
+
+from db import get_db_conn
+from listing import LIST_QUERIES, build_rows_query
+
+CHANGES_MAX_DELTA = int(os.getenv('CHANGES_MAX_DELTA', 1000))
+
+# Collections whose rows embed data from other tables also change version
+# when those tables change (e.g. posts carry the creator's name)
+VERSION_SOURCES = {
+    'tourists': ('tourists',),
+    'posts': ('posts', 'tourists'),
+    'itineraries': ('itineraries',),
+    'er': ('er', 'tourists'),
+}
+
+# For those collections, the column that references a changed row of the
+# other table; its rows are sent again in deltas
+DEPENDENT_KEYS = {
+    'posts': {'tourists': 'p.created_by'},
+    'er': {'tourists': 'e.created_by'},
+}
+
+CREATE_CHANGES_TABLE = '''
+    CREATE TABLE IF NOT EXISTS changes (
+        seq BIGINT AUTO_INCREMENT PRIMARY KEY,
+        resource VARCHAR(32) NOT NULL,
+        row_id INT NULL,
+        op ENUM('upsert', 'delete', 'reset') NOT NULL,
+        changed_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_changes_resource_seq (resource, seq)
+    )
+'''
+
+# seq comes from this counter rather than AUTO_INCREMENT: the UPDATE holds
+# the row lock until the writer commits, so seqs become visible in order
+# and a reader that has seen seq n has seen every change before it
+CREATE_CHANGE_CLOCK_TABLE = '''
+    CREATE TABLE IF NOT EXISTS change_clock (
+        id TINYINT PRIMARY KEY,
+        seq BIGINT NOT NULL
+    )
+'''
+SEED_CHANGE_CLOCK = 'INSERT IGNORE INTO change_clock (id, seq) SELECT 1, COALESCE(MAX(seq), 0) FROM changes'
+NEXT_SEQ_QUERY = 'UPDATE change_clock SET seq = LAST_INSERT_ID(seq + %s) WHERE id = 1'
+
+RECORD_CHANGE_QUERY = 'INSERT INTO changes (seq, resource, row_id, op) VALUES (%s, %s, %s, %s)'
+
+_table_ready = False
+_table_lock = threading.Lock()
+
+
+def create_tables(cursor):
+    cursor.execute(CREATE_CHANGES_TABLE)
+    cursor.execute(CREATE_CHANGE_CLOCK_TABLE)
+    cursor.execute(SEED_CHANGE_CLOCK)
+
+
+def ensure_table():
+    # DDL commits implicitly in MySQL, so it runs on its own connection
+    # rather than inside the caller's transaction
+    global _table_ready
+    if _table_ready:
+        return
+    with _table_lock:
+        if _table_ready:
+            return
+        conn = get_db_conn()
+        try:
+            with conn.cursor() as cursor:
+                create_tables(cursor)
+            conn.commit()
+        finally:
+            conn.close()
+        _table_ready = True
+
+
+def record_change(cursor, resource, row_id, op='upsert'):
+    # Call inside the writing transaction, as late as possible: the change
+    # commits with the row, and other writers wait on the clock until then
+    record_changes(cursor, resource, [row_id], op)
+
+
+def record_changes(cursor, resource, row_ids, op='upsert'):
+    if not row_ids:
+        return
+    ensure_table()
+    cursor.execute(NEXT_SEQ_QUERY, (len(row_ids),))
+    first = cursor.lastrowid - len(row_ids) + 1
+    cursor.executemany(RECORD_CHANGE_QUERY, [
+        (first + offset, resource, row_id, op) for offset, row_id in enumerate(row_ids)
+    ])
+
+
+def parse_since(args):
+    since = args.get('since')
+    if since is None or since == '':
+        return None
+    try:
+        since = int(since)
+    except ValueError:
+        raise ValueError('since must be a cursor returned by a previous response')
+    if since < 0:
+        raise ValueError('since must be a cursor returned by a previous response')
+    return since
+
+
+def build_version_query(resource):
+    sources = VERSION_SOURCES[resource]
+    placeholders = ', '.join(['%s'] * len(sources))
+    return f'SELECT MAX(seq) AS version FROM changes WHERE resource IN ({placeholders})', list(sources)
+
+
+def build_changes_since_query(resource, since, limit):
+    sources = VERSION_SOURCES[resource]
+    placeholders = ', '.join(['%s'] * len(sources))
+    query = (f'SELECT seq, resource, row_id, op FROM changes '
+             f'WHERE resource IN ({placeholders}) AND seq > %s ORDER BY seq LIMIT %s')
+    return query, [*sources, since, limit]
+
+
+def collection_version(cursor, resource):
+    ensure_table()
+    cursor.execute(*build_version_query(resource))
+    row = cursor.fetchone()
+    return (row and row['version']) or 0
+
+
+def collection_etag(resource, version, query_string):
+    digest = hashlib.sha1(f'{resource}:{version}:'.encode('utf-8') + query_string).hexdigest()
+    return f'{resource}-{digest[:20]}'
+
+
+def changes_since(cursor, resource, since, fields, version):
+    cursor.execute(*build_changes_since_query(resource, since, CHANGES_MAX_DELTA + 1))
+    changes = cursor.fetchall()
+
+    # Too far behind, or a bulk write that was not tracked row by row:
+    # the client has to refetch the collection
+    if len(changes) > CHANGES_MAX_DELTA or any(c['op'] == 'reset' for c in changes):
+        return {'status': 'success', 'reset': True, 'count': 0, 'data': [], 'deleted': [], 'cursor': version}
+
+    latest = {}
+    referenced = {}
+    for change in changes:
+        if change['resource'] == resource:
+            latest[change['row_id']] = change['op']
+        else:
+            referenced.setdefault(change['resource'], set()).add(change['row_id'])
+    upserted = [row_id for row_id, op in latest.items() if op == 'upsert']
+    deleted = [row_id for row_id, op in latest.items() if op == 'delete']
+
+    rows = []
+    if upserted:
+        cursor.execute(*build_rows_query(resource, fields, upserted))
+        rows = list(cursor.fetchall())
+        # A row can be gone without a tombstone yet (e.g. cascaded delete)
+        found = {row['id'] for row in rows}
+        deleted.extend(row_id for row_id in upserted if row_id not in found)
+
+    # Rows that embed a changed row of another table, e.g. a renamed
+    # tourist's posts
+    sent = {row['id'] for row in rows} | set(deleted)
+    for source, row_ids in referenced.items():
+        cursor.execute(*build_rows_query(resource, fields, sorted(row_ids), DEPENDENT_KEYS[resource][source]))
+        for row in cursor.fetchall():
+            if row['id'] not in sent:
+                sent.add(row['id'])
+                rows.append(row)
+    if len(rows) > CHANGES_MAX_DELTA:
+        return {'status': 'success', 'reset': True, 'count': 0, 'data': [], 'deleted': [], 'cursor': version}
+    if referenced:
+        rows.sort(key=lambda row: row['id'], reverse=LIST_QUERIES[resource]['order'] == 'DESC')
+
+    return {
+        'status': 'success',
+        'reset': False,
+        'count': len(rows),
+        'data': rows,
+        'deleted': sorted(deleted),
+        'cursor': max([version] + [c['seq'] for c in changes])
+    }
@@ -0,0 +1,244 @@
+import os
+import threading
+import time
+from collections import deque
+
+import pymysql
+
+from metrics import TimedDictCursor, timed
+
+# Environment overrides let benchmarks and local runs point elsewhere
+db_config = {
+    "host":os.getenv('DB_HOST', 'bgs-bgsh.k.aivencloud.com'),
+    "port":int(os.getenv('DB_PORT', 24154)),
+    "user":os.getenv('DB_USER', 'avnadmin'),
+    "password":os.getenv('DB_PASSWORD', 'AVNS_ztTkfwsSwhkcf8H4sf7'),
+    "database":os.getenv('DB_NAME', 'defaultdb'),
+    "ssl":{'ssl': {}} if os.getenv('DB_SSL', '1') == '1' else None,
+    "cursorclass": TimedDictCursor
+}
+
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 10))
+DB_POOL_MAX_IDLE = float(os.getenv('DB_POOL_MAX_IDLE', 300))
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', 1800))
+DB_POOL_PING_AFTER = float(os.getenv('DB_POOL_PING_AFTER', 30))
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PooledConnection:
+    """Checked-out connection; close() hands it back to the pool."""
+
+    def __init__(self, pool, conn, created_at):
+        self._pool = pool
+        self._conn = conn
+        self._created_at = created_at
+        self._checked_out_at = time.monotonic()
+
+    def __getattr__(self, name):
+        conn = self.__dict__.get('_conn')
+        if conn is None:
+            raise pymysql.err.InterfaceError('Connection already returned to pool')
+        return getattr(conn, name)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn, self._created_at, self._checked_out_at)
+
+    def discard(self):
+        conn, self._conn = self._conn, None
+        if conn is not None:
+            self._pool.release(conn, self._created_at, self._checked_out_at, discard=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ConnectionPool:
+    def __init__(self, connect, max_size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT,
+                 max_idle=DB_POOL_MAX_IDLE, max_lifetime=DB_POOL_MAX_LIFETIME,
+                 ping_after=DB_POOL_PING_AFTER):
+        self._connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.max_lifetime = max_lifetime
+        self.ping_after = ping_after
+
+        self._cond = threading.Condition()
+        # (conn, created_at, last_used); most recently used on the right
+        self._idle = deque()
+        self._size = 0
+        self._waiting = 0
+        self._stats = {
+            'checkouts': 0,
+            'created': 0,
+            'recycled': 0,
+            'ping_failures': 0,
+            'reaped': 0,
+            'timeouts': 0,
+            'wait_time_total': 0.0,
+            'wait_time_max': 0.0,
+            'hold_time_total': 0.0,
+            'hold_time_max': 0.0,
+        }
+
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        stale = []
+        with self._cond:
+            stale.extend(self._reap_locked(start))
+            while True:
+                if self._idle:
+                    entry = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    entry = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats['timeouts'] += 1
+                    raise PoolTimeout(f'No database connection available after {self.timeout}s')
+                self._waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+        self._close_all(stale)
+
+        try:
+            if entry is None:
+                conn, created_at = self._new_connection()
+            else:
+                conn, created_at = self._validate(*entry)
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._stats['checkouts'] += 1
+            self._stats['wait_time_total'] += waited
+            self._stats['wait_time_max'] = max(self._stats['wait_time_max'], waited)
+        return PooledConnection(self, conn, created_at)
+
+    def release(self, conn, created_at, checked_out_at, discard=False):
+        now = time.monotonic()
+        if not discard:
+            try:
+                # Never hand a connection with an open transaction to the next request
+                conn.rollback()
+            except Exception:
+                discard = True
+        expired = not discard and now - created_at > self.max_lifetime
+        discard = discard or expired
+
+        held = now - checked_out_at
+        with self._cond:
+            if expired:
+                self._stats['recycled'] += 1
+            self._stats['hold_time_total'] += held
+            self._stats['hold_time_max'] = max(self._stats['hold_time_max'], held)
+            if discard:
+                self._size -= 1
+            else:
+                self._idle.append((conn, created_at, now))
+            self._cond.notify()
+        if discard:
+            self._close_all([conn])
+
+    def close(self):
+        with self._cond:
+            stale = [conn for conn, _, _ in self._idle]
+            self._size -= len(stale)
+            self._idle.clear()
+            self._cond.notify_all()
+        self._close_all(stale)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'waiting': self._waiting,
+            })
+        checkouts = stats['checkouts']
+        stats['wait_time_avg'] = stats['wait_time_total'] / checkouts if checkouts else 0.0
+        stats['hold_time_avg'] = stats['hold_time_total'] / checkouts if checkouts else 0.0
+        return stats
+
+    def _new_connection(self):
+        conn = self._connect()
+        with self._cond:
+            self._stats['created'] += 1
+        return conn, time.monotonic()
+
+    def _validate(self, conn, created_at, last_used):
+        now = time.monotonic()
+        if now - created_at > self.max_lifetime:
+            self._close_all([conn])
+            with self._cond:
+                self._stats['recycled'] += 1
+            return self._new_connection()
+        if now - last_used > self.ping_after:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                self._close_all([conn])
+                with self._cond:
+                    self._stats['ping_failures'] += 1
+                return self._new_connection()
+        return conn, created_at
+
+    def _reap_locked(self, now):
+        stale = []
+        # Oldest idle connections sit on the left
+        while self._idle and now - self._idle[0][2] > self.max_idle:
+            stale.append(self._idle.popleft()[0])
+        self._size -= len(stale)
+        self._stats['reaped'] += len(stale)
+        return stale
+
+    @staticmethod
+    def _close_all(conns):
+        for conn in conns:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    # One pool per worker process; a pool inherited across fork is discarded
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = ConnectionPool(lambda: pymysql.connect(**db_config))
+                _pool_pid = pid
+    return _pool
+
+
+def get_db_conn():
+    with timed('db_checkout'):
+        return get_pool().acquire()
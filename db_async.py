@@ -0,0 +1,74 @@
+import os
+import ssl
+
+import aiomysql
+
+from db import db_config
+
+ASYNC_DB_POOL_MIN = int(os.getenv('ASYNC_DB_POOL_MIN', 1))
+ASYNC_DB_POOL_MAX = int(os.getenv('ASYNC_DB_POOL_MAX', 20))
+# Idle connections older than this are replaced on checkout
+ASYNC_DB_POOL_RECYCLE = float(os.getenv('ASYNC_DB_POOL_RECYCLE', 1800))
+
+
+def _ssl_context():
+    # Same as pymysql with ssl={'ssl': {}}: encrypted, certificate unchecked
+    if not db_config['ssl']:
+        return None
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
+class AsyncDB:
+    """aiomysql pool with the same settings as db.py, for asgi.py."""
+
+    def __init__(self, minsize=ASYNC_DB_POOL_MIN, maxsize=ASYNC_DB_POOL_MAX, recycle=ASYNC_DB_POOL_RECYCLE):
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.recycle = recycle
+        self._pool = None
+
+    async def start(self):
+        self._pool = await aiomysql.create_pool(
+            host=db_config['host'],
+            port=db_config['port'],
+            user=db_config['user'],
+            password=db_config['password'],
+            db=db_config['database'],
+            ssl=_ssl_context(),
+            minsize=self.minsize,
+            maxsize=self.maxsize,
+            pool_recycle=self.recycle,
+            # Pool.release closes connections left inside a transaction, so
+            # reads must not open one; writes commit explicitly
+            autocommit=True,
+            cursorclass=aiomysql.DictCursor,
+        )
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+    def acquire(self):
+        return self._pool.acquire()
+
+    async def fetchone(self, query, args=None):
+        async with self._pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(query, args)
+                return await cursor.fetchone()
+
+    async def fetchall(self, query, args=None):
+        async with self._pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(query, args)
+                return await cursor.fetchall()
+
+    def stats(self):
+        if self._pool is None:
+            return {'size': 0, 'idle': 0, 'max_size': self.maxsize}
+        return {'size': self._pool.size, 'idle': self._pool.freesize, 'max_size': self._pool.maxsize}
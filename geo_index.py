@@ -0,0 +1,169 @@
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+GEO_CELL_DEG = float(os.getenv('GEO_CELL_DEG', 0.05))
+GEO_INDEX_REFRESH = float(os.getenv('GEO_INDEX_REFRESH', 300))
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEG_LAT = 111320.0
+
+
+def haversine_m(lat, lng, lats, lngs):
+    lat1 = math.radians(lat)
+    lats = np.radians(lats)
+    dlat = lats - lat1
+    dlng = np.radians(lngs) - math.radians(lng)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lats) * np.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GeoIndex:
+    """Grid-bucketed in-memory copy of rows with latitude/longitude.
+
+    Rows are loaded with `loader` on first use and every `refresh_interval`
+    seconds; write handlers keep it current in between with upsert/remove.
+    One thread reloads at a time while the others keep reading the old
+    rows, and writes made during a reload are applied again on top of it.
+    """
+
+    def __init__(self, loader, cell_deg=GEO_CELL_DEG, refresh_interval=GEO_INDEX_REFRESH):
+        self.loader = loader
+        self.cell_deg = cell_deg
+        self.refresh_interval = refresh_interval
+        self._cells = {}
+        self._rows = {}
+        self._points = {}
+        self._loaded_at = None
+        self._lock = threading.RLock()
+        self._reload_lock = threading.Lock()
+        # Writes seen while a reload is loading rows, or None
+        self._journal = None
+
+    def _cell(self, lat, lng):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lng / self.cell_deg))
+
+    @staticmethod
+    def _coords(row):
+        try:
+            lat = float(row['latitude'])
+            lng = float(row['longitude'])
+        except (KeyError, TypeError, ValueError):
+            return None
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            return None
+        return lat, lng
+
+    def upsert(self, row):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((self._upsert_locked, row))
+            self._upsert_locked(row)
+
+    def remove(self, row_id):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.append((self._remove_locked, row_id))
+            self._remove_locked(row_id)
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def reload(self):
+        with self._reload_lock:
+            self._reload_locked()
+
+    def _expired(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_interval
+
+    def _reload_locked(self):
+        with self._lock:
+            self._journal = []
+        try:
+            rows = self.loader()
+        except BaseException:
+            with self._lock:
+                self._journal = None
+            raise
+        with self._lock:
+            journal, self._journal = self._journal, None
+            self._cells = {}
+            self._rows = {}
+            self._points = {}
+            for row in rows:
+                self._upsert_locked(row)
+            # The loaded rows may predate these writes
+            for apply, value in journal:
+                apply(value)
+            self._loaded_at = time.monotonic()
+
+    def nearest(self, lat, lng, radius_m, k):
+        if self._expired():
+            # Only wait for a reload when there is nothing loaded to serve
+            if self._reload_lock.acquire(blocking=self._loaded_at is None):
+                try:
+                    if self._expired():
+                        self._reload_locked()
+                finally:
+                    self._reload_lock.release()
+
+        lat_span = radius_m / METERS_PER_DEG_LAT
+        lng_span = radius_m / (METERS_PER_DEG_LAT * max(math.cos(math.radians(lat)), 0.01))
+        min_cell = self._cell(max(lat - lat_span, -90), lng - lng_span)
+        max_cell = self._cell(min(lat + lat_span, 90), lng + lng_span)
+
+        with self._lock:
+            wanted = (max_cell[0] - min_cell[0] + 1) * (max_cell[1] - min_cell[1] + 1)
+            # Large radii and searches across the antimeridian just scan everything
+            if wanted > len(self._cells) or abs(lng) + lng_span > 180:
+                candidates = list(self._points)
+            else:
+                candidates = []
+                for cell_lat in range(min_cell[0], max_cell[0] + 1):
+                    for cell_lng in range(min_cell[1], max_cell[1] + 1):
+                        candidates.extend(self._cells.get((cell_lat, cell_lng), ()))
+            if not candidates:
+                return []
+            points = np.array([self._points[row_id] for row_id in candidates], dtype=np.float64)
+            rows = [self._rows[row_id] for row_id in candidates]
+
+        distances = haversine_m(lat, lng, points[:, 0], points[:, 1])
+        within = np.flatnonzero(distances <= radius_m)
+        if len(within) > k:
+            within = within[np.argpartition(distances[within], k - 1)[:k]]
+        within = within[np.argsort(distances[within])]
+        return [dict(rows[i], distance_m=round(float(distances[i]), 1)) for i in within]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'rows': len(self._rows),
+                'cells': len(self._cells),
+                'cell_deg': self.cell_deg,
+                'loaded': self._loaded_at is not None,
+            }
+
+    def _upsert_locked(self, row):
+        self._remove_locked(row['id'])
+        coords = self._coords(row)
+        if coords is None:
+            return
+        self._rows[row['id']] = row
+        self._points[row['id']] = coords
+        self._cells.setdefault(self._cell(*coords), set()).add(row['id'])
+
+    def _remove_locked(self, row_id):
+        coords = self._points.pop(row_id, None)
+        self._rows.pop(row_id, None)
+        if coords is None:
+            return
+        cell = self._cell(*coords)
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(row_id)
+            if not members:
+                del self._cells[cell]
@@ -0,0 +1,147 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+
+IMAGE_VARIANT_WORKERS = int(os.getenv('IMAGE_VARIANT_WORKERS', 2))
+IMAGE_VARIANT_FORMAT = os.getenv('IMAGE_VARIANT_FORMAT', 'webp')
+IMAGE_VARIANT_QUALITY = int(os.getenv('IMAGE_VARIANT_QUALITY', 80))
+# Sources that could not be decoded, remembered so they are not retried on
+# every request; the oldest are forgotten first
+IMAGE_VARIANT_FAILED_MAX = int(os.getenv('IMAGE_VARIANT_FAILED_MAX', 10000))
+
+# Longest edge in pixels; images are only ever scaled down
+VARIANTS = {
+    'thumb': 160,
+    'medium': 640,
+    'full': 1600,
+}
+
+# Image columns and the key their variant URLs are returned under
+IMAGE_COLUMNS = {
+    'profile_image': 'profile_image_variants',
+    'background_image': 'background_image_variants',
+    'image_url': 'image_variants',
+}
+
+
+def variant_name(filename, variant):
+    return f'{filename}.{variant}.{IMAGE_VARIANT_FORMAT}'
+
+
+def original_name(filename):
+    # Inverse of variant_name; None if `filename` is not a variant
+    for variant in VARIANTS:
+        suffix = f'.{variant}.{IMAGE_VARIANT_FORMAT}'
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return None
+
+
+def variant_urls(url):
+    if not url:
+        return None
+    base, filename = url.rsplit('/', 1)
+    return {variant: f'{base}/{variant_name(filename, variant)}' for variant in VARIANTS}
+
+
+def add_variant_urls(row):
+    for column, key in IMAGE_COLUMNS.items():
+        if column in row:
+            row[key] = variant_urls(row[column])
+    return row
+
+
+def variant_paths(path):
+    folder, filename = os.path.split(path)
+    return [os.path.join(folder, variant_name(filename, variant)) for variant in VARIANTS]
+
+
+def remove_variants(path):
+    freed = 0
+    for variant_path in variant_paths(path):
+        if os.path.exists(variant_path):
+            freed += os.path.getsize(variant_path)
+            os.remove(variant_path)
+    return freed
+
+
+def generate_variants(path):
+    folder, filename = os.path.split(path)
+    with Image.open(path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+        for variant, size in VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            target = os.path.join(folder, variant_name(filename, variant))
+            # Written under a temporary name so a half-written variant is never served
+            tmp = f'{target}.tmp'
+            resized.save(tmp, format=IMAGE_VARIANT_FORMAT, quality=IMAGE_VARIANT_QUALITY, method=4)
+            os.replace(tmp, target)
+
+
+class ImageVariants:
+    """Builds the size variants of uploaded images on a small thread pool."""
+
+    def __init__(self, workers=IMAGE_VARIANT_WORKERS, failed_max=IMAGE_VARIANT_FAILED_MAX):
+        self.workers = workers
+        self.failed_max = failed_max
+        self._executor = None
+        self._pid = None
+        self._pending = {}
+        # path -> mtime of the source that failed; a replaced file is tried again
+        self._failed = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'submitted': 0, 'generated': 0, 'failed': 0, 'skipped_failed': 0}
+
+    def submit(self, path):
+        # Returns None without queueing when this source already failed
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            mtime = None
+        with self._lock:
+            if path in self._pending:
+                return self._pending[path]
+            if mtime is not None and self._failed.get(path) == mtime:
+                self._stats['skipped_failed'] += 1
+                return None
+            if self._pid != os.getpid():
+                # Thread pools do not survive a fork
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='image-variants')
+                self._pid = os.getpid()
+            future = self._executor.submit(self._generate, path, mtime)
+            self._pending[path] = future
+            self._stats['submitted'] += 1
+        return future
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['pending'] = len(self._pending)
+            stats['failed_sources'] = len(self._failed)
+        return stats
+
+    def _generate(self, path, mtime):
+        result = 'failed'
+        try:
+            generate_variants(path)
+            result = 'generated'
+        except Exception as e:
+            # Pillow raises more than OSError for corrupt input
+            print(f"Could not build variants for {path}: {e}")
+        finally:
+            with self._lock:
+                self._pending.pop(path, None)
+                self._stats[result] += 1
+                if result == 'failed' and mtime is not None:
+                    self._failed[path] = mtime
+                    self._failed.move_to_end(path)
+                    while len(self._failed) > self.failed_max:
+                        self._failed.popitem(last=False)
+                else:
+                    self._failed.pop(path, None)
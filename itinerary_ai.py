@@ -0,0 +1,569 @@
+import asyncio
+import json
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+from changes import NEXT_SEQ_QUERY, RECORD_CHANGE_QUERY, record_change
+from db import get_db_conn
+from itinerary_repair import RepairStats, contiguous_ranges, salvage_days, tolerant_json_loads
+from json_stream import IncrementalObjectParser
+from listing import LOOKUP_QUERIES
+from metrics import llm_tokens, record_upstream
+
+ITINERARY_MODEL = os.getenv('ITINERARY_MODEL', 'gpt-4')
+ITINERARY_MAX_TOKENS = int(os.getenv('ITINERARY_MAX_TOKENS', 3000))
+# Trips longer than ITINERARY_FANOUT_MIN_DAYS are generated as concurrent
+# ITINERARY_CHUNK_DAYS-day chunks and merged
+ITINERARY_FANOUT_MIN_DAYS = int(os.getenv('ITINERARY_FANOUT_MIN_DAYS', 5))
+ITINERARY_CHUNK_DAYS = int(os.getenv('ITINERARY_CHUNK_DAYS', 3))
+ITINERARY_FANOUT_WORKERS = int(os.getenv('ITINERARY_FANOUT_WORKERS', 4))
+
+# Salvage truncated/almost-valid responses instead of failing the request
+ITINERARY_REPAIR = os.getenv('ITINERARY_REPAIR', '1') == '1'
+ITINERARY_REPAIR_MODEL = os.getenv('ITINERARY_REPAIR_MODEL', 'gpt-3.5-turbo')
+
+BUDGET_CATEGORIES = ('transportation', 'accommodation', 'activities', 'food', 'miscellaneous')
+LIST_SECTIONS = ('restaurant_recommendations', 'transportation_details', 'local_tips', 'cultural_notes')
+
+Completion = namedtuple('Completion', ['content', 'tokens', 'seconds'])
+
+repair_stats = RepairStats()
+
+SYSTEM_PROMPT = "You are a professional travel planner with expertise in creating detailed itineraries. You must respond with valid JSON only, with no additional text. You must include activities for all days of the trip."
+
+
+class ItineraryError(Exception):
+    def __init__(self, message, details=None, raw_response=None):
+        super().__init__(message)
+        self.details = details
+        self.raw_response = raw_response
+
+    def to_dict(self):
+        result = {'error': str(self)}
+        if self.details is not None:
+            result['details'] = self.details
+        if self.raw_response is not None:
+            result['raw_response'] = self.raw_response
+        return result
+
+
+TRIP_FIELDS = ('budget', 'source', 'destination', 'days', 'preferences')
+
+
+def parse_trip(data):
+    return {
+        'budget': float(data['budget']),
+        'source': data['source'],
+        'destination': data['destination'],
+        'days': int(data['days']),
+        'preferences': data['preferences'],
+    }
+
+
+def build_itinerary_prompt(trip):
+    budget = trip['budget']
+    source = trip['source']
+    destination = trip['destination']
+    days = trip['days']
+    preferences = trip['preferences']
+
+    prompt = f"""Create a detailed {days}-day travel itinerary from {source} to {destination} with a budget of ₹{budget}.
+    Preferences: {', '.join(preferences)}.
+    
+    IMPORTANT REQUIREMENTS:
+    1. You MUST create activities for ALL {days} days of the trip
+    2. Each day must have at least 3-4 activities
+    3. Activities should be spread throughout the day (morning, afternoon, evening)
+    4. Include realistic time slots and durations
+    5. Ensure the total cost stays within the budget of ₹{budget}
+    
+    Include in your response:
+    1. Daily schedule with time slots for ALL days
+    2. Cost estimates for each activity
+    3. Transportation details
+    4. Restaurant recommendations
+    5. Must-see attractions
+    6. Budget breakdown
+    7. Local tips and cultural notes
+    8. Emergency contacts and important numbers
+    
+    Your response MUST be a valid JSON object with the following structure:
+    {{
+        "summary": "Brief overview of the trip",
+        "budget_breakdown": {{
+            "total": {budget},
+            "categories": [
+                {{"category": "transportation", "amount": 0, "percentage": 0}},
+                {{"category": "accommodation", "amount": 0, "percentage": 0}},
+                {{"category": "activities", "amount": 0, "percentage": 0}},
+                {{"category": "food", "amount": 0, "percentage": 0}},
+                {{"category": "miscellaneous", "amount": 0, "percentage": 0}}
+            ]
+        }},
+        "daily_itinerary": [
+            {{"day": 1, "activities": []}},
+            {{"day": 2, "activities": []}},
+            {{"day": 3, "activities": []}}
+        ],
+        "restaurant_recommendations": [],
+        "transportation_details": [],
+        "emergency_info": {{
+            "police": "number",
+            "ambulance": "number",
+            "fire": "number",
+            "embassy": "address and number",
+            "hospital": "address and number"
+        }},
+        "local_tips": [],
+        "cultural_notes": []
+    }}
+    
+    IMPORTANT: 
+    1. You MUST include activities for ALL {days} days in the daily_itinerary array
+    2. Each day must have at least 3-4 activities
+    3. Do not include any text before or after the JSON object
+    4. The response must be valid JSON that can be parsed directly"""
+    return prompt
+
+
+def build_chunk_prompt(trip, first_day, last_day, chunk_budget):
+    budget = trip['budget']
+    source = trip['source']
+    destination = trip['destination']
+    days = trip['days']
+    preferences = trip['preferences']
+    chunk_days = last_day - first_day + 1
+    day_entries = ',\n'.join(f'            {{"day": {day}, "activities": []}}' for day in range(first_day, last_day + 1))
+
+    if first_day == 1:
+        position = f"This part starts the trip, so day {first_day} includes travel from {source}."
+    elif last_day == days:
+        position = f"This part ends the trip, so day {last_day} includes the return to {source}."
+    else:
+        position = f"The traveller is already in {destination} at the start of day {first_day}."
+
+    prompt = f"""You are planning part of a {days}-day trip from {source} to {destination} with a total budget of ₹{budget}.
+    Preferences: {', '.join(preferences)}.
+
+    Plan ONLY days {first_day} to {last_day} ({chunk_days} days). {position}
+    The budget allocated to these days is ₹{chunk_budget:.0f}.
+
+    IMPORTANT REQUIREMENTS:
+    1. You MUST create activities for ALL of days {first_day} to {last_day}, numbered {first_day} to {last_day}
+    2. Each day must have at least 3-4 activities
+    3. Activities should be spread throughout the day (morning, afternoon, evening)
+    4. Include realistic time slots and durations
+    5. Ensure the cost of these days stays within ₹{chunk_budget:.0f}
+
+    Your response MUST be a valid JSON object with the following structure:
+    {{
+        "summary": "Brief overview of these days",
+        "budget_breakdown": {{
+            "total": {chunk_budget:.0f},
+            "categories": [
+                {{"category": "transportation", "amount": 0, "percentage": 0}},
+                {{"category": "accommodation", "amount": 0, "percentage": 0}},
+                {{"category": "activities", "amount": 0, "percentage": 0}},
+                {{"category": "food", "amount": 0, "percentage": 0}},
+                {{"category": "miscellaneous", "amount": 0, "percentage": 0}}
+            ]
+        }},
+        "daily_itinerary": [
+{day_entries}
+        ],
+        "restaurant_recommendations": [],
+        "transportation_details": [],
+        "emergency_info": {{
+            "police": "number",
+            "ambulance": "number",
+            "fire": "number",
+            "embassy": "address and number",
+            "hospital": "address and number"
+        }},
+        "local_tips": [],
+        "cultural_notes": []
+    }}
+
+    IMPORTANT:
+    1. The daily_itinerary array must contain exactly {chunk_days} days
+    2. Do not include any text before or after the JSON object
+    3. The response must be valid JSON that can be parsed directly"""
+    return prompt
+
+
+def split_days(days, chunk_days=ITINERARY_CHUNK_DAYS):
+    return [(first, min(first + chunk_days - 1, days)) for first in range(1, days + 1, chunk_days)]
+
+
+def merge_itinerary_chunks(trip, chunks):
+    merged = {
+        'summary': ' '.join(c['summary'] for c in chunks if c.get('summary')),
+        'budget_breakdown': {'total': trip['budget'], 'categories': []},
+        'daily_itinerary': [],
+        'emergency_info': next((c['emergency_info'] for c in chunks if c.get('emergency_info')), {}),
+    }
+
+    day = 1
+    for chunk in chunks:
+        # Renumber by position in case a chunk restarted its numbering at 1
+        for entry in chunk.get('daily_itinerary', []):
+            merged['daily_itinerary'].append(dict(entry, day=day))
+            day += 1
+
+    amounts = {}
+    for chunk in chunks:
+        for category in chunk.get('budget_breakdown', {}).get('categories', []):
+            name = category.get('category')
+            try:
+                amounts[name] = amounts.get(name, 0) + float(category.get('amount') or 0)
+            except (TypeError, ValueError):
+                continue
+    spent = sum(amounts.values())
+    for name in list(BUDGET_CATEGORIES) + [n for n in amounts if n not in BUDGET_CATEGORIES]:
+        amount = amounts.get(name, 0)
+        merged['budget_breakdown']['categories'].append({
+            'category': name,
+            'amount': round(amount, 2),
+            'percentage': round(amount * 100 / spent, 1) if spent else 0
+        })
+
+    for section in LIST_SECTIONS:
+        seen = set()
+        merged[section] = []
+        for chunk in chunks:
+            for item in chunk.get(section) or []:
+                marker = json.dumps(item, sort_keys=True)
+                if marker not in seen:
+                    seen.add(marker)
+                    merged[section].append(item)
+    return merged
+
+
+def completion_params(prompt, model=ITINERARY_MODEL, system_prompt=SYSTEM_PROMPT, max_tokens=ITINERARY_MAX_TOKENS):
+    return {
+        'model': model,
+        'messages': [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ],
+        'temperature': 0.5,
+        'max_tokens': max_tokens
+    }
+
+
+def completion_result(model, response, seconds):
+    usage = response.get('usage') or {}
+    record_upstream('openai', model, seconds)
+    llm_tokens.inc(usage.get('prompt_tokens', 0), model, 'prompt')
+    llm_tokens.inc(usage.get('completion_tokens', 0), model, 'completion')
+    return Completion(
+        response['choices'][0]['message']['content'].strip(),
+        usage.get('total_tokens', 0),
+        seconds
+    )
+
+
+def request_completion(prompt, model=ITINERARY_MODEL, system_prompt=SYSTEM_PROMPT, max_tokens=ITINERARY_MAX_TOKENS):
+    started = time.monotonic()
+    response = openai.ChatCompletion.create(**completion_params(prompt, model, system_prompt, max_tokens))
+    return completion_result(model, response, time.monotonic() - started)
+
+
+def stream_completion(prompt):
+    started = time.monotonic()
+    response = openai.ChatCompletion.create(**completion_params(prompt), stream=True)
+    try:
+        for chunk in response:
+            content = chunk.choices[0].delta.get('content')
+            if content:
+                yield content
+    finally:
+        # Streamed responses carry no usage block, so only latency is recorded
+        record_upstream('openai', ITINERARY_MODEL, time.monotonic() - started)
+
+
+def parse_itinerary_response(response_content, days):
+    if response_content.startswith("```json"):
+        response_content = response_content[7:]
+    if response_content.endswith("```"):
+        response_content = response_content[:-3]
+    response_content = response_content.strip()
+
+    try:
+        itinerary = json.loads(response_content)
+    except json.JSONDecodeError as e:
+        print("JSON Parse Error:", str(e))
+        print("Raw AI Response:", response_content)
+        raise ItineraryError('Failed to parse AI response as JSON', details=str(e), raw_response=response_content)
+
+    daily = itinerary.get('daily_itinerary') if isinstance(itinerary, dict) else None
+    received = len(daily) if isinstance(daily, list) else 0
+    if received != days:
+        print(f"Error: Expected {days} days but got {received} days")
+        raise ItineraryError(
+            f'Incomplete itinerary: Expected {days} days but got {received} days',
+            raw_response=response_content
+        )
+    return itinerary
+
+
+def chunk_budget(trip, first_day, last_day):
+    return trip['budget'] * (last_day - first_day + 1) / trip['days']
+
+
+def generate_itinerary_chunk(trip, first_day, last_day):
+    print(f"Sending prompt to OpenAI for days {first_day}-{last_day}...")
+    prompt = build_chunk_prompt(trip, first_day, last_day, chunk_budget(trip, first_day, last_day))
+    return parse_or_repair(trip, first_day, last_day, request_completion(prompt))
+
+
+def parse_or_repair(trip, first_day, last_day, completion):
+    try:
+        return parse_itinerary_response(completion.content, last_day - first_day + 1)
+    except ItineraryError as e:
+        if not ITINERARY_REPAIR:
+            raise
+        return repair_itinerary(trip, first_day, last_day, completion, e)
+
+
+def repair_itinerary(trip, first_day, last_day, completion, error):
+    started = time.monotonic()
+    tokens_spent = 0
+    fixup_calls = 0
+    repair_stats.record(attempted=1)
+
+    try:
+        itinerary = tolerant_json_loads(completion.content)
+    except ValueError:
+        # Cheap targeted fix-up rather than a full regeneration
+        print("Asking OpenAI to fix malformed itinerary JSON...")
+        fixup = request_completion(
+            f"Fix the following so it is one valid JSON object. Keep all content, drop any text outside the object.\n\n{completion.content}",
+            model=ITINERARY_REPAIR_MODEL,
+            system_prompt="You repair malformed JSON. Respond with the corrected JSON only."
+        )
+        fixup_calls += 1
+        tokens_spent += fixup.tokens
+        try:
+            itinerary = tolerant_json_loads(fixup.content)
+        except ValueError:
+            repair_stats.record(failed=1, fixup_calls=fixup_calls)
+            raise error
+
+    if not isinstance(itinerary, dict):
+        repair_stats.record(failed=1, fixup_calls=fixup_calls)
+        raise error
+
+    days = salvage_days(itinerary, first_day, last_day)
+    salvaged = len(days)
+    missing = [day for day in range(first_day, last_day + 1) if day not in days]
+    if missing:
+        print(f"Salvaged {salvaged} days, requesting missing days {missing}")
+    for missing_first, missing_last in contiguous_ranges(missing):
+        prompt = build_chunk_prompt(trip, missing_first, missing_last, chunk_budget(trip, missing_first, missing_last))
+        part_completion = request_completion(prompt)
+        tokens_spent += part_completion.tokens
+        try:
+            part = parse_itinerary_response(part_completion.content, missing_last - missing_first + 1)
+        except ItineraryError:
+            repair_stats.record(failed=1, fixup_calls=fixup_calls)
+            raise error
+        for offset, entry in enumerate(part['daily_itinerary']):
+            days[missing_first + offset] = dict(entry, day=missing_first + offset)
+
+    itinerary['daily_itinerary'] = [days[day] for day in range(first_day, last_day + 1)]
+    # A full regeneration would have cost roughly what the original call did
+    repair_stats.record(
+        repaired=1,
+        fixup_calls=fixup_calls,
+        days_salvaged=salvaged,
+        days_regenerated=len(missing),
+        tokens_saved=max(completion.tokens - tokens_spent, 0),
+        seconds_saved=max(completion.seconds - (time.monotonic() - started), 0.0)
+    )
+    return itinerary
+
+
+def generate_itinerary_fanout(trip):
+    ranges = split_days(trip['days'])
+    with ThreadPoolExecutor(max_workers=min(ITINERARY_FANOUT_WORKERS, len(ranges))) as executor:
+        futures = [executor.submit(generate_itinerary_chunk, trip, first, last) for first, last in ranges]
+        chunks = [future.result() for future in futures]
+    return merge_itinerary_chunks(trip, chunks)
+
+
+def generate_itinerary(trip):
+    print(f"Received request: {trip['days']} days from {trip['source']} to {trip['destination']} with budget {trip['budget']}")
+    if trip['days'] > ITINERARY_FANOUT_MIN_DAYS:
+        return generate_itinerary_fanout(trip)
+    prompt = build_itinerary_prompt(trip)
+    print("Sending prompt to OpenAI...")
+    return parse_or_repair(trip, 1, trip['days'], request_completion(prompt))
+
+
+def stream_itinerary(trip):
+    # Yields the same events as IncrementalObjectParser while the model is
+    # still writing, then ('itinerary', None, <validated itinerary>)
+    print(f"Streaming request: {trip['days']} days from {trip['source']} to {trip['destination']} with budget {trip['budget']}")
+    started = time.monotonic()
+    parser = IncrementalObjectParser(item_keys=('daily_itinerary',))
+    for content in stream_completion(build_itinerary_prompt(trip)):
+        for event in parser.feed(content):
+            yield event
+    # Streamed responses carry no usage block; ~4 characters per token
+    completion = Completion(parser.text.strip(), len(parser.text) // 4, time.monotonic() - started)
+    yield 'itinerary', None, parse_or_repair(trip, 1, trip['days'], completion)
+
+
+# Async versions of the OpenAI calls for asgi.py. They talk to the same
+# endpoint through an httpx.AsyncClient, so a waiting completion holds no
+# thread. Repairs and fixups are rare and still run the sync path on a
+# worker thread.
+
+def _openai_request(client, params):
+    return client.build_request(
+        'POST',
+        f'{openai.api_base}/chat/completions',
+        json=params,
+        headers={'Authorization': f'Bearer {openai.api_key}'}
+    )
+
+
+async def arequest_completion(client, prompt, model=ITINERARY_MODEL, system_prompt=SYSTEM_PROMPT,
+                              max_tokens=ITINERARY_MAX_TOKENS):
+    started = time.monotonic()
+    response = await client.send(_openai_request(client, completion_params(prompt, model, system_prompt, max_tokens)))
+    response.raise_for_status()
+    return completion_result(model, response.json(), time.monotonic() - started)
+
+
+async def astream_completion(client, prompt):
+    started = time.monotonic()
+    response = await client.send(_openai_request(client, dict(completion_params(prompt), stream=True)), stream=True)
+    try:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.startswith('data:'):
+                continue
+            payload = line[5:].strip()
+            if payload == '[DONE]':
+                break
+            content = json.loads(payload)['choices'][0]['delta'].get('content')
+            if content:
+                yield content
+    finally:
+        await response.aclose()
+        record_upstream('openai', ITINERARY_MODEL, time.monotonic() - started)
+
+
+async def aparse_or_repair(trip, first_day, last_day, completion):
+    try:
+        return parse_itinerary_response(completion.content, last_day - first_day + 1)
+    except ItineraryError as e:
+        if not ITINERARY_REPAIR:
+            raise
+        return await asyncio.to_thread(repair_itinerary, trip, first_day, last_day, completion, e)
+
+
+async def agenerate_itinerary_chunk(client, trip, first_day, last_day):
+    print(f"Sending prompt to OpenAI for days {first_day}-{last_day}...")
+    prompt = build_chunk_prompt(trip, first_day, last_day, chunk_budget(trip, first_day, last_day))
+    return await aparse_or_repair(trip, first_day, last_day, await arequest_completion(client, prompt))
+
+
+async def agenerate_itinerary(client, trip):
+    print(f"Received request: {trip['days']} days from {trip['source']} to {trip['destination']} with budget {trip['budget']}")
+    if trip['days'] > ITINERARY_FANOUT_MIN_DAYS:
+        # Same per-request cap as the thread pool in generate_itinerary_fanout
+        limit = asyncio.Semaphore(ITINERARY_FANOUT_WORKERS)
+
+        async def chunk(first, last):
+            async with limit:
+                return await agenerate_itinerary_chunk(client, trip, first, last)
+
+        chunks = await asyncio.gather(*(chunk(first, last) for first, last in split_days(trip['days'])))
+        return merge_itinerary_chunks(trip, chunks)
+    prompt = build_itinerary_prompt(trip)
+    print("Sending prompt to OpenAI...")
+    return await aparse_or_repair(trip, 1, trip['days'], await arequest_completion(client, prompt))
+
+
+async def astream_itinerary(client, trip):
+    print(f"Streaming request: {trip['days']} days from {trip['source']} to {trip['destination']} with budget {trip['budget']}")
+    started = time.monotonic()
+    parser = IncrementalObjectParser(item_keys=('daily_itinerary',))
+    async for content in astream_completion(client, build_itinerary_prompt(trip)):
+        for event in parser.feed(content):
+            yield event
+    completion = Completion(parser.text.strip(), len(parser.text) // 4, time.monotonic() - started)
+    yield 'itinerary', None, await aparse_or_repair(trip, 1, trip['days'], completion)
+
+
+def load_itinerary(itinerary_id):
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(LOOKUP_QUERIES['itinerary plan'], (itinerary_id,))
+            return cursor.fetchone()
+    finally:
+        conn.close()
+
+
+def adapt_itinerary(trip, stored_budget, stored_days, itinerary):
+    # Light-touch reuse of a near-duplicate: trim or extend the days and scale
+    # the budget figures, without regenerating the whole plan
+    itinerary = json.loads(json.dumps(itinerary))
+    daily = itinerary.get('daily_itinerary') or []
+    if stored_days > trip['days']:
+        daily = daily[:trip['days']]
+    elif stored_days < trip['days']:
+        extra = generate_itinerary_chunk(trip, stored_days + 1, trip['days'])
+        daily = daily + extra['daily_itinerary']
+    itinerary['daily_itinerary'] = [dict(entry, day=day) for day, entry in enumerate(daily, start=1)]
+
+    breakdown = itinerary.get('budget_breakdown')
+    if isinstance(breakdown, dict) and stored_budget:
+        ratio = trip['budget'] / stored_budget
+        for category in breakdown.get('categories') or []:
+            if isinstance(category.get('amount'), (int, float)):
+                category['amount'] = round(category['amount'] * ratio, 2)
+        breakdown['total'] = trip['budget']
+    return itinerary
+
+
+def store_itinerary(trip, itinerary):
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                'INSERT INTO itineraries (budget, source, destination, days, preferences, itinerary_data) VALUES (%s, %s, %s, %s, %s, %s)',
+                (trip['budget'], trip['source'], trip['destination'], trip['days'], json.dumps(trip['preferences']), json.dumps(itinerary))
+            )
+            itinerary_id = cursor.lastrowid
+            record_change(cursor, 'itineraries', itinerary_id)
+            conn.commit()
+    finally:
+        conn.close()
+    return itinerary_id
+
+
+async def astore_itinerary(db, trip, itinerary):
+    # The changes table is created at startup, see asgi.py
+    async with db.acquire() as conn:
+        # The pool runs in autocommit, so the row and its change are
+        # grouped explicitly
+        await conn.begin()
+        async with conn.cursor() as cursor:
+            await cursor.execute(
+                'INSERT INTO itineraries (budget, source, destination, days, preferences, itinerary_data) VALUES (%s, %s, %s, %s, %s, %s)',
+                (trip['budget'], trip['source'], trip['destination'], trip['days'], json.dumps(trip['preferences']), json.dumps(itinerary))
+            )
+            itinerary_id = cursor.lastrowid
+            await cursor.execute(NEXT_SEQ_QUERY, (1,))
+            await cursor.execute(RECORD_CHANGE_QUERY, (cursor.lastrowid, 'itineraries', itinerary_id, 'upsert'))
+        await conn.commit()
+    return itinerary_id
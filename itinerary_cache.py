@@ -0,0 +1,160 @@
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from db import get_db_conn
+
+ITINERARY_CACHE_SIZE = int(os.getenv('ITINERARY_CACHE_SIZE', 512))
+ITINERARY_CACHE_TTL = float(os.getenv('ITINERARY_CACHE_TTL', 24 * 3600))
+ITINERARY_CACHE_DB_TTL_DAYS = int(os.getenv('ITINERARY_CACHE_DB_TTL_DAYS', 30))
+# Relative width of a budget bucket: 0.1 puts budgets within ~10% of each other together
+ITINERARY_BUDGET_BUCKET = float(os.getenv('ITINERARY_BUDGET_BUCKET', 0.1))
+
+DB_LOOKUP_QUERY = '''
+    SELECT id, budget, source, destination, days, preferences, itinerary_data
+    FROM itineraries
+    WHERE source = %s AND destination = %s AND days = %s
+        AND budget >= %s AND budget < %s
+        AND created_at >= NOW() - INTERVAL %s DAY
+    ORDER BY id DESC
+    LIMIT 20
+'''
+
+
+def normalize_text(value):
+    return ' '.join(str(value).lower().split())
+
+
+def budget_bucket(budget):
+    if budget <= 0:
+        return 0
+    return int(math.floor(math.log(budget) / math.log1p(ITINERARY_BUDGET_BUCKET)))
+
+
+def bucket_range(bucket):
+    base = 1 + ITINERARY_BUDGET_BUCKET
+    return base ** bucket, base ** (bucket + 1)
+
+
+def normalize_trip(trip):
+    return {
+        'source': normalize_text(trip['source']),
+        'destination': normalize_text(trip['destination']),
+        'days': int(trip['days']),
+        'budget_bucket': budget_bucket(float(trip['budget'])),
+        'preferences': sorted({normalize_text(p) for p in trip['preferences']}),
+    }
+
+
+def cache_key(trip):
+    normalized = json.dumps(normalize_trip(trip), sort_keys=True)
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+
+class ItineraryCache:
+    """In-process LRU/TTL cache backed by previously stored itineraries."""
+
+    def __init__(self, max_entries=ITINERARY_CACHE_SIZE, ttl=ITINERARY_CACHE_TTL,
+                 db_ttl_days=ITINERARY_CACHE_DB_TTL_DAYS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_ttl_days = db_ttl_days
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits': 0,
+            'db_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+        }
+
+    def get(self, trip):
+        found = self._get_memory(trip)
+        if found is None:
+            found = self._record_lookup(trip, self._lookup_db(trip))
+        return found
+
+    async def aget(self, trip, fetchall):
+        # For asgi.py: fetchall is a coroutine function (query, args) -> rows
+        found = self._get_memory(trip)
+        if found is None:
+            rows = await fetchall(DB_LOOKUP_QUERY, self._lookup_params(trip))
+            found = self._record_lookup(trip, self._match(trip, rows))
+        return found
+
+    def put(self, trip, itinerary_id, itinerary):
+        key = cache_key(trip)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, itinerary_id, itinerary)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['size'] = len(self._entries)
+            stats['max_entries'] = self.max_entries
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        stats['hit_ratio'] = (stats['memory_hits'] + stats['db_hits']) / lookups if lookups else 0.0
+        return stats
+
+    def _get_memory(self, trip):
+        key = cache_key(trip)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, itinerary_id, itinerary = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return itinerary_id, itinerary
+                del self._entries[key]
+                self._stats['expirations'] += 1
+        return None
+
+    def _record_lookup(self, trip, found):
+        with self._lock:
+            if found is None:
+                self._stats['misses'] += 1
+                return None
+            self._stats['db_hits'] += 1
+        self.put(trip, *found)
+        return found
+
+    def _lookup_params(self, trip):
+        normalized = normalize_trip(trip)
+        low, high = bucket_range(normalized['budget_bucket'])
+        return (trip['source'].strip(), trip['destination'].strip(), normalized['days'], low, high, self.db_ttl_days)
+
+    def _lookup_db(self, trip):
+        conn = get_db_conn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(DB_LOOKUP_QUERY, self._lookup_params(trip))
+                candidates = cursor.fetchall()
+        finally:
+            conn.close()
+        return self._match(trip, candidates)
+
+    @staticmethod
+    def _match(trip, candidates):
+        normalized = normalize_trip(trip)
+        for row in candidates:
+            stored = {
+                'source': row['source'],
+                'destination': row['destination'],
+                'days': row['days'],
+                'budget': float(row['budget']),
+                'preferences': json.loads(row['preferences']),
+            }
+            if normalize_trip(stored) == normalized:
+                return row['id'], json.loads(row['itinerary_data'])
+        return None
@@ -0,0 +1,207 @@
+import json
+import math
+import os
+import threading
+import time
+
+import numpy as np
+
+from db import get_db_conn
+from itinerary_cache import normalize_text
+
+ITINERARY_SIMILARITY_THRESHOLD = float(os.getenv('ITINERARY_SIMILARITY_THRESHOLD', 0.85))
+ITINERARY_SIMILARITY_MAX_DAY_DELTA = int(os.getenv('ITINERARY_SIMILARITY_MAX_DAY_DELTA', 1))
+ITINERARY_INDEX_REFRESH = float(os.getenv('ITINERARY_INDEX_REFRESH', 60))
+
+# Budget similarity decays with the log-ratio of the two budgets
+BUDGET_SCALE = 0.5
+WEIGHTS = {'days': 0.3, 'budget': 0.3, 'preferences': 0.4}
+LOAD_BATCH = 5000
+REFRESH_QUERY = 'SELECT id, source, destination, days, budget, preferences FROM itineraries WHERE id > %s ORDER BY id LIMIT %s'
+
+
+class _RouteGroup:
+    # Rows for one (source, destination) pair, with numpy views rebuilt lazily
+    def __init__(self):
+        self.ids = []
+        self.days = []
+        self.log_budgets = []
+        self.preferences = []
+        self._arrays = None
+
+    def add(self, itinerary_id, days, log_budget, preferences):
+        self.ids.append(itinerary_id)
+        self.days.append(days)
+        self.log_budgets.append(log_budget)
+        self.preferences.append(preferences)
+        self._arrays = None
+
+    def arrays(self, vocab_size):
+        if self._arrays is None or self._arrays[3].shape[1] != vocab_size:
+            matrix = np.zeros((len(self.ids), vocab_size), dtype=np.float32)
+            for row, prefs in enumerate(self.preferences):
+                matrix[row, list(prefs)] = 1.0
+            self._arrays = (
+                np.array(self.ids, dtype=np.int64),
+                np.array(self.days, dtype=np.float32),
+                np.array(self.log_budgets, dtype=np.float32),
+                matrix,
+                matrix.sum(axis=1),
+            )
+        return self._arrays
+
+
+class ItineraryIndex:
+    """Nearest stored itinerary for the same route, scored on days, budget and preferences.
+
+    The stored rows are loaded by a background thread started with start(),
+    and find() matches nothing until that load finishes. After that, one
+    caller at a time pulls in newer rows every `refresh_interval` seconds
+    while the others keep matching against what is already loaded.
+    """
+
+    def __init__(self, threshold=ITINERARY_SIMILARITY_THRESHOLD,
+                 max_day_delta=ITINERARY_SIMILARITY_MAX_DAY_DELTA,
+                 refresh_interval=ITINERARY_INDEX_REFRESH):
+        self.threshold = threshold
+        self.max_day_delta = max_day_delta
+        self.refresh_interval = refresh_interval
+        self._groups = {}
+        self._vocab = {}
+        self._known = set()
+        self._max_id = 0
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._loader = None
+        self._loader_pid = None
+        # A failed load is retried after refresh_interval
+        self._retry_at = 0.0
+        self._stats = {'queries': 0, 'matches': 0, 'indexed': 0}
+
+    def add(self, itinerary_id, trip):
+        with self._lock:
+            self._add_locked(itinerary_id, trip)
+
+    def start(self):
+        # Per worker process, like the other background threads
+        with self._lock:
+            if self._refreshed_at is not None or time.monotonic() < self._retry_at:
+                return
+            if self._loader_pid == os.getpid() and self._loader.is_alive():
+                return
+            self._loader = threading.Thread(target=self._initial_load, name='itinerary-index-load', daemon=True)
+            self._loader.start()
+            self._loader_pid = os.getpid()
+
+    def find(self, trip):
+        if self._refreshed_at is None:
+            self.start()
+        elif self._expired() and self._refresh_lock.acquire(blocking=False):
+            try:
+                if self._expired():
+                    self._refresh_locked()
+            finally:
+                self._refresh_lock.release()
+
+        key = (normalize_text(trip['source']), normalize_text(trip['destination']))
+        with self._lock:
+            self._stats['queries'] += 1
+            group = self._groups.get(key)
+            if group is None:
+                return None
+            ids, days, log_budgets, prefs, pref_sizes = group.arrays(len(self._vocab))
+            query = np.zeros(len(self._vocab), dtype=np.float32)
+            query[[self._vocab[p] for p in self._preference_terms(trip) if p in self._vocab]] = 1.0
+            query_size = float(len(self._preference_terms(trip)))
+
+        day_delta = np.abs(days - trip['days'])
+        # The furthest allowed day count still scores above 0.5
+        day_score = 1.0 - day_delta / (2 * (self.max_day_delta + 1))
+        budget_score = np.exp(-np.abs(log_budgets - math.log(max(trip['budget'], 1.0))) / BUDGET_SCALE)
+        overlap = prefs @ query
+        union = pref_sizes + query_size - overlap
+        pref_score = np.where(union > 0, overlap / np.maximum(union, 1.0), 1.0)
+
+        scores = (WEIGHTS['days'] * day_score + WEIGHTS['budget'] * budget_score
+                  + WEIGHTS['preferences'] * pref_score)
+        scores[day_delta > self.max_day_delta] = -1.0
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+
+        with self._lock:
+            self._stats['matches'] += 1
+        return int(ids[best]), float(scores[best])
+
+    def _expired(self):
+        return time.monotonic() - self._refreshed_at > self.refresh_interval
+
+    def refresh(self):
+        with self._refresh_lock:
+            self._refresh_locked()
+
+    def _initial_load(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            self._retry_at = time.monotonic() + self.refresh_interval
+            print(f"Itinerary index load failed: {e}")
+
+    def _refresh_locked(self):
+        # Pulls rows inserted since the last refresh, including ones written
+        # by other worker processes
+        while True:
+            conn = get_db_conn()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(REFRESH_QUERY, (self._max_id, LOAD_BATCH))
+                    rows = cursor.fetchall()
+            finally:
+                conn.close()
+
+            with self._lock:
+                for row in rows:
+                    self._max_id = max(self._max_id, row['id'])
+                    try:
+                        preferences = json.loads(row['preferences'])
+                    except (TypeError, ValueError):
+                        preferences = []
+                    self._add_locked(row['id'], {
+                        'source': row['source'],
+                        'destination': row['destination'],
+                        'days': row['days'],
+                        'budget': float(row['budget']),
+                        'preferences': preferences,
+                    })
+            if len(rows) < LOAD_BATCH:
+                break
+        self._refreshed_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                'routes': len(self._groups),
+                'vocabulary': len(self._vocab),
+                'threshold': self.threshold,
+                'loaded': self._refreshed_at is not None,
+            })
+        return stats
+
+    @staticmethod
+    def _preference_terms(trip):
+        return {normalize_text(p) for p in trip['preferences']}
+
+    def _add_locked(self, itinerary_id, trip):
+        if itinerary_id in self._known:
+            return
+        self._known.add(itinerary_id)
+        key = (normalize_text(trip['source']), normalize_text(trip['destination']))
+        terms = set()
+        for term in self._preference_terms(trip):
+            terms.add(self._vocab.setdefault(term, len(self._vocab)))
+        self._groups.setdefault(key, _RouteGroup()).add(
+            itinerary_id, int(trip['days']), math.log(max(float(trip['budget']), 1.0)), terms
+        )
+        self._stats['indexed'] += 1
@@ -0,0 +1,106 @@
+import json
+import re
+import threading
+
+FENCE_RE = re.compile(r'```(?:json)?', re.IGNORECASE)
+TRAILING_COMMA_RE = re.compile(r',\s*([}\]])')
+CLOSERS = {'{': '}', '[': ']'}
+
+
+def _extract_object(text, start):
+    # Returns the balanced object starting at `start`. If the text was cut off
+    # (e.g. max_tokens), returns everything up to the last closed container
+    # with the still-open brackets closed, which keeps every finished day.
+    stack = []
+    in_string = False
+    escape = False
+    last_safe = None
+    for pos in range(start, len(text)):
+        ch = text[pos]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in CLOSERS:
+            stack.append(ch)
+        elif ch in '}]':
+            if not stack:
+                break
+            stack.pop()
+            if not stack:
+                return text[start:pos + 1]
+            last_safe = (pos + 1, list(stack))
+    if last_safe is None:
+        raise ValueError('No complete JSON value found')
+    end, open_brackets = last_safe
+    return text[start:end] + ''.join(CLOSERS[b] for b in reversed(open_brackets))
+
+
+def tolerant_json_loads(text):
+    text = FENCE_RE.sub('', text)
+    start = text.find('{')
+    if start == -1:
+        raise ValueError('No JSON object found')
+    candidate = _extract_object(text, start)
+    try:
+        return json.loads(candidate)
+    except ValueError:
+        return json.loads(TRAILING_COMMA_RE.sub(r'\1', candidate))
+
+
+def salvage_days(itinerary, first_day, last_day):
+    # Map usable day entries onto first_day..last_day. Day numbers may be
+    # absolute or restart at 1 within a chunk; anything else is dropped.
+    days = {}
+    entries = itinerary.get('daily_itinerary') if isinstance(itinerary, dict) else None
+    for entry in entries or []:
+        if not isinstance(entry, dict) or not isinstance(entry.get('activities'), list):
+            continue
+        number = entry.get('day')
+        if not isinstance(number, int):
+            continue
+        if not first_day <= number <= last_day:
+            number = first_day + number - 1
+        if first_day <= number <= last_day and number not in days:
+            days[number] = dict(entry, day=number)
+    return days
+
+
+def contiguous_ranges(numbers):
+    ranges = []
+    for number in sorted(numbers):
+        if ranges and ranges[-1][1] == number - 1:
+            ranges[-1][1] = number
+        else:
+            ranges.append([number, number])
+    return [tuple(r) for r in ranges]
+
+
+class RepairStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {
+            'attempted': 0,
+            'repaired': 0,
+            'failed': 0,
+            'fixup_calls': 0,
+            'days_salvaged': 0,
+            'days_regenerated': 0,
+            'tokens_saved': 0,
+            'seconds_saved': 0.0,
+        }
+
+    def record(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self._stats[name] += value
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
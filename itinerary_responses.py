@@ -0,0 +1,102 @@
+"""Response bodies and SSE framing shared by the itinerary routes in
+server.py and their native versions in asgi.py, so both serve the same
+statuses and bodies."""
+import json
+import traceback
+
+from admission import Rejected
+from itinerary_ai import ItineraryError
+from jobs import QueueFull
+from singleflight import SingleFlightTimeout
+
+
+def created_body(itinerary_id, itinerary, cached):
+    return {
+        'status': 'success',
+        'id': itinerary_id,
+        'data': itinerary,
+        'cached': cached
+    }
+
+
+def accepted_job(job):
+    # (body, headers) for a job submitted with ?async=1
+    status_url = f"/itinerary/jobs/{job['id']}"
+    return {
+        'status': 'accepted',
+        'job_id': job['id'],
+        'status_url': status_url
+    }, {'Location': status_url}
+
+
+def error_response(e):
+    # (body, status, headers) for an exception from POST /itinerary
+    if isinstance(e, Rejected):
+        return {'error': str(e)}, e.status, e.headers()
+    if isinstance(e, QueueFull):
+        return {'error': str(e)}, 503, {'Retry-After': '5'}
+    if isinstance(e, ItineraryError):
+        return e.to_dict(), 500, None
+    if isinstance(e, SingleFlightTimeout):
+        return {'error': str(e)}, 504, None
+    if isinstance(e, ValueError):
+        print("ValueError:", str(e))
+        return {'error': f'Invalid input: {str(e)}'}, 400, None
+    print("Unexpected Error:", str(e))
+    print("Error type:", type(e).__name__)
+    # Called from the route's except block
+    print("Traceback:", traceback.format_exc())
+    return {'error': str(e)}, 500, None
+
+
+def itinerary_events(itinerary):
+    # Replays a finished itinerary as the events stream_itinerary yields
+    for day in itinerary.get('daily_itinerary', []):
+        yield 'item', 'daily_itinerary', day
+    for key, value in itinerary.items():
+        if key != 'daily_itinerary':
+            yield 'field', key, value
+    yield 'itinerary', None, itinerary
+
+
+class ItineraryEventStream:
+    """Frames itinerary events as Server-Sent Events.
+
+    Days go out as `day` events and other fields as `section` events while
+    the model writes; the final ('itinerary', None, <itinerary>) event is
+    kept in `itinerary` rather than sent.
+    """
+
+    def __init__(self, dumps):
+        self.dumps = dumps
+        self.itinerary = None
+        self._sent_days = set()
+
+    def frame(self, event, data):
+        return f"event: {event}\ndata: {self.dumps(data)}\n\n"
+
+    def on_event(self, kind, key, value):
+        # The frame to send for an event, or None
+        if kind == 'item':
+            self._sent_days.add(json.dumps(value, sort_keys=True))
+            return self.frame('day', value)
+        if kind == 'field':
+            return self.frame('section', {'key': key, 'value': value})
+        self.itinerary = value
+        return None
+
+    def unsent_days(self):
+        # Days filled in by the repair stage were never streamed
+        return [
+            self.frame('day', day) for day in self.itinerary['daily_itinerary']
+            if json.dumps(day, sort_keys=True) not in self._sent_days
+        ]
+
+    def done(self, itinerary_id, cached):
+        return self.frame('done', {'id': itinerary_id, 'cached': cached})
+
+    def error(self, e):
+        if isinstance(e, ItineraryError):
+            return self.frame('error', e.to_dict())
+        print("Unexpected Error:", str(e))
+        return self.frame('error', {'error': str(e)})
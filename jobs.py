@@ -0,0 +1,126 @@
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+
+ITINERARY_WORKERS = int(os.getenv('ITINERARY_WORKERS', 4))
+ITINERARY_QUEUE_DEPTH = int(os.getenv('ITINERARY_QUEUE_DEPTH', 32))
+ITINERARY_JOB_RETENTION = float(os.getenv('ITINERARY_JOB_RETENTION', 3600))
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobQueue:
+    """Bounded in-process job queue drained by a fixed pool of worker threads.
+
+    Job state lives in this process only, so deployments with several worker
+    processes need sticky routing for the status endpoint.
+    """
+
+    def __init__(self, handler, workers=ITINERARY_WORKERS, max_depth=ITINERARY_QUEUE_DEPTH,
+                 retention=ITINERARY_JOB_RETENTION):
+        self.handler = handler
+        self.workers = workers
+        self.max_depth = max_depth
+        self.retention = retention
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self._stats = {'submitted': 0, 'rejected': 0, 'done': 0, 'failed': 0}
+
+    def submit(self, payload):
+        self._ensure_workers()
+        self._prune()
+        job = {
+            'id': uuid.uuid4().hex,
+            'state': 'queued',
+            'created_at': time.time(),
+            'started_at': None,
+            'finished_at': None,
+            'result': None,
+            'error': None,
+        }
+        with self._lock:
+            self._jobs[job['id']] = job
+        try:
+            self._queue.put_nowait((job['id'], payload))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job['id']]
+                self._stats['rejected'] += 1
+            raise QueueFull(f'Job queue is full ({self.max_depth} pending)')
+        with self._lock:
+            self._stats['submitted'] += 1
+        return dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            states = [job['state'] for job in self._jobs.values()]
+        stats.update({
+            'workers': self.workers,
+            'max_depth': self.max_depth,
+            'queued': states.count('queued'),
+            'running': states.count('running'),
+            'tracked': len(states),
+        })
+        return stats
+
+    def _ensure_workers(self):
+        # Threads do not survive fork, so each worker process starts its own
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        with self._lock:
+            if self._pid == pid:
+                return
+            self._threads = [
+                threading.Thread(target=self._run, name=f'job-worker-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            self._pid = pid
+
+    def _run(self):
+        while True:
+            job_id, payload = self._queue.get()
+            self._update(job_id, state='running', started_at=time.time())
+            try:
+                result = self.handler(payload)
+                self._update(job_id, state='done', finished_at=time.time(), result=result)
+                outcome = 'done'
+            except Exception as e:
+                print(f"Job {job_id} failed:", traceback.format_exc())
+                error = e.to_dict() if hasattr(e, 'to_dict') else {'error': str(e)}
+                self._update(job_id, state='failed', finished_at=time.time(), error=error)
+                outcome = 'failed'
+            finally:
+                self._queue.task_done()
+            with self._lock:
+                self._stats[outcome] += 1
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                job.update(fields)
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job['finished_at'] and job['finished_at'] < cutoff]
+            for job_id in expired:
+                del self._jobs[job_id]
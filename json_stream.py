@@ -0,0 +1,92 @@
+import json
+
+
+class IncrementalObjectParser:
+    """Emits pieces of a top-level JSON object while its text is still arriving.
+
+    feed() returns ('item', key, value) for every completed element of the
+    arrays named in `item_keys`, and ('field', key, value) for every other
+    top-level member once its value closes. Anything before the opening brace
+    (e.g. a ```json fence) is ignored. If a fragment fails to parse the
+    parser stops emitting and sets `broken`; `text` still holds everything fed.
+    """
+
+    def __init__(self, item_keys=()):
+        self.item_keys = set(item_keys)
+        self.text = ''
+        self._pos = 0
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key = None
+        self._key_start = None
+        self._value_start = None
+        self._item_start = None
+        self.broken = False
+
+    def feed(self, chunk):
+        self.text += chunk
+        events = []
+        if self.broken:
+            return events
+        try:
+            self._scan(events)
+        except ValueError:
+            # Malformed output; stop emitting and leave it to the final parse
+            self.broken = True
+        return events
+
+    def _scan(self, events):
+        text = self.text
+        while self._pos < len(text):
+            pos = self._pos
+            ch = text[pos]
+            self._pos += 1
+
+            if not self._started:
+                if ch == '{':
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == '\\':
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._key_start is not None:
+                        self._key = json.loads(text[self._key_start:pos + 1])
+                        self._key_start = None
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._value_start is None:
+                    self._key_start = pos
+            elif ch == ':' and self._depth == 1:
+                self._value_start = pos + 1
+            elif ch in '{[':
+                self._depth += 1
+                if self._depth == 3 and self._key in self.item_keys:
+                    self._item_start = pos
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 2 and self._item_start is not None:
+                    events.append(('item', self._key, json.loads(text[self._item_start:pos + 1])))
+                    self._item_start = None
+                elif self._depth == 0:
+                    self._close_field(pos, events)
+            elif ch == ',' and self._depth == 1:
+                self._close_field(pos, events)
+
+    def _close_field(self, pos, events):
+        if self._value_start is None:
+            return
+        value = json.loads(self.text[self._value_start:pos])
+        if self._key not in self.item_keys:
+            events.append(('field', self._key, value))
+        self._key = None
+        self._value_start = None
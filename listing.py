@@ -0,0 +1,225 @@
+import json
+import os
+from datetime import datetime
+
+MAX_PAGE_LIMIT = int(os.getenv('MAX_PAGE_LIMIT', 500))
+AUTHOR_PAGE_LIMIT = int(os.getenv('AUTHOR_PAGE_LIMIT', 50))
+
+# Per-resource SQL for the list endpoints. `columns` maps the public field
+# name to its SQL expression so ?fields= is pushed down into the SELECT, and
+# `key` is the indexed column used for keyset pagination.
+LIST_QUERIES = {
+    'tourists': {
+        'columns': {
+            'id': 'id',
+            'name': 'name',
+            'email': 'email',
+            'badge': 'badge',
+            'profile_image': 'profile_image',
+            'background_image': 'background_image',
+            'bio': 'bio',
+        },
+        'from': 'tourists',
+        'key': 'id',
+        'order': 'ASC',
+    },
+    'posts': {
+        'columns': {
+            'id': 'p.id',
+            'created_at': 'p.created_at',
+            'created_by': 'p.created_by',
+            'content': 'p.content',
+            'loc_link': 'p.loc_link',
+            'image_url': 'p.image_url',
+            'title': 'p.title',
+            'creator_name': 't.name',
+        },
+        'from': 'posts p JOIN tourists t ON p.created_by = t.id',
+        'key': 'p.id',
+        'order': 'ASC',
+    },
+    'itineraries': {
+        'columns': {
+            'id': 'id',
+            'budget': 'budget',
+            'source': 'source',
+            'destination': 'destination',
+            'days': 'days',
+            'preferences': 'preferences',
+            'created_at': 'created_at',
+        },
+        'from': 'itineraries',
+        # ids are assigned in insertion order, so this matches the old
+        # ORDER BY created_at DESC without a filesort
+        'key': 'id',
+        'order': 'DESC',
+    },
+    'er': {
+        'columns': {
+            'id': 'e.id',
+            'name': 'e.name',
+            'phno': 'e.phno',
+            'loc': 'e.loc',
+            'latitude': 'e.latitude',
+            'longitude': 'e.longitude',
+            'link': 'e.link',
+            'creator': 't.name',
+        },
+        'from': 'er e JOIN tourists t ON e.created_by = t.id',
+        'key': 'e.id',
+        'order': 'ASC',
+    },
+}
+
+
+# Single-row and per-author lookups the other routes run, all taking one id
+LOOKUP_QUERIES = {
+    'tourist': 'SELECT * FROM tourists WHERE id = %s',
+    'tourist images': 'SELECT profile_image, background_image FROM tourists WHERE id = %s',
+    'posts by author': 'SELECT id, image_url FROM posts WHERE created_by = %s',
+    'contacts by author': 'SELECT id FROM er WHERE created_by = %s',
+    'post': 'SELECT * FROM posts WHERE id = %s',
+    'post image': 'SELECT image_url FROM posts WHERE id = %s',
+    'itinerary': 'SELECT * FROM itineraries WHERE id = %s',
+    'itinerary plan': 'SELECT budget, days, itinerary_data FROM itineraries WHERE id = %s',
+}
+
+
+def parse_fields(resource, args):
+    spec = LIST_QUERIES[resource]
+    if not args.get('fields'):
+        return list(spec['columns'])
+    requested = [f.strip() for f in args['fields'].split(',') if f.strip()]
+    unknown = [f for f in requested if f not in spec['columns']]
+    if unknown:
+        raise ValueError(f'Unknown fields: {", ".join(unknown)}')
+    # id is the pagination cursor, so it is always returned
+    return ['id'] + [f for f in dict.fromkeys(requested) if f != 'id']
+
+
+def parse_limit(args, default=None):
+    limit = args.get('limit')
+    if limit is None or limit == '':
+        return default
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if not 1 <= limit <= MAX_PAGE_LIMIT:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_LIMIT}')
+    return limit
+
+
+def parse_list_args(resource, args):
+    fields = parse_fields(resource, args)
+
+    after = args.get('after')
+    if after is not None and after != '':
+        try:
+            after = int(after)
+        except ValueError:
+            raise ValueError('after must be an integer id')
+    else:
+        after = None
+
+    return fields, after, parse_limit(args)
+
+
+def build_list_query(resource, fields, after=None, limit=None, lookahead=True):
+    spec = LIST_QUERIES[resource]
+    columns = ', '.join(f"{spec['columns'][f]} AS {f}" for f in fields)
+    query = f"SELECT {columns} FROM {spec['from']}"
+    params = []
+    if after is not None:
+        query += f" WHERE {spec['key']} {'<' if spec['order'] == 'DESC' else '>'} %s"
+        params.append(after)
+    query += f" ORDER BY {spec['key']} {spec['order']}"
+    if limit is not None:
+        # One extra row tells page_result whether there is a next page
+        query += ' LIMIT %s'
+        params.append(limit + 1 if lookahead else limit)
+    return query, params
+
+
+def build_author_posts_query(author_id, fields, after=None, limit=AUTHOR_PAGE_LIMIT):
+    # Newest first on (created_at, id), which an index on
+    # posts(created_by, created_at, id) serves without a filesort
+    columns_map = LIST_QUERIES['posts']['columns']
+    if 'created_at' not in fields:
+        fields = fields + ['created_at']
+    columns = ', '.join(f"{columns_map[f]} AS {f}" for f in fields)
+    query = f"SELECT {columns} FROM {LIST_QUERIES['posts']['from']} WHERE p.created_by = %s"
+    params = [author_id]
+    if after is not None:
+        created_at, post_id = after
+        query += ' AND (p.created_at < %s OR (p.created_at = %s AND p.id < %s))'
+        params.extend([created_at, created_at, post_id])
+    query += ' ORDER BY p.created_at DESC, p.id DESC LIMIT %s'
+    params.append(limit + 1)
+    return query, params
+
+
+def encode_post_cursor(post):
+    return f"{post['created_at'].isoformat()}_{post['id']}"
+
+
+def decode_post_cursor(cursor):
+    try:
+        created_at, post_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(post_id)
+    except ValueError:
+        raise ValueError('after must be a cursor returned as next_after')
+
+
+def build_row_query(resource, row_id):
+    spec = LIST_QUERIES[resource]
+    columns = ', '.join(f"{expr} AS {field}" for field, expr in spec['columns'].items())
+    return f"SELECT {columns} FROM {spec['from']} WHERE {spec['key']} = %s", [row_id]
+
+
+def build_rows_query(resource, fields, row_ids, match=None):
+    # match selects on another column instead of the key, e.g. the rows
+    # that reference a set of tourists
+    spec = LIST_QUERIES[resource]
+    columns = ', '.join(f"{spec['columns'][f]} AS {f}" for f in fields)
+    placeholders = ', '.join(['%s'] * len(row_ids))
+    query = f"SELECT {columns} FROM {spec['from']} WHERE {match or spec['key']} IN ({placeholders}) ORDER BY {spec['key']} {spec['order']}"
+    return query, list(row_ids)
+
+
+def page_result(rows, limit):
+    next_after = None
+    if limit is not None and len(rows) > limit:
+        rows = rows[:limit]
+        next_after = rows[-1]['id']
+    return {
+        'status': 'success',
+        'count': len(rows),
+        'data': rows,
+        'next_after': next_after
+    }
+
+
+def serialize_itinerary_summary(itinerary):
+    result = dict(itinerary)
+    if result.get('budget') is not None:
+        result['budget'] = float(result['budget'])
+    if 'preferences' in result:
+        result['preferences'] = json.loads(result['preferences'])
+    if 'created_at' in result:
+        result['created_at'] = result['created_at'].isoformat() if result['created_at'] else None
+    return result
+
+
+def serialize_itinerary(itinerary):
+    # GET /itinerary/<id>, from an itineraries row
+    return {
+        'id': itinerary['id'],
+        'budget': float(itinerary['budget']),
+        'source': itinerary['source'],
+        'destination': itinerary['destination'],
+        'days': itinerary['days'],
+        'preferences': json.loads(itinerary['preferences']),
+        'itinerary': json.loads(itinerary['itinerary_data']),
+        'created_at': itinerary['created_at'].isoformat() if itinerary['created_at'] else None
+    }
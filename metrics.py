@@ -0,0 +1,232 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+import pymysql.cursors
+from flask import g, has_request_context, request
+from flask.json.provider import DefaultJSONProvider
+
+PREFIX = 'roamconnect_'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # Per-bucket counts plus +Inf, then sum
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            snapshot = [(labels, list(counts), total) for labels, (counts, total) in sorted(self._series.items())]
+        for label_values, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(float(bound))
+                labels = _labels(self.labels, label_values, 'le="%s"' % le)
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labels, label_values)} {total}')
+            lines.append(f'{self.name}_count{_labels(self.labels, label_values)} {cumulative}')
+        return lines
+
+
+request_seconds = Histogram('http_request_duration_seconds', 'Time spent in the route handler.', ('method', 'route', 'status'))
+phase_seconds = Histogram('request_phase_seconds', 'Time per request spent in each phase.', ('route', 'phase'))
+upstream_seconds = Histogram('upstream_request_duration_seconds', 'Latency of calls to external APIs.', ('service', 'target'))
+llm_tokens = Counter('llm_tokens_total', 'Tokens used by OpenAI completions.', ('model', 'kind'))
+
+METRICS = (request_seconds, phase_seconds, upstream_seconds, llm_tokens)
+
+# (route, phases) for work outside a Flask request context that still
+# belongs to a request: streamed bodies and the native routes in asgi.py
+_current_phases = contextvars.ContextVar('metrics_phases', default=None)
+
+
+def record(phase, seconds):
+    # Phases add up per request and are observed once it finishes; work on
+    # background threads (jobs, refreshes) is observed as it happens
+    if has_request_context():
+        phases = g.setdefault('metrics_phases', {})
+    elif _current_phases.get() is not None:
+        phases = _current_phases.get()[1]
+    else:
+        phase_seconds.observe(seconds, 'background', phase)
+        return
+    phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def observe_phases(route, phases):
+    for phase, seconds in phases.items():
+        phase_seconds.observe(seconds, route, phase)
+
+
+@contextmanager
+def route_phases(route):
+    # Files phases recorded inside the block under route, observed at the end
+    phases = {}
+    token = _current_phases.set((route, phases))
+    try:
+        yield phases
+    finally:
+        _current_phases.reset(token)
+        observe_phases(route, phases)
+
+
+@contextmanager
+def timed(phase):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(phase, time.perf_counter() - started)
+
+
+def record_upstream(service, target, seconds):
+    # target is the model for OpenAI and the place type for Places
+    upstream_seconds.observe(seconds, service, target or '')
+    record(service, seconds)
+
+
+class TimedDictCursor(pymysql.cursors.DictCursor):
+    # executemany() goes through execute(), so it is covered too
+    def execute(self, query, args=None):
+        with timed('db_execute'):
+            return super().execute(query, args)
+
+    def fetchall(self):
+        with timed('db_fetch'):
+            return super().fetchall()
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        with timed('serialize'):
+            return super().dumps(obj, **kwargs)
+
+
+class StreamPhases:
+    """Wraps a streamed response body so the phases it records while being
+    iterated, after the request context is gone, count for its route."""
+
+    def __init__(self, iterable, route, phases):
+        self._iterable = iterable
+        self._iterator = iter(iterable)
+        self._state = (route, phases)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        token = _current_phases.set(self._state)
+        try:
+            return next(self._iterator)
+        finally:
+            _current_phases.reset(token)
+
+    def close(self):
+        try:
+            close = getattr(self._iterable, 'close', None)
+            if close is not None:
+                close()
+        finally:
+            observe_phases(*self._state)
+
+
+def init_app(app):
+    app.json = TimedJSONProvider(app)
+
+    @app.before_request
+    def start_request_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def note_response(response):
+        g.metrics_status = response.status_code
+        # direct_passthrough bodies are files for wsgi.file_wrapper, which a
+        # wrapper would hide from sendfile()
+        if response.is_streamed and not response.direct_passthrough and 'metrics_started' in g:
+            # The body runs after teardown; its phases and the handler's are
+            # observed together once it is closed
+            response.response = StreamPhases(response.response, _route(), g.pop('metrics_phases', {}))
+        return response
+
+    @app.teardown_request
+    def observe_request(exc):
+        # Here rather than in after_request, which is skipped when the
+        # handler raises
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        status = 500 if exc is not None else g.pop('metrics_status', 500)
+        route = _route()
+        request_seconds.observe(time.perf_counter() - started, request.method, route, str(status))
+        observe_phases(route, g.pop('metrics_phases', {}))
+
+
+def _route():
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+
+def render(stats_sources=None):
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+
+    # Counters and gauges the components already keep, read at scrape time
+    if stats_sources:
+        name = PREFIX + 'component_stat'
+        lines.append(f'# HELP {name} Numeric values from the /stats endpoints.')
+        lines.append(f'# TYPE {name} gauge')
+        for component, stats in stats_sources.items():
+            for stat, value in sorted(stats().items()):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    lines.append(f'{name}{_labels(("component", "stat"), (component, stat))} {value}')
+    return '\n'.join(lines) + '\n'
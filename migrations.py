@@ -0,0 +1,261 @@
+import argparse
+import os
+import sys
+
+from dotenv import load_dotenv
+
+# Settings are read at import time, see server.py
+load_dotenv()
+
+from changes import (  # noqa: E402
+    CHANGES_MAX_DELTA, CREATE_CHANGE_CLOCK_TABLE, CREATE_CHANGES_TABLE, DEPENDENT_KEYS, SEED_CHANGE_CLOCK,
+    build_changes_since_query, build_version_query
+)
+from db import get_db_conn  # noqa: E402
+from bulk import build_creator_check_query  # noqa: E402
+from itinerary_cache import DB_LOOKUP_QUERY  # noqa: E402
+from itinerary_index import LOAD_BATCH, REFRESH_QUERY  # noqa: E402
+from listing import (  # noqa: E402
+    LIST_QUERIES, LOOKUP_QUERIES, build_author_posts_query, build_list_query, build_row_query, build_rows_query
+)
+from storage import build_count_references_query, build_referenced_urls_query  # noqa: E402
+
+# EXPLAIN rows above which a full table scan fails the check
+EXPLAIN_MIN_ROWS = int(os.getenv('EXPLAIN_MIN_ROWS', 1000))
+
+MIGRATION_LOCK_NAME = 'roamconnect_migrate'
+
+CREATE_MIGRATIONS_TABLE = '''
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT PRIMARY KEY,
+        description VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+'''
+
+# The tables as server.py uses them. IF NOT EXISTS keeps this a no-op on
+# databases that were created by hand before migrations existed.
+BASE_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS tourists (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        email VARCHAR(255) NOT NULL UNIQUE,
+        pwd VARCHAR(255) NOT NULL,
+        badge ENUM('lvl0', 'lvl1', 'lvl2', 'lvl3') NOT NULL DEFAULT 'lvl0',
+        profile_image VARCHAR(255) NULL,
+        background_image VARCHAR(255) NULL,
+        bio TEXT NULL
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS posts (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        created_by INT NOT NULL,
+        content TEXT NOT NULL,
+        loc_link VARCHAR(512) NOT NULL,
+        image_url VARCHAR(255) NULL,
+        title VARCHAR(255) NOT NULL,
+        FOREIGN KEY (created_by) REFERENCES tourists(id) ON DELETE CASCADE
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS itineraries (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        budget DECIMAL(12, 2) NOT NULL,
+        source VARCHAR(255) NOT NULL,
+        destination VARCHAR(255) NOT NULL,
+        days INT NOT NULL,
+        preferences TEXT NOT NULL,
+        itinerary_data LONGTEXT NOT NULL,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS er (
+        id INT AUTO_INCREMENT PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        phno VARCHAR(32) NOT NULL,
+        loc VARCHAR(255) NOT NULL,
+        created_by INT NOT NULL,
+        latitude DECIMAL(9, 6) NULL,
+        longitude DECIMAL(9, 6) NULL,
+        link VARCHAR(512) NULL,
+        FOREIGN KEY (created_by) REFERENCES tourists(id) ON DELETE CASCADE
+    )
+    ''',
+]
+
+# (table, index name, column list). Prefix lengths keep the URL and route
+# columns indexable whether they are VARCHAR or TEXT in an older database.
+ROUTE_INDEXES = [
+    # GET /tourists/<id>/posts: keyset on (created_at, id) per author
+    ('posts', 'idx_posts_author_created', 'created_by, created_at, id'),
+    # Upload reference counts and the orphan sweep
+    ('posts', 'idx_posts_image_url', 'image_url(191)'),
+    ('tourists', 'idx_tourists_profile_image', 'profile_image(191)'),
+    ('tourists', 'idx_tourists_background_image', 'background_image(191)'),
+    # Itinerary cache lookups by route, day count and budget bucket
+    ('itineraries', 'idx_itineraries_route', 'source(100), destination(100), days, budget'),
+    ('itineraries', 'idx_itineraries_created_at', 'created_at'),
+]
+
+
+def index_exists(cursor, table, name):
+    cursor.execute(
+        '''
+        SELECT 1 FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s
+        LIMIT 1
+        ''',
+        (table, name)
+    )
+    return cursor.fetchone() is not None
+
+
+def ensure_index(cursor, table, name, columns):
+    # MySQL has no CREATE INDEX IF NOT EXISTS
+    if not index_exists(cursor, table, name):
+        cursor.execute(f'CREATE INDEX {name} ON {table} ({columns})')
+
+
+def create_base_tables(cursor):
+    for statement in BASE_TABLES:
+        cursor.execute(statement)
+
+
+def create_changes_table(cursor):
+    cursor.execute(CREATE_CHANGES_TABLE)
+
+
+def create_change_clock(cursor):
+    cursor.execute(CREATE_CHANGE_CLOCK_TABLE)
+    cursor.execute(SEED_CHANGE_CLOCK)
+
+
+def create_route_indexes(cursor):
+    for table, name, columns in ROUTE_INDEXES:
+        ensure_index(cursor, table, name, columns)
+
+
+# Append only; a released version must never change
+MIGRATIONS = [
+    (1, 'Base tables', create_base_tables),
+    (2, 'Change log for delta sync', create_changes_table),
+    (3, 'Indexes for route queries', create_route_indexes),
+    (4, 'Commit-ordered change sequence', create_change_clock),
+]
+
+
+def applied_versions(cursor):
+    cursor.execute(CREATE_MIGRATIONS_TABLE)
+    cursor.execute('SELECT version FROM schema_migrations')
+    return {row['version'] for row in cursor.fetchall()}
+
+
+def migrate(conn):
+    applied = []
+    with conn.cursor() as cursor:
+        cursor.execute('SELECT GET_LOCK(%s, 60) AS locked', (MIGRATION_LOCK_NAME,))
+        if not cursor.fetchone()['locked']:
+            raise RuntimeError('Another migration is running')
+        try:
+            done = applied_versions(cursor)
+            for version, description, apply in MIGRATIONS:
+                if version in done:
+                    continue
+                print(f"Applying migration {version}: {description}")
+                # DDL commits implicitly, so every step is written to be
+                # safe to re-run if it fails halfway
+                apply(cursor)
+                cursor.execute(
+                    'INSERT INTO schema_migrations (version, description) VALUES (%s, %s)',
+                    (version, description)
+                )
+                conn.commit()
+                applied.append(version)
+        finally:
+            cursor.execute('SELECT RELEASE_LOCK(%s)', (MIGRATION_LOCK_NAME,))
+    return applied
+
+
+def status(conn):
+    with conn.cursor() as cursor:
+        done = applied_versions(cursor)
+    return [
+        {'version': version, 'description': description, 'applied': version in done}
+        for version, description, _ in MIGRATIONS
+    ]
+
+
+def route_queries():
+    # Representative parameters for every query the routes issue. The
+    # unpaginated list forms and the geo index load scan on purpose and are
+    # left out.
+    queries = []
+    for resource in LIST_QUERIES:
+        fields = list(LIST_QUERIES[resource]['columns'])
+        queries.append((f'list {resource}', *build_list_query(resource, fields, after=1, limit=50)))
+        queries.append((f'list {resource} first page', *build_list_query(resource, fields, limit=50)))
+        queries.append((f'row {resource}', *build_row_query(resource, 1)))
+        queries.append((f'delta rows {resource}', *build_rows_query(resource, fields, [1, 2, 3])))
+        queries.append((f'version {resource}', *build_version_query(resource)))
+        queries.append((f'changes since {resource}', *build_changes_since_query(resource, 0, CHANGES_MAX_DELTA + 1)))
+        for source, column in DEPENDENT_KEYS.get(resource, {}).items():
+            queries.append((f'delta rows {resource} by {source}', *build_rows_query(resource, fields, [1, 2], column)))
+
+    posts_fields = list(LIST_QUERIES['posts']['columns'])
+    queries.append(('author posts', *build_author_posts_query(1, posts_fields)))
+    queries.append(('author posts next page', *build_author_posts_query(1, posts_fields, after=('2024-01-01 00:00:00', 10))))
+
+    for name, query in LOOKUP_QUERIES.items():
+        queries.append((name, query, [1]))
+    queries.extend([
+        ('image references', *build_count_references_query('/uploads/x.jpg')),
+        ('referenced uploads', *build_referenced_urls_query(['/uploads/x.jpg', '/uploads/y.jpg'])),
+        ('itinerary cache lookup', DB_LOOKUP_QUERY, ['Delhi', 'Goa', 3, 10000, 11000, 30]),
+        ('itinerary index refresh', REFRESH_QUERY, [0, LOAD_BATCH]),
+        ('bulk creator check', *build_creator_check_query([1, 2])),
+    ])
+    return queries
+
+
+def explain_routes(conn, min_rows=EXPLAIN_MIN_ROWS):
+    problems = []
+    with conn.cursor() as cursor:
+        for name, query, params in route_queries():
+            cursor.execute(f'EXPLAIN {query}', params)
+            for step in cursor.fetchall():
+                rows = step.get('rows') or 0
+                extra = step.get('Extra') or ''
+                if step.get('type') == 'ALL' and rows >= min_rows:
+                    problems.append(f"{name}: full scan of {step['table']} (~{rows} rows)")
+                elif 'Using filesort' in extra and rows >= min_rows:
+                    problems.append(f"{name}: filesort over {step['table']} (~{rows} rows)")
+    return problems
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Manage the database schema.')
+    parser.add_argument('command', choices=['migrate', 'status', 'explain'])
+    parser.add_argument('--min-rows', type=int, default=EXPLAIN_MIN_ROWS,
+                        help='EXPLAIN row estimate above which scans fail the check')
+    args = parser.parse_args()
+
+    conn = get_db_conn()
+    try:
+        if args.command == 'migrate':
+            applied = migrate(conn)
+            print(f"Applied {len(applied)} migration(s)" if applied else 'Schema is up to date')
+        elif args.command == 'status':
+            for migration in status(conn):
+                print(f"{migration['version']:>4}  {'applied' if migration['applied'] else 'pending':<8} {migration['description']}")
+        else:
+            problems = explain_routes(conn, args.min_rows)
+            for problem in problems:
+                print(problem)
+            print(f"{len(problems)} query plan problem(s)" if problems else 'All route queries use indexes')
+            sys.exit(1 if problems else 0)
+    finally:
+        conn.close()
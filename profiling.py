@@ -0,0 +1,195 @@
+import hmac
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+
+from flask import g, request
+
+# Requests with this header set to PROFILE_SECRET are profiled; unset
+# disables the header
+PROFILE_HEADER = 'X-Profile'
+PROFILE_SECRET = os.getenv('PROFILE_SECRET')
+# Fraction of all requests profiled at random
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+# Seconds between stack samples of a profiled request
+PROFILE_INTERVAL = float(os.getenv('PROFILE_INTERVAL', 0.005))
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+# Profiles kept per route; the oldest is dropped when a new one is written
+PROFILE_KEEP = int(os.getenv('PROFILE_KEEP', 20))
+
+# Phases from metrics.record() that are reported under one Server-Timing
+# entry
+SERVER_TIMING_GROUPS = {
+    'db_checkout': 'db',
+    'db_execute': 'db',
+    'db_fetch': 'db',
+}
+
+
+def collapse(frame):
+    # Root first, in the "a;b;c" form flamegraph.pl and speedscope read
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def route_slug(method, rule):
+    return method + re.sub(r'[^A-Za-z0-9]+', '_', rule).rstrip('_')
+
+
+def server_timing(phases, total=None):
+    durations = {}
+    for phase, seconds in phases.items():
+        name = SERVER_TIMING_GROUPS.get(phase, phase)
+        durations[name] = durations.get(name, 0.0) + seconds
+    entries = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in sorted(durations.items())]
+    if total is not None:
+        entries.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(entries)
+
+
+class Profiler:
+    """Stack sampling for selected requests.
+
+    One thread samples the stacks of the request threads currently being
+    profiled and stays idle while there are none, so unprofiled requests
+    pay only for the sampling decision. Only the handler's own thread is
+    sampled: work handed to executors and the body of streamed responses
+    are not in the profile.
+    """
+
+    def __init__(self, secret=PROFILE_SECRET, sample_rate=PROFILE_SAMPLE_RATE, interval=PROFILE_INTERVAL,
+                 directory=PROFILE_DIR, keep=PROFILE_KEEP):
+        self.secret = secret
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.directory = directory
+        self.keep = keep
+        self._active = {}
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stats = {'profiled': 0, 'samples': 0, 'written': 0, 'write_errors': 0}
+
+    def wanted(self, headers):
+        token = headers.get(PROFILE_HEADER)
+        if self.secret and token and hmac.compare_digest(token, self.secret):
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self):
+        self._ensure_thread()
+        with self._lock:
+            self._active[threading.get_ident()] = Counter()
+            self._stats['profiled'] += 1
+        self._wake.set()
+
+    def stop(self):
+        with self._lock:
+            return self._active.pop(threading.get_ident(), None)
+
+    def save(self, slug, stacks, status, seconds):
+        route_dir = os.path.join(self.directory, slug)
+        stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+        name = f'{stamp}-{seconds * 1000:.0f}ms-{status}-{uuid.uuid4().hex[:8]}.folded'
+        try:
+            os.makedirs(route_dir, exist_ok=True)
+            path = os.path.join(route_dir, name)
+            with open(path + '.tmp', 'w') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f'{stack} {count}\n')
+            os.replace(path + '.tmp', path)
+            self._prune(route_dir)
+        except OSError as e:
+            print(f"Error writing profile for {slug}: {e}")
+            with self._lock:
+                self._stats['write_errors'] += 1
+            return None
+        with self._lock:
+            self._stats['written'] += 1
+        return path
+
+    def _prune(self, route_dir):
+        # Names start with a timestamp, so sorted order is oldest first
+        profiles = sorted(f for f in os.listdir(route_dir) if f.endswith('.folded'))
+        for name in profiles[:max(0, len(profiles) - self.keep)]:
+            try:
+                os.remove(os.path.join(route_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork, so each worker process starts its own
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._active.clear()
+            self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                idle = not self._active
+                if idle:
+                    self._wake.clear()
+            if idle:
+                self._wake.wait()
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, stacks in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        stacks[collapse(frame)] += 1
+                        self._stats['samples'] += 1
+            del frames
+            time.sleep(self.interval)
+
+    def stats(self):
+        with self._lock:
+            return {
+                **self._stats,
+                'active': len(self._active),
+                'sample_rate': self.sample_rate,
+                'header_enabled': bool(self.secret),
+            }
+
+    def init_app(self, app):
+        # Register after metrics.init_app so this after_request runs first
+        # and still sees the request's phases
+        @app.before_request
+        def start_profile():
+            if self.wanted(request.headers):
+                g.profile_started = time.perf_counter()
+                self.start()
+
+        @app.after_request
+        def finish_profile(response):
+            started = g.pop('profile_started', None)
+            if started is None:
+                return response
+            stacks = self.stop()
+            seconds = time.perf_counter() - started
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            if stacks:
+                self.save(route_slug(request.method, route), stacks, response.status_code, seconds)
+            response.headers['Server-Timing'] = server_timing(g.get('metrics_phases', {}), seconds)
+            return response
+
+        @app.teardown_request
+        def discard_profile(exc):
+            # after_request is skipped when the handler raised
+            if g.pop('profile_started', None) is not None:
+                self.stop()
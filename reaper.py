@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+
+from db import get_db_conn
+from images import original_name, variant_paths
+from storage import UPLOAD_FOLDER, UPLOAD_URL_PREFIX, delete_upload, recently_touched, referenced_urls
+
+# Seconds between sweeps of the uploads directory; 0 turns the sweep off
+UPLOAD_GC_INTERVAL = float(os.getenv('UPLOAD_GC_INTERVAL', 3600))
+UPLOAD_GC_BATCH = int(os.getenv('UPLOAD_GC_BATCH', 500))
+# Max files unlinked per second by a sweep
+UPLOAD_GC_RATE = float(os.getenv('UPLOAD_GC_RATE', 50))
+UPLOAD_GC_DRY_RUN = os.getenv('UPLOAD_GC_DRY_RUN') == '1'
+
+# Only one worker process sweeps at a time
+SWEEP_LOCK_NAME = 'roamconnect_upload_gc'
+
+
+class UploadReaper:
+    """Deletes unreferenced uploads off the request path.
+
+    Handlers enqueue blobs whose last reference they removed. A periodic
+    sweep reconciles the uploads directory against the image columns and
+    picks up everything else: uploads whose INSERT failed, blobs skipped
+    for being too recent, leftovers from crashes.
+    """
+
+    def __init__(self, interval=UPLOAD_GC_INTERVAL, batch_size=UPLOAD_GC_BATCH,
+                 rate=UPLOAD_GC_RATE, dry_run=UPLOAD_GC_DRY_RUN):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.rate = rate
+        self.dry_run = dry_run
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._stats = {'enqueued': 0, 'deleted': 0, 'reclaimed_bytes': 0, 'sweeps': 0}
+        self._last_sweep = None
+
+    def enqueue(self, urls):
+        self._ensure_thread()
+        for url in urls:
+            self._queue.put(url)
+            with self._lock:
+                self._stats['enqueued'] += 1
+
+    def start(self):
+        self._ensure_thread()
+
+    def sweep(self, dry_run=None):
+        dry_run = self.dry_run if dry_run is None else dry_run
+        if not self._sweep_lock.acquire(blocking=False):
+            return None
+        try:
+            conn = get_db_conn()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT GET_LOCK(%s, 0) AS locked', (SWEEP_LOCK_NAME,))
+                    if not cursor.fetchone()['locked']:
+                        return None
+                    try:
+                        report = self._sweep(cursor, dry_run)
+                    finally:
+                        cursor.execute('SELECT RELEASE_LOCK(%s)', (SWEEP_LOCK_NAME,))
+            finally:
+                conn.close()
+        finally:
+            self._sweep_lock.release()
+
+        with self._lock:
+            self._stats['sweeps'] += 1
+            if not dry_run:
+                self._stats['deleted'] += report['deleted']
+                self._stats['reclaimed_bytes'] += report['reclaimed_bytes']
+            self._last_sweep = report
+        print(f"Upload sweep: {report}")
+        return report
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['queued'] = self._queue.qsize()
+            stats['dry_run'] = self.dry_run
+            stats['last_sweep'] = self._last_sweep
+        return stats
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='upload-reaper', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def _run(self):
+        next_sweep = time.monotonic() + self.interval if self.interval else None
+        while True:
+            timeout = max(next_sweep - time.monotonic(), 0) if next_sweep else None
+            try:
+                url = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                url = None
+            if url is not None:
+                self._delete_queued(url)
+            if next_sweep and time.monotonic() >= next_sweep:
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"Upload sweep failed: {e}")
+                next_sweep = time.monotonic() + self.interval
+
+    def _delete_queued(self, url):
+        if self.dry_run:
+            return
+        try:
+            freed = delete_upload(url)
+        except OSError as e:
+            print(f"Could not delete {url}: {e}")
+            return
+        if freed:
+            with self._lock:
+                self._stats['deleted'] += 1
+                self._stats['reclaimed_bytes'] += freed
+
+    def _sweep(self, cursor, dry_run):
+        started = time.monotonic()
+        report = {'dry_run': dry_run, 'scanned': 0, 'orphans': 0, 'deleted': 0, 'skipped_recent': 0, 'reclaimed_bytes': 0}
+        blobs = []
+        leftovers = []
+        with os.scandir(UPLOAD_FOLDER) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                report['scanned'] += 1
+                if entry.name.endswith('.tmp'):
+                    # Interrupted upload or variant write
+                    leftovers.append(entry.path)
+                elif original_name(entry.name):
+                    if not os.path.exists(os.path.join(UPLOAD_FOLDER, original_name(entry.name))):
+                        leftovers.append(entry.path)
+                else:
+                    blobs.append(UPLOAD_URL_PREFIX + entry.name)
+
+        for start in range(0, len(blobs), self.batch_size):
+            batch = blobs[start:start + self.batch_size]
+            referenced = referenced_urls(cursor, batch)
+            for url in batch:
+                if url in referenced:
+                    continue
+                report['orphans'] += 1
+                path = os.path.join(UPLOAD_FOLDER, url[len(UPLOAD_URL_PREFIX):])
+                if recently_touched(path):
+                    report['skipped_recent'] += 1
+                elif dry_run:
+                    report['reclaimed_bytes'] += sum(
+                        os.path.getsize(p) for p in [path] + variant_paths(path) if os.path.exists(p)
+                    )
+                else:
+                    freed = delete_upload(url)
+                    if freed:
+                        report['deleted'] += 1
+                        report['reclaimed_bytes'] += freed
+                        self._throttle()
+
+        for path in leftovers:
+            report['orphans'] += 1
+            if not os.path.exists(path):
+                continue
+            if recently_touched(path):
+                report['skipped_recent'] += 1
+                continue
+            size = os.path.getsize(path)
+            if not dry_run:
+                os.remove(path)
+                report['deleted'] += 1
+                self._throttle()
+            report['reclaimed_bytes'] += size
+
+        report['seconds'] = round(time.monotonic() - started, 3)
+        return report
+
+    def _throttle(self):
+        if self.rate > 0:
+            time.sleep(1.0 / self.rate)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Delete uploads that no tourist or post references.')
+    parser.add_argument('--dry-run', action='store_true', help='report what would be deleted without deleting')
+    args = parser.parse_args()
+    report = UploadReaper(interval=0).sweep(dry_run=args.dry_run)
+    if report is None:
+        print('Another sweep is already running')
+    else:
+        print(json.dumps(report, indent=2))
@@ -1,51 +1,130 @@
-from flask import Blueprint, Flask, request, jsonify, send_from_directory
+from flask import Blueprint, Flask, Response, request, jsonify, send_from_directory
 from flask_cors import CORS
 import pymysql
 from enum import Enum
 from datetime import datetime
 import os
-import uuid
-from werkzeug.utils import secure_filename
+from werkzeug.utils import safe_join
 import openai
 from dotenv import load_dotenv
 import json
+import mimetypes
 import requests
 
+# Before the local imports: they read their settings from the environment
+# at import time
 load_dotenv()
 
+from admission import AdmissionController, Rejected, client_key
+from bulk import insert_rows, read_bulk_rows, validate_rows
+from changes import (
+    changes_since, collection_etag, collection_version, parse_since, record_change, record_changes
+)
+from db import get_db_conn, get_pool
+from geo_index import GeoIndex
+from images import ImageVariants, add_variant_urls, original_name
+from itinerary_ai import TRIP_FIELDS, adapt_itinerary, generate_itinerary, load_itinerary, parse_trip, repair_stats, store_itinerary, stream_itinerary
+from itinerary_cache import ItineraryCache, cache_key
+from itinerary_index import ItineraryIndex
+from itinerary_responses import ItineraryEventStream, accepted_job, created_body, error_response, itinerary_events
+from jobs import JobQueue, QueueFull
+from profiling import Profiler
+from reaper import UploadReaper
+import metrics
+from listing import (
+    AUTHOR_PAGE_LIMIT, LIST_QUERIES, LOOKUP_QUERIES, build_author_posts_query, build_list_query, build_row_query, decode_post_cursor,
+    encode_post_cursor, page_result, parse_fields, parse_limit, parse_list_args, serialize_itinerary,
+    serialize_itinerary_summary
+)
+from singleflight import SingleFlight
+from storage import UPLOAD_FOLDER, save_upload, unreferenced, upload_path
+
 app = Flask(__name__)
+metrics.init_app(app)
+profiler = Profiler()
+profiler.init_app(app)
 CORS(app, resources={
     r"/*": {
         "origins": ["*"],  # Allows all origins
         "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Authorization"],
+        "allow_headers": ["Content-Type", "Authorization", "X-Profile"],
         "expose_headers": ["Content-Type", "Authorization"],
         "supports_credentials": True,
         "max_age": 3600
     }
 })
 
-UPLOAD_FOLDER = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# Upload filenames are unique and never rewritten, so browsers and proxies
+# can keep them for good
+UPLOAD_MAX_AGE = int(os.getenv('UPLOAD_MAX_AGE', 365 * 24 * 3600))
+# Behind nginx, the internal location aliased to UPLOAD_FOLDER (e.g.
+# /protected-uploads/); nginx then serves the bytes, ranges and 304s itself
+UPLOAD_ACCEL_REDIRECT = os.getenv('UPLOAD_ACCEL_REDIRECT')
+# Behind Apache/lighttpd with mod_xsendfile
+app.config['USE_X_SENDFILE'] = os.getenv('USE_X_SENDFILE') == '1'
 
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 # Initialize OpenAI client
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
+itinerary_cache = ItineraryCache()
+itinerary_flights = SingleFlight()
+itinerary_admission = AdmissionController()
+itinerary_index = ItineraryIndex()
+image_variants = ImageVariants()
+upload_reaper = UploadReaper()
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-db_config = {
-    "host":'bgs-bgsh.k.aivencloud.com',
-    "port":24154,
-    "user":'avnadmin',
-    "password":'AVNS_ztTkfwsSwhkcf8H4sf7',
-    "database":'defaultdb',
-    "ssl":{'ssl': {}},
-    "cursorclass": pymysql.cursors.DictCursor
-}
+def save_image(field):
+    file = request.files.get(field)
+    if not file or file.filename == '' or not allowed_file(file.filename):
+        return None
+    with metrics.timed('file_save'):
+        url, created = save_upload(file)
+    if created:
+        image_variants.submit(upload_path(url))
+    return url
+
+def bulk_insert(resource):
+    try:
+        valid, results = validate_rows(resource, read_bulk_rows(request))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not results:
+        return jsonify({'error': 'No rows to insert'}), 400
+
+    created = []
+    if valid:
+        conn = get_db_conn()
+        try:
+            created = insert_rows(conn, resource, valid, results)
+        finally:
+            conn.close()
+
+    failed = len(results) - len(created)
+    return jsonify({
+        'status': 'success' if created else 'error',
+        'created': len(created),
+        'failed': failed,
+        'results': results
+    }), 201 if not failed else (200 if created else 400)
+
+def delete_images(urls):
+    # Called after commit with what unreferenced() returned; the files are
+    # removed by the reaper thread, not while this request holds a connection
+    if urls:
+        upload_reaper.enqueue(urls)
+
+@app.before_request
+def start_background_workers():
+    # Started per worker process, after any pre-fork import
+    upload_reaper.start()
+    itinerary_index.start()
 
 class Badge(Enum):
     lvl0 = 'lvl0'
@@ -53,8 +132,75 @@ class Badge(Enum):
     lvl2 = 'lvl2'
     lvl3 = 'lvl3'
 
-def get_db_conn():
-    return pymysql.connect(**db_config)
+def wants_stream():
+    if request.args.get('stream') == '1':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', 'application/x-ndjson']) == 'application/x-ndjson'
+
+def stream_rows(query, params, transform=None):
+    # Unbuffered server-side cursor: rows are read off the socket as they are
+    # written to the client, so memory stays flat regardless of result size
+    conn = get_db_conn()
+    try:
+        cursor = conn.cursor(pymysql.cursors.SSDictCursor)
+        cursor.execute(query, params)
+    except Exception:
+        conn.discard()
+        raise
+
+    def generate():
+        finished = False
+        try:
+            for row in cursor:
+                if transform:
+                    row = transform(row)
+                yield app.json.dumps(row) + '\n'
+            finished = True
+        finally:
+            if finished:
+                cursor.close()
+                conn.close()
+            else:
+                # Client went away mid-stream; dropping the socket is cheaper
+                # than draining the rest of the result set
+                conn.discard()
+
+    return Response(generate(), mimetype='application/x-ndjson')
+
+def list_resource(resource, transform=None):
+    try:
+        fields, after, limit = parse_list_args(resource, request.args)
+        since = parse_since(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    if wants_stream():
+        return stream_rows(*build_list_query(resource, fields, after, limit, lookahead=False), transform)
+
+    conn = get_db_conn()
+    try:
+        with conn.cursor() as cursor:
+            # The version is read first in the same transaction, so it never
+            # runs ahead of the rows returned with it
+            version = collection_version(cursor, resource)
+            etag = collection_etag(resource, version, request.query_string)
+            if etag in request.if_none_match:
+                response = Response(status=304)
+            else:
+                if since is not None:
+                    result = changes_since(cursor, resource, since, fields, version)
+                else:
+                    cursor.execute(*build_list_query(resource, fields, after, limit))
+                    result = page_result(cursor.fetchall(), limit)
+                    result['cursor'] = version
+                if transform:
+                    result['data'] = [transform(row) for row in result['data']]
+                response = jsonify(result)
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+    finally:
+        conn.close()
 
 # Initialize emergency blueprint
 # emergency_bp = Blueprint('emergency', __name__)
@@ -152,29 +298,7 @@ def get_db_conn():
 
 @app.route('/tourists', methods=['GET'])
 def get_tourists():
-    conn = get_db_conn()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute('''
-                SELECT 
-                    id,
-                    name,
-                    email,
-                    badge,
-                    profile_image,
-                    background_image,
-                    bio
-                FROM tourists
-            ''')
-            tourists = cursor.fetchall()
-            result = {
-                'status': 'success',
-                'count': len(tourists),
-                'data': tourists
-            }
-            return jsonify(result)
-    finally:
-        conn.close()
+    return list_resource('tourists', add_variant_urls)
 
 @app.route('/tourists', methods=['POST'])
 def create_tourist():
@@ -187,27 +311,9 @@ def create_tourist():
     except ValueError:
         return jsonify({'error': 'Invalid badge value'}), 400
     
-    profile_image = None
-    background_image = None
     bio = data.get('bio')
-    
-    if 'profile_image' in request.files:
-        file = request.files['profile_image']
-        if file.filename != '' and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            file.save(file_path)
-            profile_image = f"/uploads/{unique_filename}"
-    
-    if 'background_image' in request.files:
-        file = request.files['background_image']
-        if file.filename != '' and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            file.save(file_path)
-            background_image = f"/uploads/{unique_filename}"
+    profile_image = save_image('profile_image')
+    background_image = save_image('background_image')
     
     conn = get_db_conn()
     try:
@@ -216,6 +322,7 @@ def create_tourist():
                 'INSERT INTO tourists (name, email, pwd, badge, profile_image, background_image, bio) VALUES (%s, %s, %s, %s, %s, %s, %s)',
                 (data['name'], data['email'], data['pwd'], badge.value, profile_image, background_image, bio)
             )
+            record_change(cursor, 'tourists', cursor.lastrowid)
             conn.commit()
             response = {'message': 'Tourist created successfully'}
             if profile_image:
@@ -224,7 +331,7 @@ def create_tourist():
                 response['background_image'] = background_image
             if bio:
                 response['bio'] = bio
-            return jsonify(response), 201
+            return jsonify(add_variant_urls(response)), 201
     except pymysql.err.IntegrityError:
         return jsonify({'error': 'Email already exists'}), 400
     finally:
@@ -235,7 +342,7 @@ def update_tourist(tourist_id):
     conn = get_db_conn()
     try:
         with conn.cursor() as cursor:
-            cursor.execute('SELECT * FROM tourists WHERE id = %s', (tourist_id,))
+            cursor.execute(LOOKUP_QUERIES['tourist'], (tourist_id,))
             current_tourist = cursor.fetchone()
             if not current_tourist:
                 return jsonify({'error': 'Tourist not found'}), 404
@@ -265,43 +372,14 @@ def update_tourist(tourist_id):
                 update_fields.append('bio = %s')
                 values.append(data['bio'])
             
-            # Handle profile image
-            if 'profile_image' in request.files:
-                file = request.files['profile_image']
-                if file.filename != '' and allowed_file(file.filename):
-                    old_profile_image = current_tourist.get('profile_image')
-                    if old_profile_image:
-                        old_image_path = os.path.join(app.config['UPLOAD_FOLDER'], 
-                                                    old_profile_image.split('/')[-1])
-                        if os.path.exists(old_image_path):
-                            os.remove(old_image_path)
-                    
-                    filename = secure_filename(file.filename)
-                    unique_filename = f"{uuid.uuid4()}_{filename}"
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-                    file.save(file_path)
-                    profile_image = f"/uploads/{unique_filename}"
-                    update_fields.append('profile_image = %s')
-                    values.append(profile_image)
-            
-            # Handle background image
-            if 'background_image' in request.files:
-                file = request.files['background_image']
-                if file.filename != '' and allowed_file(file.filename):
-                    old_background_image = current_tourist.get('background_image')
-                    if old_background_image:
-                        old_image_path = os.path.join(app.config['UPLOAD_FOLDER'], 
-                                                    old_background_image.split('/')[-1])
-                        if os.path.exists(old_image_path):
-                            os.remove(old_image_path)
-                    
-                    filename = secure_filename(file.filename)
-                    unique_filename = f"{uuid.uuid4()}_{filename}"
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-                    file.save(file_path)
-                    background_image = f"/uploads/{unique_filename}"
-                    update_fields.append('background_image = %s')
-                    values.append(background_image)
+            # Handle images; replaced ones are deleted once nothing references them
+            replaced_images = []
+            for column in ('profile_image', 'background_image'):
+                image = save_image(column)
+                if image:
+                    replaced_images.append(current_tourist.get(column))
+                    update_fields.append(f'{column} = %s')
+                    values.append(image)
             
             # If no fields to update, return error
             if not update_fields:
@@ -313,19 +391,22 @@ def update_tourist(tourist_id):
             # Build and execute update query
             query = f'UPDATE tourists SET {", ".join(update_fields)} WHERE id = %s'
             cursor.execute(query, values)
+            record_change(cursor, 'tourists', tourist_id)
+            orphaned_images = unreferenced(cursor, [url for url in replaced_images if url])
             
             conn.commit()
+            delete_images(orphaned_images)
             
             # Build response
             response = {'message': 'Tourist updated successfully'}
-            if 'profile_image' in update_fields:
+            if 'profile_image = %s' in update_fields:
                 response['profile_image'] = values[update_fields.index('profile_image = %s')]
-            if 'background_image' in update_fields:
+            if 'background_image = %s' in update_fields:
                 response['background_image'] = values[update_fields.index('background_image = %s')]
-            if 'bio' in update_fields:
+            if 'bio = %s' in update_fields:
                 response['bio'] = values[update_fields.index('bio = %s')]
             
-            return jsonify(response)
+            return jsonify(add_variant_urls(response))
     finally:
         conn.close()
 
@@ -334,55 +415,55 @@ def delete_tourist(tourist_id):
     conn = get_db_conn()
     try:
         with conn.cursor() as cursor:
-            cursor.execute('SELECT profile_image, background_image FROM tourists WHERE id = %s', (tourist_id,))
+            cursor.execute(LOOKUP_QUERIES['tourist images'], (tourist_id,))
             tourist = cursor.fetchone()
             if not tourist:
                 return jsonify({'error': 'Tourist not found'}), 404
             
-            profile_image = tourist.get('profile_image')
-            if profile_image:
-                image_path = os.path.join(app.config['UPLOAD_FOLDER'], 
-                                        profile_image.split('/')[-1])
-                if os.path.exists(image_path):
-                    os.remove(image_path)
-            
-            background_image = tourist.get('background_image')
-            if background_image:
-                image_path = os.path.join(app.config['UPLOAD_FOLDER'], 
-                                        background_image.split('/')[-1])
-                if os.path.exists(image_path):
-                    os.remove(image_path)
+            images = [tourist.get('profile_image'), tourist.get('background_image')]
             
+            # Their posts and contacts go with them (ON DELETE CASCADE), so
+            # clients syncing those feeds need tombstones too
+            cursor.execute(LOOKUP_QUERIES['posts by author'], (tourist_id,))
+            posts = cursor.fetchall()
+            images.extend(post['image_url'] for post in posts)
+            cursor.execute(LOOKUP_QUERIES['contacts by author'], (tourist_id,))
+            contact_ids = [contact['id'] for contact in cursor.fetchall()]
             cursor.execute('DELETE FROM tourists WHERE id = %s', (tourist_id,))
+            record_changes(cursor, 'posts', [post['id'] for post in posts], 'delete')
+            record_changes(cursor, 'er', contact_ids, 'delete')
+            record_change(cursor, 'tourists', tourist_id, 'delete')
+            orphaned_images = unreferenced(cursor, [url for url in images if url])
             conn.commit()
+            for contact_id in contact_ids:
+                er_index.remove(contact_id)
+            delete_images(orphaned_images)
             return jsonify({'message': 'Tourist deleted successfully'})
     finally:
         conn.close()
 
 @app.route('/posts', methods=['GET'])
 def get_posts():
+    return list_resource('posts', add_variant_urls)
+
+@app.route('/tourists/<int:tourist_id>/posts', methods=['GET'])
+def get_tourist_posts(tourist_id):
+    try:
+        fields = parse_fields('posts', request.args)
+        limit = parse_limit(request.args, default=AUTHOR_PAGE_LIMIT)
+        after = decode_post_cursor(request.args['after']) if request.args.get('after') else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    query, params = build_author_posts_query(tourist_id, fields, after, limit)
     conn = get_db_conn()
     try:
         with conn.cursor() as cursor:
-            cursor.execute('''
-                SELECT 
-                    p.id,
-                    p.created_at,
-                    p.created_by,
-                    p.content,
-                    p.loc_link,
-                    p.image_url,
-                    p.title,
-                    t.name as creator_name 
-                FROM posts p 
-                JOIN tourists t ON p.created_by = t.id
-            ''')
+            cursor.execute(query, params)
             posts = cursor.fetchall()
-            result = {
-                'status': 'success',
-                'count': len(posts),
-                'data': posts
-            }
+            result = page_result([add_variant_urls(post) for post in posts], limit)
+            if result['next_after'] is not None:
+                result['next_after'] = encode_post_cursor(result['data'][-1])
             return jsonify(result)
     finally:
         conn.close()
@@ -393,15 +474,7 @@ def create_post():
     if not all(k in data for k in ('created_by', 'content', 'loc_link', 'title')):
         return jsonify({'error': 'Missing required fields'}), 400
     
-    image_url = None
-    if 'image' in request.files:
-        file = request.files['image']
-        if file.filename != '' and allowed_file(file.filename):
-            filename = secure_filename(file.filename)
-            unique_filename = f"{uuid.uuid4()}_{filename}"
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-            file.save(file_path)
-            image_url = f"/uploads/{unique_filename}"
+    image_url = save_image('image')
     
     conn = get_db_conn()
     try:
@@ -410,24 +483,55 @@ def create_post():
                 'INSERT INTO posts (created_by, content, loc_link, image_url, title) VALUES (%s, %s, %s, %s, %s)',
                 (data['created_by'], data['content'], data['loc_link'], image_url, data['title'])
             )
+            record_change(cursor, 'posts', cursor.lastrowid)
             conn.commit()
             response = {'message': 'Post created successfully'}
             if image_url:
                 response['image_url'] = image_url
-            return jsonify(response), 201
+            return jsonify(add_variant_urls(response)), 201
     finally:
         conn.close()
 
+@app.route('/posts/bulk', methods=['POST'])
+def create_posts_bulk():
+    return bulk_insert('posts')
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    original = original_name(filename)
+    if original and not os.path.exists(os.path.join(app.config['UPLOAD_FOLDER'], filename)):
+        original_path = safe_join(app.config['UPLOAD_FOLDER'], original)
+        if original_path is None or not os.path.isfile(original_path):
+            return jsonify({'error': 'File not found'}), 404
+        # Variant still being built (or an upload from before variants
+        # existed): queue it and serve the original without long caching.
+        # Sources that failed to decode are not queued again.
+        image_variants.submit(original_path)
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], original, max_age=0)
+        response.cache_control.no_cache = True
+        return response
+
+    if UPLOAD_ACCEL_REDIRECT:
+        path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+        if path is None or not os.path.isfile(path):
+            return jsonify({'error': 'File not found'}), 404
+        response = Response(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = f"{UPLOAD_ACCEL_REDIRECT.rstrip('/')}/{filename}"
+    else:
+        # Conditional and Range requests are answered by werkzeug; the body
+        # goes out through wsgi.file_wrapper, which gunicorn sends with sendfile()
+        response = send_from_directory(app.config['UPLOAD_FOLDER'], filename, max_age=UPLOAD_MAX_AGE)
+    response.cache_control.public = True
+    response.cache_control.max_age = UPLOAD_MAX_AGE
+    response.cache_control.immutable = True
+    return response
 
 @app.route('/posts/<int:post_id>', methods=['PUT'])
 def update_post(post_id):
     conn = get_db_conn()
     try:
         with conn.cursor() as cursor:
-            cursor.execute('SELECT * FROM posts WHERE id = %s', (post_id,))
+            cursor.execute(LOOKUP_QUERIES['post'], (post_id,))
             current_post = cursor.fetchone()
             if not current_post:
                 return jsonify({'error': 'Post not found'}), 404
@@ -444,33 +548,28 @@ def update_post(post_id):
                 update_fields.append('title = %s')
                 values.append(data['title'])
             image_url = current_post.get('image_url')
-            if 'image' in request.files:
-                file = request.files['image']
-                if file.filename != '' and allowed_file(file.filename):
-                    if image_url:
-                        old_image_path = os.path.join(app.config['UPLOAD_FOLDER'], 
-                                                    image_url.split('/')[-1])
-                        if os.path.exists(old_image_path):
-                            os.remove(old_image_path)
-                    filename = secure_filename(file.filename)
-                    unique_filename = f"{uuid.uuid4()}_{filename}"
-                    file_path = os.path.join(app.config['UPLOAD_FOLDER'], unique_filename)
-                    file.save(file_path)
-                    image_url = f"/uploads/{unique_filename}"
-                    update_fields.append('image_url = %s')
-                    values.append(image_url)
+            new_image_url = save_image('image')
+            if new_image_url:
+                image_url = new_image_url
+                update_fields.append('image_url = %s')
+                values.append(image_url)
             if not update_fields:
                 return jsonify({'error': 'No valid fields to update'}), 400
             
             values.append(post_id)
             query = f'UPDATE posts SET {", ".join(update_fields)} WHERE id = %s'
             cursor.execute(query, values)
+            record_change(cursor, 'posts', post_id)
+            orphaned_images = []
+            if new_image_url and current_post.get('image_url'):
+                orphaned_images = unreferenced(cursor, [current_post['image_url']])
             
             conn.commit()
+            delete_images(orphaned_images)
             response = {'message': 'Post updated successfully'}
             if image_url != current_post.get('image_url'):
                 response['image_url'] = image_url
-            return jsonify(response)
+            return jsonify(add_variant_urls(response))
     finally:
         conn.close()
 
@@ -479,244 +578,248 @@ def delete_post(post_id):
     conn = get_db_conn()
     try:
         with conn.cursor() as cursor:
-            cursor.execute('SELECT image_url FROM posts WHERE id = %s', (post_id,))
+            cursor.execute(LOOKUP_QUERIES['post image'], (post_id,))
             post = cursor.fetchone()
             if not post:
                 return jsonify({'error': 'Post not found'}), 404
-            image_url = post.get('image_url') 
-            if image_url:
-                image_path = os.path.join(app.config['UPLOAD_FOLDER'], 
-                                        image_url.split('/')[-1])
-                if os.path.exists(image_path):
-                    os.remove(image_path)
             cursor.execute('DELETE FROM posts WHERE id = %s', (post_id,))
+            record_change(cursor, 'posts', post_id, 'delete')
+            orphaned_images = unreferenced(cursor, [post['image_url']] if post.get('image_url') else [])
             conn.commit()
+            delete_images(orphaned_images)
             return jsonify({'message': 'Post deleted successfully'})
     finally:
         conn.close()
 
+def save_itinerary(trip, itinerary):
+    itinerary_id = store_itinerary(trip, itinerary)
+    itinerary_cache.put(trip, itinerary_id, itinerary)
+    itinerary_index.add(itinerary_id, trip)
+    return itinerary_id
+
+def admitted(client, call, *args):
+    # With a client, OpenAI calls go through itinerary_admission; background
+    # jobs are bounded by their queue instead
+    if client is None:
+        return call(*args)
+    with itinerary_admission.admit(client):
+        return call(*args)
+
+def reuse_similar_itinerary(trip, client=None):
+    match = itinerary_index.find(trip)
+    if not match:
+        return None
+    similar_id, score = match
+    stored = load_itinerary(similar_id)
+    if not stored:
+        return None
+    print(f"Reusing itinerary {similar_id} (similarity {score:.2f}) for {trip['source']} to {trip['destination']}")
+    args = (trip, float(stored['budget']), stored['days'], json.loads(stored['itinerary_data']))
+    if stored['days'] < trip['days']:
+        # Extending a shorter plan asks OpenAI for the missing days
+        return admitted(client, adapt_itinerary, *args)
+    return adapt_itinerary(*args)
+
+def produce_itinerary(trip, client=None):
+    cached = itinerary_cache.get(trip)
+    if cached:
+        itinerary_id, itinerary = cached
+        print(f"Itinerary cache hit: {trip['source']} to {trip['destination']} ({trip['days']} days)")
+        return itinerary_id, itinerary, True
+
+    def generate_and_store():
+        itinerary = reuse_similar_itinerary(trip, client) or admitted(client, generate_itinerary, trip)
+        return save_itinerary(trip, itinerary), itinerary
+
+    # Identical requests that arrive while this one is generating share its result
+    try:
+        (itinerary_id, itinerary), coalesced = itinerary_flights.do(cache_key(trip), generate_and_store)
+    except Rejected as e:
+        raise e.seen_by(client)
+    return itinerary_id, itinerary, coalesced
+
+def run_itinerary_job(trip):
+    itinerary_id, _, cached = produce_itinerary(trip)
+    return {'itinerary_id': itinerary_id, 'cached': cached}
+
+itinerary_jobs = JobQueue(run_itinerary_job)
+
+def submit_itinerary_job(trip, client):
+    # Jobs are already bounded by the queue; only the rate applies
+    itinerary_admission.check_rate(client)
+    try:
+        return itinerary_jobs.submit(trip)
+    except QueueFull:
+        itinerary_admission.refund(client)
+        raise
+
 @app.route('/itinerary', methods=['POST'])
 def create_ai_itinerary():
     data = request.get_json()
-    if not all(k in data for k in ('budget', 'source', 'destination', 'days', 'preferences')):
+    if not all(k in data for k in TRIP_FIELDS):
         return jsonify({'error': 'Missing required fields'}), 400
     
     try:
-        budget = float(data['budget'])
-        source = data['source']
-        destination = data['destination']
-        days = int(data['days'])
-        preferences = data['preferences']
-        
-        print(f"Received request: {days} days from {source} to {destination} with budget {budget}")
-        
-        prompt = f"""Create a detailed {days}-day travel itinerary from {source} to {destination} with a budget of ₹{budget}.
-        Preferences: {', '.join(preferences)}.
-        
-        IMPORTANT REQUIREMENTS:
-        1. You MUST create activities for ALL {days} days of the trip
-        2. Each day must have at least 3-4 activities
-        3. Activities should be spread throughout the day (morning, afternoon, evening)
-        4. Include realistic time slots and durations
-        5. Ensure the total cost stays within the budget of ₹{budget}
-        
-        Include in your response:
-        1. Daily schedule with time slots for ALL days
-        2. Cost estimates for each activity
-        3. Transportation details
-        4. Restaurant recommendations
-        5. Must-see attractions
-        6. Budget breakdown
-        7. Local tips and cultural notes
-        8. Emergency contacts and important numbers
-        
-        Your response MUST be a valid JSON object with the following structure:
-        {{
-            "summary": "Brief overview of the trip",
-            "budget_breakdown": {{
-                "total": {budget},
-                "categories": [
-                    {{"category": "transportation", "amount": 0, "percentage": 0}},
-                    {{"category": "accommodation", "amount": 0, "percentage": 0}},
-                    {{"category": "activities", "amount": 0, "percentage": 0}},
-                    {{"category": "food", "amount": 0, "percentage": 0}},
-                    {{"category": "miscellaneous", "amount": 0, "percentage": 0}}
-                ]
-            }},
-            "daily_itinerary": [
-                {{"day": 1, "activities": []}},
-                {{"day": 2, "activities": []}},
-                {{"day": 3, "activities": []}}
-            ],
-            "restaurant_recommendations": [],
-            "transportation_details": [],
-            "emergency_info": {{
-                "police": "number",
-                "ambulance": "number",
-                "fire": "number",
-                "embassy": "address and number",
-                "hospital": "address and number"
-            }},
-            "local_tips": [],
-            "cultural_notes": []
-        }}
-        
-        IMPORTANT: 
-        1. You MUST include activities for ALL {days} days in the daily_itinerary array
-        2. Each day must have at least 3-4 activities
-        3. Do not include any text before or after the JSON object
-        4. The response must be valid JSON that can be parsed directly"""
-        
-        print("Sending prompt to OpenAI...")
-        
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": "You are a professional travel planner with expertise in creating detailed itineraries. You must respond with valid JSON only, with no additional text. You must include activities for all days of the trip."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.5,
-            max_tokens=3000
-        )
-        
-        response_content = response.choices[0].message.content.strip()
-        
-        try:
-            if response_content.startswith("```json"):
-                response_content = response_content[7:]
-            if response_content.endswith("```"):
-                response_content = response_content[:-3]
-            response_content = response_content.strip()
-            
-            
-            itinerary = json.loads(response_content)
-            
-            if len(itinerary['daily_itinerary']) != days:
-                print(f"Error: Expected {days} days but got {len(itinerary['daily_itinerary'])} days")
-                return jsonify({
-                    'error': f'Incomplete itinerary: Expected {days} days but got {len(itinerary["daily_itinerary"])} days',
-                    'raw_response': response_content
-                }), 500
-            
-            # Store the itinerary in the database
-            conn = get_db_conn()
-            try:
-                with conn.cursor() as cursor:
-                    cursor.execute(
-                        'INSERT INTO itineraries (budget, source, destination, days, preferences, itinerary_data) VALUES (%s, %s, %s, %s, %s, %s)',
-                        (budget, source, destination, days, json.dumps(preferences), json.dumps(itinerary))
-                    )
-                    itinerary_id = cursor.lastrowid
-                    conn.commit()
-            finally:
-                conn.close()
-            
-            return jsonify({
-                'status': 'success',
-                'id': itinerary_id,
-                'data': itinerary
-            })
-                
-        except json.JSONDecodeError as e:
-            print("JSON Parse Error:", str(e))
-            print("Raw AI Response:", response_content)
-            return jsonify({
-                'error': 'Failed to parse AI response as JSON',
-                'details': str(e),
-                'raw_response': response_content
-            }), 500
-        
+        trip = parse_trip(data)
+        client = client_key(request.headers, request.remote_addr)
+
+        if request.args.get('async') == '1':
+            body, headers = accepted_job(submit_itinerary_job(trip, client))
+            return jsonify(body), 202, headers
+
+        return jsonify(created_body(*produce_itinerary(trip, client)))
+    except Exception as e:
+        body, status, headers = error_response(e)
+        return jsonify(body), status, headers
+
+@app.route('/itinerary/stream', methods=['GET'])
+def stream_ai_itinerary():
+    data = request.args.to_dict()
+    if 'preferences' in data:
+        data['preferences'] = [p.strip() for p in ','.join(request.args.getlist('preferences')).split(',') if p.strip()]
+    if not all(k in data for k in TRIP_FIELDS):
+        return jsonify({'error': 'Missing required fields'}), 400
+
+    try:
+        trip = parse_trip(data)
     except ValueError as e:
-        print("ValueError:", str(e))
         return jsonify({'error': f'Invalid input: {str(e)}'}), 400
+
+    # Decided before the response starts so a rejection keeps its status
+    try:
+        cached = itinerary_cache.get(trip)
+        started = None if cached else itinerary_admission.acquire(client_key(request.headers, request.remote_addr))
+    except Rejected as e:
+        return jsonify({'error': str(e)}), e.status, e.headers()
     except Exception as e:
         print("Unexpected Error:", str(e))
-        print("Error type:", type(e).__name__)
-        import traceback
-        print("Traceback:", traceback.format_exc())
         return jsonify({'error': str(e)}), 500
 
+    def generate():
+        stream = ItineraryEventStream(app.json.dumps)
+        try:
+            if cached:
+                itinerary_id, itinerary = cached
+                events = itinerary_events(itinerary)
+            else:
+                itinerary_id = None
+                events = stream_itinerary(trip)
+
+            for event in events:
+                frame = stream.on_event(*event)
+                if frame:
+                    yield frame
+            yield from stream.unsent_days()
+
+            if itinerary_id is None:
+                itinerary_id = save_itinerary(trip, stream.itinerary)
+            yield stream.done(itinerary_id, cached is not None)
+        except Exception as e:
+            yield stream.error(e)
+
+    response = Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    if started is not None:
+        # Runs even when the client leaves before the stream starts
+        response.call_on_close(lambda: itinerary_admission.release(started))
+    return response
+
+@app.route('/itinerary/jobs/<job_id>', methods=['GET'])
+def get_itinerary_job(job_id):
+    job = itinerary_jobs.get(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+
+    result = job['result'] or {}
+    return jsonify({
+        'status': 'success',
+        'data': {
+            'id': job['id'],
+            'state': job['state'],
+            'itinerary_id': result.get('itinerary_id'),
+            'cached': result.get('cached'),
+            'error': job['error'],
+            'created_at': job['created_at'],
+            'started_at': job['started_at'],
+            'finished_at': job['finished_at']
+        }
+    })
+
 @app.route('/itinerary/<int:itinerary_id>', methods=['GET'])
 def get_itinerary(itinerary_id):
     conn = get_db_conn()
     try:
         with conn.cursor() as cursor:
-            cursor.execute('SELECT * FROM itineraries WHERE id = %s', (itinerary_id,))
+            cursor.execute(LOOKUP_QUERIES['itinerary'], (itinerary_id,))
             itinerary = cursor.fetchone()
             if not itinerary:
                 return jsonify({'error': 'Itinerary not found'}), 404
             
             return jsonify({
                 'status': 'success',
-                'data': {
-                    'id': itinerary['id'],
-                    'budget': float(itinerary['budget']),
-                    'source': itinerary['source'],
-                    'destination': itinerary['destination'],
-                    'days': itinerary['days'],
-                    'preferences': json.loads(itinerary['preferences']),
-                    'itinerary': json.loads(itinerary['itinerary_data']),
-                    'created_at': itinerary['created_at'].isoformat() if itinerary['created_at'] else None
-                }
+                'data': serialize_itinerary(itinerary)
             })
     finally:
         conn.close()
 
 @app.route('/itinerary', methods=['GET'])
 def get_all_itineraries():
+    return list_resource('itineraries', serialize_itinerary_summary)
+
+def load_emergency_contacts():
+    query, params = build_list_query('er', list(LIST_QUERIES['er']['columns']))
     conn = get_db_conn()
     try:
         with conn.cursor() as cursor:
-            cursor.execute('SELECT * FROM itineraries ORDER BY created_at DESC')
-            itineraries = cursor.fetchall()
-            
-            result = []
-            for itinerary in itineraries:
-                result.append({
-                    'id': itinerary['id'],
-                    'budget': float(itinerary['budget']),
-                    'source': itinerary['source'],
-                    'destination': itinerary['destination'],
-                    'days': itinerary['days'],
-                    'preferences': json.loads(itinerary['preferences']),
-                    'created_at': itinerary['created_at'].isoformat() if itinerary['created_at'] else None
-                })
-            
-            return jsonify({
-                'status': 'success',
-                'count': len(result),
-                'data': result
-            })
+            cursor.execute(query, params)
+            return cursor.fetchall()
     finally:
         conn.close()
 
+def sync_emergency_contact(cursor, contact_id):
+    cursor.execute(*build_row_query('er', contact_id))
+    contact = cursor.fetchone()
+    if contact:
+        er_index.upsert(contact)
+    else:
+        er_index.remove(contact_id)
+
+er_index = GeoIndex(load_emergency_contacts)
+
+MAX_NEARBY_RADIUS = 50000
+MAX_NEARBY_K = 100
+
+@app.route('/er-cont/nearby', methods=['GET'])
+def get_nearby_emergency_contacts():
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+        radius = float(request.args.get('radius', 5000))
+        k = int(request.args.get('k', 10))
+    except KeyError:
+        return jsonify({'error': 'Missing required parameters: lat and lng are required'}), 400
+    except ValueError:
+        return jsonify({'error': 'Invalid parameter format: lat, lng, radius and k must be numbers'}), 400
+
+    if not (-90 <= lat <= 90) or not (-180 <= lng <= 180):
+        return jsonify({'error': 'Invalid coordinates: latitude must be between -90 and 90, longitude between -180 and 180'}), 400
+    if not 0 < radius <= MAX_NEARBY_RADIUS:
+        return jsonify({'error': f'radius must be between 0 and {MAX_NEARBY_RADIUS} meters'}), 400
+    if not 1 <= k <= MAX_NEARBY_K:
+        return jsonify({'error': f'k must be between 1 and {MAX_NEARBY_K}'}), 400
+
+    contacts = er_index.nearest(lat, lng, radius, k)
+    return jsonify({
+        'status': 'success',
+        'count': len(contacts),
+        'data': contacts
+    })
+
 @app.route('/er-cont', methods=['GET'])
 def get_emergency_contacts():
-    conn = get_db_conn()
-    try:
-        with conn.cursor() as cursor:
-            cursor.execute('''
-                SELECT 
-                    e.id,
-                    e.name,
-                    e.phno,
-                    e.loc,
-                    e.latitude,
-                    e.longitude,
-                    e.link,
-                    t.name as creator
-                FROM er e
-                JOIN tourists t ON e.created_by = t.id
-            ''')
-            contacts = cursor.fetchall()
-            result = {
-                'status': 'success',
-                'count': len(contacts),
-                'data': contacts
-            }
-            return jsonify(result)
-    finally:
-        conn.close()
+    return list_resource('er')
 
 @app.route('/er-cont', methods=['POST'])
 def create_emergency_contact():
@@ -739,13 +842,23 @@ def create_emergency_contact():
                     data.get('link')
                 )
             )
+            contact_id = cursor.lastrowid
+            record_change(cursor, 'er', contact_id)
             conn.commit()
+            sync_emergency_contact(cursor, contact_id)
             return jsonify({'message': 'Emergency contact created successfully'}), 201
     except pymysql.err.IntegrityError:
         return jsonify({'error': 'Invalid created_by ID'}), 400
     finally:
         conn.close()
 
+@app.route('/er-cont/bulk', methods=['POST'])
+def create_emergency_contacts_bulk():
+    response = bulk_insert('er')
+    # Cheaper to rebuild the grid on the next lookup than to upsert each row
+    er_index.invalidate()
+    return response
+
 @app.route('/er-cont/<int:contact_id>', methods=['PUT'])
 def update_emergency_contact(contact_id):
     data = request.get_json()
@@ -783,8 +896,10 @@ def update_emergency_contact(contact_id):
             
             if cursor.rowcount == 0:
                 return jsonify({'error': 'Emergency contact not found'}), 404
+            record_change(cursor, 'er', contact_id)
             
             conn.commit()
+            sync_emergency_contact(cursor, contact_id)
             return jsonify({'message': 'Emergency contact updated successfully'})
     finally:
         conn.close()
@@ -797,10 +912,40 @@ def delete_emergency_contact(contact_id):
             cursor.execute('DELETE FROM er WHERE id = %s', (contact_id,))
             if cursor.rowcount == 0:
                 return jsonify({'error': 'Emergency contact not found'}), 404
+            record_change(cursor, 'er', contact_id, 'delete')
             conn.commit()
+            er_index.remove(contact_id)
             return jsonify({'message': 'Emergency contact deleted successfully'})
     finally:
         conn.close()
 
+STATS_SOURCES = {
+    'db-pool': lambda: get_pool().stats(),
+    'itinerary-jobs': itinerary_jobs.stats,
+    'itinerary-coalescing': itinerary_flights.stats,
+    'itinerary-repair': repair_stats.stats,
+    'itinerary-similarity': itinerary_index.stats,
+    'er-index': er_index.stats,
+    'itinerary-cache': itinerary_cache.stats,
+    'image-variants': image_variants.stats,
+    'upload-reaper': upload_reaper.stats,
+    'profiler': profiler.stats,
+    'itinerary-admission': itinerary_admission.stats,
+}
+
+@app.route('/stats/<name>', methods=['GET'])
+def get_stats(name):
+    source = STATS_SOURCES.get(name)
+    if source is None:
+        return jsonify({'error': f'No stats named {name}'}), 404
+    return jsonify({
+        'status': 'success',
+        'data': source()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(STATS_SOURCES), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
\ No newline at end of file
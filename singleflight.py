@@ -0,0 +1,135 @@
+import asyncio
+import os
+import threading
+
+ITINERARY_COALESCE_TIMEOUT = float(os.getenv('ITINERARY_COALESCE_TIMEOUT', 120))
+
+
+class SingleFlightTimeout(Exception):
+    pass
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Collapses concurrent calls for the same key into one execution.
+
+    The first caller for a key runs fn; callers arriving while it is in flight
+    wait for that result (or exception) instead of running fn themselves.
+    """
+
+    def __init__(self, timeout=ITINERARY_COALESCE_TIMEOUT):
+        self.timeout = timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'leaders': 0,
+            'coalesced': 0,
+            'leader_failures': 0,
+            'follower_failures': 0,
+            'follower_timeouts': 0,
+        }
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+                self._stats['leaders'] += 1
+            else:
+                call.followers += 1
+                leader = False
+                self._stats['coalesced'] += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except BaseException as e:
+                call.error = e
+                with self._lock:
+                    self._stats['leader_failures'] += 1
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result, False
+
+        if not call.done.wait(self.timeout):
+            with self._lock:
+                self._stats['follower_timeouts'] += 1
+            raise SingleFlightTimeout(f'Timed out after {self.timeout}s waiting for an identical request')
+        if call.error is not None:
+            with self._lock:
+                self._stats['follower_failures'] += 1
+            raise call.error
+        return call.result, True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+            stats['waiting'] = sum(call.followers for call in self._calls.values())
+        return stats
+
+
+class _AsyncCall:
+    def __init__(self):
+        self.future = asyncio.get_running_loop().create_future()
+        self.followers = 0
+
+
+class AsyncSingleFlight(SingleFlight):
+    """SingleFlight for coroutines; all callers must share one event loop."""
+
+    async def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _AsyncCall()
+                leader = True
+                self._stats['leaders'] += 1
+            else:
+                call.followers += 1
+                leader = False
+                self._stats['coalesced'] += 1
+
+        if leader:
+            try:
+                result = await fn()
+            except asyncio.CancelledError:
+                call.future.cancel()
+                raise
+            except BaseException as e:
+                with self._lock:
+                    self._stats['leader_failures'] += 1
+                call.future.set_exception(e)
+                # Followers re-raise it; this marks it as retrieved
+                call.future.exception()
+                raise
+            else:
+                call.future.set_result(result)
+            finally:
+                with self._lock:
+                    del self._calls[key]
+            return result, False
+
+        try:
+            # shield: a follower timing out must not cancel the leader's call
+            result = await asyncio.wait_for(asyncio.shield(call.future), self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self._stats['follower_timeouts'] += 1
+            raise SingleFlightTimeout(f'Timed out after {self.timeout}s waiting for an identical request')
+        except Exception:
+            with self._lock:
+                self._stats['follower_failures'] += 1
+            raise
+        return result, True
@@ -0,0 +1,148 @@
+import hashlib
+import os
+import time
+import uuid
+
+from werkzeug.utils import secure_filename
+
+from images import remove_variants
+
+UPLOAD_FOLDER = 'uploads'
+UPLOAD_URL_PREFIX = '/uploads/'
+UPLOAD_CHUNK_SIZE = 64 * 1024
+# A blob touched this recently may be about to gain a reference from an
+# in-flight request, so it is left for the orphan sweep instead
+UPLOAD_DELETE_GRACE = float(os.getenv('UPLOAD_DELETE_GRACE', 300))
+
+EXTENSION_ALIASES = {'jpeg': 'jpg'}
+
+# Every column that stores an /uploads/ URL
+IMAGE_REFERENCES = (
+    ('tourists', 'profile_image'),
+    ('tourists', 'background_image'),
+    ('posts', 'image_url'),
+)
+
+
+def upload_path(url):
+    if not url or not url.startswith(UPLOAD_URL_PREFIX):
+        return None
+    filename = url[len(UPLOAD_URL_PREFIX):]
+    if not filename or filename != secure_filename(filename):
+        return None
+    return os.path.join(UPLOAD_FOLDER, filename)
+
+
+def _used_marker(path):
+    # Empty file under uploads/.used/ whose mtime is the blob's last reuse.
+    # The blob's own mtime is its Last-Modified and ETag, which /uploads
+    # serves as immutable, so it is never touched.
+    folder, filename = os.path.split(path)
+    return os.path.join(folder, '.used', filename)
+
+
+def _existing_blob(path):
+    if not os.path.exists(path):
+        return False
+    # Mark the reuse so a concurrent delete_upload leaves it alone
+    marker = _used_marker(path)
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    with open(marker, 'a'):
+        pass
+    os.utime(marker)
+    return True
+
+
+def save_upload(file):
+    # Hash while streaming to a temporary file, then move it to its digest
+    # name; identical content resolves to the blob that is already there.
+    # Returns (url, created).
+    ext = secure_filename(file.filename).rsplit('.', 1)[-1].lower()
+    ext = EXTENSION_ALIASES.get(ext, ext)
+
+    # werkzeug has already spooled the upload, so when it can be rewound a
+    # read-only pass finds duplicates without writing anything
+    if file.stream.seekable():
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: file.stream.read(UPLOAD_CHUNK_SIZE), b''):
+            digest.update(chunk)
+        filename = f'{digest.hexdigest()}.{ext}'
+        if _existing_blob(os.path.join(UPLOAD_FOLDER, filename)):
+            return UPLOAD_URL_PREFIX + filename, False
+        file.stream.seek(0)
+
+    tmp_path = os.path.join(UPLOAD_FOLDER, f'.{uuid.uuid4().hex}.tmp')
+    digest = hashlib.sha256()
+    try:
+        with open(tmp_path, 'wb') as out:
+            while True:
+                chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+        filename = f'{digest.hexdigest()}.{ext}'
+        path = os.path.join(UPLOAD_FOLDER, filename)
+        if _existing_blob(path):
+            os.remove(tmp_path)
+            return UPLOAD_URL_PREFIX + filename, False
+        os.replace(tmp_path, path)
+        return UPLOAD_URL_PREFIX + filename, True
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def build_count_references_query(url):
+    query = ' + '.join(f'(SELECT COUNT(*) FROM {table} WHERE {column} = %s)' for table, column in IMAGE_REFERENCES)
+    return f'SELECT {query} AS refs', [url] * len(IMAGE_REFERENCES)
+
+
+def build_referenced_urls_query(urls):
+    placeholders = ', '.join(['%s'] * len(urls))
+    query = ' UNION '.join(
+        f'SELECT {column} AS url FROM {table} WHERE {column} IN ({placeholders})' for table, column in IMAGE_REFERENCES
+    )
+    return query, list(urls) * len(IMAGE_REFERENCES)
+
+
+def count_references(cursor, url):
+    cursor.execute(*build_count_references_query(url))
+    return int(cursor.fetchone()['refs'])
+
+
+def unreferenced(cursor, urls):
+    # Run after the statement that dropped the references, inside the same
+    # transaction, and delete what it returns once that transaction commits
+    return [url for url in dict.fromkeys(urls) if upload_path(url) and count_references(cursor, url) == 0]
+
+
+def referenced_urls(cursor, urls):
+    # One round trip for a whole batch of candidate URLs
+    cursor.execute(*build_referenced_urls_query(urls))
+    return {row['url'] for row in cursor.fetchall()}
+
+
+def recently_touched(path):
+    touched = os.path.getmtime(path)
+    try:
+        touched = max(touched, os.path.getmtime(_used_marker(path)))
+    except FileNotFoundError:
+        pass
+    return time.time() - touched < UPLOAD_DELETE_GRACE
+
+
+def delete_upload(url):
+    # Returns the bytes freed, 0 if the blob was missing or too recent
+    path = upload_path(url)
+    if path is None or not os.path.exists(path) or recently_touched(path):
+        return 0
+    freed = os.path.getsize(path)
+    os.remove(path)
+    freed += remove_variants(path)
+    try:
+        os.remove(_used_marker(path))
+    except FileNotFoundError:
+        pass
+    return freed
@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The modules live at the repository root rather than in a package, and
+# the Places routes under the front end's backend, as in asgi.py
+sys.path.insert(0, ROOT)
+sys.path.append(os.path.join(ROOT, 'RoamConnect-FrontEnd', 'backend'))
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from admission import AdmissionController, Rejected, client_key
+
+
+def controller(**kwargs):
+    settings = {'max_concurrent': 1, 'max_waiting': 1, 'max_wait': 1, 'rate': 0, 'client_rate': 0}
+    settings.update(kwargs)
+    return AdmissionController(**settings)
+
+
+def test_client_rate_limit_is_429_with_retry_after():
+    admission = controller(client_rate=0.5, client_burst=2)
+    admission.check_rate('a')
+    admission.check_rate('a')
+    with pytest.raises(Rejected) as rejected:
+        admission.check_rate('a')
+    assert rejected.value.status == 429
+    assert rejected.value.headers() == {'Retry-After': '2'}
+    # Other clients have their own bucket
+    admission.check_rate('b')
+    assert admission.stats()['rejected_client_rate'] == 1
+
+
+def test_global_rate_limit_is_503_and_takes_no_client_token():
+    admission = controller(rate=0.5, burst=1, client_rate=1, client_burst=1)
+    admission.check_rate('a')
+    with pytest.raises(Rejected) as rejected:
+        admission.check_rate('b')
+    assert rejected.value.status == 503
+    assert admission._clients['b'].tokens == 1
+
+
+def test_refund_returns_the_tokens():
+    admission = controller(rate=0.001, burst=1, client_rate=0.001, client_burst=1)
+    admission.check_rate('a')
+    admission.refund('a')
+    admission.refund('a')
+    admission.check_rate('a')
+    with pytest.raises(Rejected):
+        admission.check_rate('a')
+
+
+def test_full_queue_is_rejected():
+    admission = controller(max_waiting=0)
+    with admission.admit('a'):
+        with pytest.raises(Rejected) as rejected:
+            with admission.admit('b'):
+                pass
+    assert rejected.value.status == 503
+    assert admission.stats()['rejected_queue_full'] == 1
+    assert admission.stats()['active'] == 0
+
+
+def test_wait_timeout_is_rejected():
+    admission = controller(max_wait=0.05)
+    with admission.admit('a'):
+        with pytest.raises(Rejected):
+            with admission.admit('b'):
+                pass
+    stats = admission.stats()
+    assert stats['rejected_wait_timeout'] == 1
+    assert stats['waiting'] == 0
+
+
+def test_waiters_are_admitted_in_order():
+    admission = controller(max_waiting=3)
+    order = []
+
+    def run(name):
+        with admission.admit(name):
+            order.append(name)
+
+    started = admission.acquire('first')
+    threads = []
+    for name in ('a', 'b', 'c'):
+        thread = threading.Thread(target=run, args=(name,))
+        thread.start()
+        threads.append(thread)
+        while admission.stats()['waiting'] < len(threads):
+            time.sleep(0.001)
+    admission.release(started)
+    for thread in threads:
+        thread.join()
+    assert order == ['a', 'b', 'c']
+    assert admission.stats()['active'] == 0
+
+
+def test_async_admit_releases_on_cancel():
+    # The abandoned wait still parks its thread until max_wait
+    admission = controller(max_wait=0.2)
+
+    async def main():
+        started = admission.acquire('a')
+        task = asyncio.create_task(admission.aadmit('b').__aenter__())
+        while admission.stats()['waiting'] == 0:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        admission.release(started)
+
+    asyncio.run(main())
+    stats = admission.stats()
+    assert stats['active'] == 0
+    assert stats['waiting'] == 0
+
+
+def test_follower_sees_503_for_another_clients_429():
+    rejected = Rejected('slow down', 429, 5, client='a')
+    assert rejected.seen_by('a') is rejected
+    other = rejected.seen_by('b')
+    assert other.status == 503
+    assert other.retry_after == 5
+
+
+def test_client_key_uses_remote_address():
+    assert client_key({'X-Forwarded-For': '1.2.3.4'}, '10.0.0.1') == '10.0.0.1'
+    assert client_key({}, None) == 'unknown'
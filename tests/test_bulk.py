@@ -0,0 +1,135 @@
+import pymysql
+import pytest
+
+import bulk
+from bulk import chunked, id_step, insert_rows, validate_rows
+
+
+def contact(**kwargs):
+    row = {'name': 'Clinic', 'phno': '112', 'loc': 'Centre', 'created_by': 1}
+    row.update(kwargs)
+    return row
+
+
+def test_validate_rows_reports_each_row():
+    rows = [(contact(), None), (None, 'Invalid JSON'), ('x', None), (contact(name=' '), None),
+            ({'name': 'x'}, None), (contact(latitude='91'), None), (contact(latitude='12.5', created_by='2'), None)]
+    valid, results = validate_rows('er', rows)
+    assert [index for index, _ in valid] == [0, 6]
+    assert valid[1][1] == ('Clinic', '112', 'Centre', '2', '12.5', None, None)
+    assert [r['status'] for r in results] == ['pending', 'error', 'error', 'error', 'error', 'error', 'pending']
+    assert results[1]['error'] == 'Invalid JSON'
+    assert results[2]['error'] == 'Row must be an object'
+    assert results[3]['error'] == 'Invalid fields: name'
+    assert results[4]['error'] == 'Missing required fields: phno, loc, created_by'
+    assert results[5]['error'] == 'Invalid fields: latitude'
+
+
+def test_validate_rows_limit(monkeypatch):
+    monkeypatch.setattr(bulk, 'BULK_MAX_ROWS', 2)
+    with pytest.raises(ValueError, match='At most 2'):
+        validate_rows('er', [(contact(), None)] * 3)
+
+
+def test_chunked_by_rows_and_bytes(monkeypatch):
+    monkeypatch.setattr(bulk, 'BULK_CHUNK_ROWS', 2)
+    items = [(i, ('x',)) for i in range(5)]
+    assert [[i for i, _ in chunk] for chunk in chunked(items)] == [[0, 1], [2, 3], [4]]
+
+    monkeypatch.setattr(bulk, 'BULK_CHUNK_ROWS', 100)
+    monkeypatch.setattr(bulk, 'BULK_CHUNK_BYTES', 50)
+    items = [(i, ('y' * 10,)) for i in range(5)]
+    # 24 bytes per row
+    assert [len(chunk) for chunk in chunked(items)] == [2, 2, 1]
+    assert list(chunked([])) == []
+
+
+class FakeCursor:
+    def __init__(self, settings=None, fail=False, first_id=100, creators=(1,)):
+        self.settings = settings
+        self.fail = fail
+        self.next_id = first_id
+        self.creators = creators
+        self.inserted = []
+        self.statements = 0
+        self._row = None
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query, params=None):
+        if '@@auto_increment_increment' in query:
+            if self.fail:
+                raise pymysql.err.OperationalError(1193, 'Unknown system variable')
+            self._row = self.settings
+        elif 'FROM tourists' in query:
+            self._rows = [{'id': i} for i in params if i in self.creators]
+        elif query.startswith('INSERT INTO er'):
+            self.statements += 1
+            self.lastrowid = self.next_id
+            self.next_id += 1
+            self.inserted.append(params)
+
+    def executemany(self, query, rows):
+        if query.startswith('INSERT INTO er'):
+            self.statements += 1
+            self.lastrowid = self.next_id
+            self.next_id += 2 * len(rows)
+            self.inserted.extend(rows)
+
+    def fetchone(self):
+        return self._row
+
+    def fetchall(self):
+        return self._rows
+
+
+def test_id_step():
+    assert id_step(FakeCursor({'step': 2, 'lock_mode': 1})) == 2
+    assert id_step(FakeCursor({'step': 1, 'lock_mode': 2})) is None
+    assert id_step(FakeCursor({'step': 1, 'lock_mode': None})) is None
+    assert id_step(FakeCursor(fail=True)) is None
+
+
+class FakeConn:
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self.commits = 0
+
+    def cursor(self):
+        return self._cursor
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def no_change_log(monkeypatch):
+    monkeypatch.setattr(bulk, 'record_changes', lambda cursor, resource, ids: None)
+
+
+def test_insert_rows_uses_the_id_step_for_multi_row_inserts():
+    valid, results = validate_rows('er', [(contact(), None), (contact(created_by=5), None), (contact(), None)])
+    cursor = FakeCursor({'step': 2, 'lock_mode': 1})
+    conn = FakeConn(cursor)
+    assert insert_rows(conn, 'er', valid, results) == [100, 102]
+    assert cursor.statements == 1
+    assert results[1] == {'index': 1, 'status': 'error', 'error': 'Invalid created_by ID'}
+    assert results[2] == {'index': 2, 'status': 'created', 'id': 102}
+
+
+def test_insert_rows_inserts_one_by_one_under_interleaved_locking():
+    valid, results = validate_rows('er', [(contact(), None)] * 3)
+    cursor = FakeCursor({'step': 1, 'lock_mode': 2})
+    conn = FakeConn(cursor)
+    assert insert_rows(conn, 'er', valid, results) == [100, 101, 102]
+    assert cursor.statements == 3
+    # Still one transaction per chunk
+    assert conn.commits == 1
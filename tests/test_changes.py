@@ -0,0 +1,164 @@
+import pytest
+
+import changes
+import server
+from changes import NEXT_SEQ_QUERY, changes_since, collection_etag, parse_since, record_changes
+
+
+@pytest.fixture(autouse=True)
+def table_ready(monkeypatch):
+    monkeypatch.setattr(changes, '_table_ready', True)
+
+
+class ScriptedCursor:
+    """Answers each query from the first handler whose text it contains."""
+
+    def __init__(self, handlers):
+        self.handlers = handlers
+        self.queries = []
+        self.lastrowid = None
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query, params=None):
+        self.queries.append((query, params))
+        for text, handler in self.handlers:
+            if text in query:
+                self._rows = handler(params)
+                return
+        raise AssertionError(f'unexpected query {query}')
+
+    def executemany(self, query, rows):
+        self.queries.append((query, rows))
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+
+def change(seq, resource, row_id, op='upsert'):
+    return {'seq': seq, 'resource': resource, 'row_id': row_id, 'op': op}
+
+
+def delta_cursor(change_rows, rows_by_id):
+    def rows(params):
+        return [rows_by_id[row_id] for row_id in params if row_id in rows_by_id]
+
+    def by_creator(params):
+        return [row for row in rows_by_id.values() if row['creator_id'] in params]
+
+    return ScriptedCursor([
+        ('FROM changes', lambda params: change_rows),
+        ('WHERE e.created_by IN', by_creator),
+        ('WHERE e.id IN', rows),
+    ])
+
+
+def test_record_changes_takes_consecutive_seqs_from_the_clock():
+    cursor = ScriptedCursor([(NEXT_SEQ_QUERY, lambda params: [])])
+    cursor.lastrowid = 12
+    record_changes(cursor, 'posts', [4, 5, 6], 'delete')
+    assert cursor.queries[0] == (NEXT_SEQ_QUERY, (3,))
+    assert cursor.queries[1][1] == [(10, 'posts', 4, 'delete'), (11, 'posts', 5, 'delete'), (12, 'posts', 6, 'delete')]
+
+
+def test_record_changes_without_rows_does_nothing():
+    cursor = ScriptedCursor([])
+    record_changes(cursor, 'posts', [])
+    assert cursor.queries == []
+
+
+@pytest.mark.parametrize('since', ['x', '-1'])
+def test_bad_since(since):
+    with pytest.raises(ValueError, match='since'):
+        parse_since({'since': since})
+
+
+def test_since_is_optional():
+    assert parse_since({}) is None
+    assert parse_since({'since': '7'}) == 7
+
+
+def test_etag_depends_on_version_and_query():
+    etag = collection_etag('posts', 5, b'limit=10')
+    assert etag.startswith('posts-')
+    assert etag == collection_etag('posts', 5, b'limit=10')
+    assert etag != collection_etag('posts', 6, b'limit=10')
+    assert etag != collection_etag('posts', 5, b'limit=20')
+
+
+def test_delta_sends_latest_state_per_row():
+    rows = {1: {'id': 1, 'creator_id': 9}, 2: {'id': 2, 'creator_id': 9}}
+    cursor = delta_cursor([
+        change(11, 'er', 1), change(12, 'er', 2), change(13, 'er', 1, 'delete'), change(14, 'er', 3),
+    ], rows)
+    result = changes_since(cursor, 'er', 10, ['id'], 14)
+    assert result['reset'] is False
+    assert [row['id'] for row in result['data']] == [2]
+    # 1 was deleted; 3 is gone without a tombstone yet
+    assert result['deleted'] == [1, 3]
+    assert result['cursor'] == 14
+
+
+def test_delta_resends_rows_of_a_changed_tourist():
+    rows = {1: {'id': 1, 'creator_id': 9}, 2: {'id': 2, 'creator_id': 8}, 3: {'id': 3, 'creator_id': 9}}
+    cursor = delta_cursor([change(11, 'er', 3), change(12, 'tourists', 9)], rows)
+    result = changes_since(cursor, 'er', 10, ['id'], 12)
+    assert [row['id'] for row in result['data']] == [1, 3]
+    assert result['deleted'] == []
+
+
+def test_delta_too_large_or_reset_asks_for_a_refetch(monkeypatch):
+    monkeypatch.setattr(changes, 'CHANGES_MAX_DELTA', 2)
+    cursor = delta_cursor([change(11, 'er', 1), change(12, 'er', 2), change(13, 'er', 3)], {})
+    assert changes_since(cursor, 'er', 10, ['id'], 13)['reset'] is True
+    cursor = delta_cursor([change(11, 'er', None, 'reset')], {})
+    result = changes_since(cursor, 'er', 10, ['id'], 11)
+    assert result['reset'] is True
+    assert result['cursor'] == 11
+
+
+class FakeConn:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+    def close(self):
+        pass
+
+
+def test_list_endpoint_answers_304_for_a_current_etag(monkeypatch):
+    cursor = ScriptedCursor([
+        ('MAX(seq)', lambda params: [{'version': 5}]),
+        ('FROM er e', lambda params: [{'id': 1}]),
+    ])
+    monkeypatch.setattr(server, 'get_db_conn', lambda: FakeConn(cursor))
+    client = server.app.test_client()
+
+    response = client.get('/er-cont?fields=id')
+    assert response.status_code == 200
+    assert response.json['cursor'] == 5
+    etag = response.headers['ETag']
+    response.close()
+
+    response = client.get('/er-cont?fields=id', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.get_data() == b''
+    response.close()
+    # The 304 was decided from the version alone
+    assert len([query for query, _ in cursor.queries if 'FROM er e' in query]) == 1
+
+    cursor.handlers[0] = ('MAX(seq)', lambda params: [{'version': 6}])
+    response = client.get('/er-cont?fields=id', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    response.close()
@@ -0,0 +1,135 @@
+import threading
+import time
+
+import pytest
+
+from db import ConnectionPool, PoolTimeout
+
+
+class FakeConn:
+    def __init__(self):
+        self.closed = False
+        self.rollbacks = 0
+        self.pings = 0
+        self.fail_ping = False
+        self.fail_rollback = False
+
+    def rollback(self):
+        if self.fail_rollback:
+            raise RuntimeError('connection lost')
+        self.rollbacks += 1
+
+    def ping(self, reconnect=False):
+        self.pings += 1
+        if self.fail_ping:
+            raise RuntimeError('gone away')
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(**kwargs):
+    created = []
+
+    def connect():
+        conn = FakeConn()
+        created.append(conn)
+        return conn
+
+    return ConnectionPool(connect, **kwargs), created
+
+
+def test_reuses_returned_connection():
+    pool, created = make_pool(max_size=2)
+    conn = pool.acquire()
+    conn.close()
+    pool.acquire().close()
+    assert len(created) == 1
+    assert created[0].rollbacks == 2
+    assert pool.stats()['checkouts'] == 2
+
+
+def test_closed_handle_cannot_be_used():
+    pool, _ = make_pool()
+    conn = pool.acquire()
+    conn.close()
+    with pytest.raises(Exception, match='already returned'):
+        conn.cursor()
+
+
+def test_times_out_when_exhausted():
+    pool, _ = make_pool(max_size=1, timeout=0.05)
+    pool.acquire()
+    with pytest.raises(PoolTimeout):
+        pool.acquire()
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_waiter_gets_released_connection():
+    pool, created = make_pool(max_size=1, timeout=2)
+    conn = pool.acquire()
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+    waiter.start()
+    time.sleep(0.05)
+    conn.close()
+    waiter.join()
+    assert len(got) == 1
+    assert len(created) == 1
+
+
+def test_discard_frees_the_slot():
+    pool, created = make_pool(max_size=1, timeout=0.05)
+    pool.acquire().discard()
+    assert created[0].closed
+    pool.acquire()
+    assert len(created) == 2
+    assert pool.stats()['size'] == 1
+
+
+def test_failed_rollback_discards_connection():
+    pool, created = make_pool()
+    conn = pool.acquire()
+    created[0].fail_rollback = True
+    conn.close()
+    assert created[0].closed
+    assert pool.stats()['idle'] == 0
+
+
+def test_stale_connection_is_pinged_and_replaced():
+    pool, created = make_pool(ping_after=0)
+    pool.acquire().close()
+    created[0].fail_ping = True
+    pool.acquire()
+    assert created[0].closed
+    assert len(created) == 2
+    assert pool.stats()['ping_failures'] == 1
+
+
+def test_old_connections_are_recycled():
+    pool, created = make_pool(max_lifetime=0)
+    pool.acquire().close()
+    pool.acquire()
+    assert created[0].closed
+    assert pool.stats()['recycled'] >= 1
+
+
+def test_acquire_reaps_idle_connections():
+    pool, created = make_pool(max_idle=0)
+    pool.acquire().close()
+    time.sleep(0.01)
+    pool.acquire()
+    assert created[0].closed
+    assert len(created) == 2
+    assert pool.stats()['reaped'] == 1
+    assert pool.stats()['size'] == 1
+
+
+def test_connect_failure_frees_the_slot():
+    def connect():
+        raise RuntimeError('refused')
+
+    pool = ConnectionPool(connect, max_size=1, timeout=0.05)
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+    assert pool.stats()['size'] == 0
@@ -0,0 +1,83 @@
+import threading
+import time
+
+from geo_index import GeoIndex, haversine_m
+
+CONTACTS = [
+    {'id': 1, 'name': 'Near', 'latitude': 12.9716, 'longitude': 77.5946},
+    {'id': 2, 'name': 'Mid', 'latitude': 12.9816, 'longitude': 77.5946},
+    {'id': 3, 'name': 'Far', 'latitude': 13.5, 'longitude': 77.5946},
+    {'id': 4, 'name': 'No location', 'latitude': None, 'longitude': None},
+]
+
+
+def test_haversine_one_degree_of_latitude():
+    assert abs(haversine_m(0, 0, [1.0], [0.0])[0] - 111195) < 10
+
+
+def test_nearest_sorted_and_limited_by_radius():
+    index = GeoIndex(lambda: CONTACTS)
+    found = index.nearest(12.9716, 77.5946, 5000, 10)
+    assert [row['id'] for row in found] == [1, 2]
+    assert found[0]['distance_m'] == 0
+    assert 1100 < found[1]['distance_m'] < 1120
+
+
+def test_nearest_returns_k_closest():
+    index = GeoIndex(lambda: CONTACTS)
+    assert [row['id'] for row in index.nearest(12.9716, 77.5946, 100000, 2)] == [1, 2]
+
+
+def test_upsert_and_remove():
+    index = GeoIndex(lambda: CONTACTS)
+    index.nearest(0, 0, 1, 1)
+    index.upsert({'id': 5, 'name': 'New', 'latitude': 12.9717, 'longitude': 77.5946})
+    index.upsert({'id': 1, 'name': 'Moved', 'latitude': 40.0, 'longitude': -70.0})
+    index.remove(2)
+    assert [row['id'] for row in index.nearest(12.9716, 77.5946, 5000, 10)] == [5]
+    assert index.stats()['rows'] == 3
+
+
+def test_wide_search_across_the_antimeridian():
+    index = GeoIndex(lambda: [
+        {'id': 1, 'latitude': 0.0, 'longitude': 179.99},
+        {'id': 2, 'latitude': 0.0, 'longitude': -179.99},
+    ])
+    assert {row['id'] for row in index.nearest(0.0, 179.995, 5000, 10)} == {1, 2}
+
+
+def test_concurrent_expiry_reloads_once():
+    loads = []
+
+    def loader():
+        loads.append(1)
+        time.sleep(0.1)
+        return CONTACTS
+
+    index = GeoIndex(loader)
+    threads = [threading.Thread(target=index.nearest, args=(12.9716, 77.5946, 5000, 1)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert loads == [1]
+
+
+def test_writes_during_a_reload_survive_it():
+    loading = threading.Event()
+    finish = threading.Event()
+
+    def loader():
+        loading.set()
+        finish.wait()
+        return CONTACTS
+
+    index = GeoIndex(loader)
+    reload = threading.Thread(target=index.reload)
+    reload.start()
+    loading.wait()
+    index.upsert({'id': 5, 'name': 'New', 'latitude': 12.9717, 'longitude': 77.5946})
+    index.remove(2)
+    finish.set()
+    reload.join()
+    assert [row['id'] for row in index.nearest(12.9716, 77.5946, 5000, 10)] == [1, 5]
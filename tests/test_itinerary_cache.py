@@ -0,0 +1,79 @@
+import asyncio
+import json
+
+import pytest
+
+from itinerary_cache import ItineraryCache, bucket_range, budget_bucket, cache_key, normalize_trip
+
+
+def trip(**kwargs):
+    values = {'source': 'Paris', 'destination': 'Rome', 'days': 3, 'budget': 1000, 'preferences': ['Food', 'Art']}
+    values.update(kwargs)
+    return values
+
+
+def test_normalize_trip_ignores_case_spacing_and_preference_order():
+    assert normalize_trip(trip(source='  PARIS ', destination='rome', preferences=['art', ' food', 'Art'])) == \
+        normalize_trip(trip())
+    assert normalize_trip(trip(days='3'))['days'] == 3
+
+
+def test_cache_key_separates_different_trips():
+    assert cache_key(trip()) == cache_key(trip(source='paris', preferences=['ART', 'food']))
+    assert cache_key(trip()) != cache_key(trip(days=4))
+    assert cache_key(trip()) != cache_key(trip(preferences=['Food']))
+
+
+def test_budget_buckets():
+    assert budget_bucket(1000) == budget_bucket(1040)
+    assert budget_bucket(1000) != budget_bucket(1500)
+    assert budget_bucket(0) == 0
+    low, high = bucket_range(budget_bucket(1000))
+    assert low <= 1000 < high
+
+
+def test_lru_eviction_and_ttl():
+    cache = ItineraryCache(max_entries=2, ttl=60)
+    cache.put(trip(days=1), 1, {})
+    cache.put(trip(days=2), 2, {})
+    assert cache._get_memory(trip(days=1)) == (1, {})
+    cache.put(trip(days=3), 3, {})
+    # days=2 was least recently used
+    assert cache._get_memory(trip(days=2)) is None
+    assert cache.stats()['evictions'] == 1
+
+    expired = ItineraryCache(ttl=-1)
+    expired.put(trip(), 1, {})
+    assert expired._get_memory(trip()) is None
+    assert expired.stats()['expirations'] == 1
+
+
+def stored_row(itinerary_id, **kwargs):
+    stored = trip(**kwargs)
+    return dict(stored, id=itinerary_id, preferences=json.dumps(stored['preferences']),
+                itinerary_data=json.dumps({'id': itinerary_id}))
+
+
+def test_async_lookup_matches_stored_rows_and_caches_them():
+    cache = ItineraryCache()
+    queries = []
+
+    async def fetchall(query, params):
+        queries.append(params)
+        return [stored_row(1, preferences=['Beaches']), stored_row(2, budget=1020)]
+
+    assert asyncio.run(cache.aget(trip(), fetchall)) == (2, {'id': 2})
+    assert asyncio.run(cache.aget(trip(), fetchall)) == (2, {'id': 2})
+    assert len(queries) == 1
+    assert cache.stats()['db_hits'] == 1
+    assert cache.stats()['memory_hits'] == 1
+
+
+def test_async_lookup_miss():
+    async def fetchall(query, params):
+        return []
+
+    cache = ItineraryCache()
+    assert asyncio.run(cache.aget(trip(), fetchall)) is None
+    assert cache.stats()['misses'] == 1
+    assert cache.stats()['hit_ratio'] == pytest.approx(0.0)
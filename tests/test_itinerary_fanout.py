@@ -0,0 +1,58 @@
+import itinerary_ai
+from itinerary_ai import BUDGET_CATEGORIES, merge_itinerary_chunks, split_days
+
+TRIP = {'source': 'Paris', 'destination': 'Rome', 'days': 5, 'budget': 1000, 'preferences': []}
+
+
+def chunk(first_day, last_day, **kwargs):
+    # Chunks number their days from 1, as the model often does
+    values = {
+        'summary': f'Days {first_day}-{last_day}.',
+        'daily_itinerary': [{'day': n, 'title': f'Day {first_day + n - 1}'} for n in range(1, last_day - first_day + 2)],
+        'budget_breakdown': {'categories': []},
+    }
+    values.update(kwargs)
+    return values
+
+
+def test_split_days():
+    assert split_days(7, 3) == [(1, 3), (4, 6), (7, 7)]
+    assert split_days(3, 3) == [(1, 3)]
+    assert split_days(1, 3) == [(1, 1)]
+
+
+def test_merge_renumbers_days_in_order():
+    merged = merge_itinerary_chunks(TRIP, [chunk(1, 3), chunk(4, 5)])
+    assert [entry['day'] for entry in merged['daily_itinerary']] == [1, 2, 3, 4, 5]
+    assert [entry['title'] for entry in merged['daily_itinerary']] == [f'Day {n}' for n in range(1, 6)]
+    assert merged['summary'] == 'Days 1-3. Days 4-5.'
+
+
+def test_merge_sums_budget_categories():
+    first = chunk(1, 3, budget_breakdown={'categories': [
+        {'category': 'food', 'amount': 300}, {'category': 'souvenirs', 'amount': '100'}]})
+    second = chunk(4, 5, budget_breakdown={'categories': [
+        {'category': 'food', 'amount': 100}, {'category': 'activities', 'amount': 'lots'}]})
+    breakdown = merge_itinerary_chunks(TRIP, [first, second])['budget_breakdown']
+    assert breakdown['total'] == 1000
+    categories = {c['category']: c for c in breakdown['categories']}
+    assert [c['category'] for c in breakdown['categories']] == list(BUDGET_CATEGORIES) + ['souvenirs']
+    assert categories['food'] == {'category': 'food', 'amount': 400, 'percentage': 80.0}
+    assert categories['souvenirs']['percentage'] == 20.0
+    assert categories['activities']['amount'] == 0
+
+
+def test_merge_deduplicates_list_sections():
+    tip = {'tip': 'Carry cash'}
+    first = chunk(1, 3, local_tips=[tip], emergency_info={'police': '112'})
+    second = chunk(4, 5, local_tips=[dict(tip), {'tip': 'Walk'}], emergency_info={'police': '113'})
+    merged = merge_itinerary_chunks(TRIP, [first, second])
+    assert merged['local_tips'] == [tip, {'tip': 'Walk'}]
+    assert merged['cultural_notes'] == []
+    assert merged['emergency_info'] == {'police': '112'}
+
+
+def test_fanout_keeps_chunk_order(monkeypatch):
+    monkeypatch.setattr(itinerary_ai, 'generate_itinerary_chunk', lambda trip, first, last: chunk(first, last))
+    merged = itinerary_ai.generate_itinerary_fanout(dict(TRIP, days=7))
+    assert [entry['title'] for entry in merged['daily_itinerary']] == [f'Day {n}' for n in range(1, 8)]
@@ -0,0 +1,161 @@
+import json
+import threading
+import time
+
+import pytest
+
+import itinerary_index
+from itinerary_index import ItineraryIndex
+
+
+def trip(days=3, budget=1000, preferences=('Museums', 'Food'), source='Paris', destination='Rome'):
+    return {'source': source, 'destination': destination, 'days': days, 'budget': budget,
+            'preferences': list(preferences)}
+
+
+def loaded_index(**kwargs):
+    index = ItineraryIndex(**kwargs)
+    index._refreshed_at = time.monotonic()
+    return index
+
+
+class FakeCursor:
+    def __init__(self, table, queries):
+        self.table = table
+        self.queries = queries
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, query, params):
+        self.queries.append(params)
+        after, limit = params
+        self.rows = [row for row in self.table if row['id'] > after][:limit]
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConn:
+    def __init__(self, table, queries, gate=None):
+        self.table = table
+        self.queries = queries
+        self.gate = gate
+
+    def cursor(self):
+        if self.gate:
+            self.gate.wait(1)
+        return FakeCursor(self.table, self.queries)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def table(monkeypatch):
+    rows = []
+    queries = []
+    gate = threading.Event()
+    gate.set()
+    monkeypatch.setattr(itinerary_index, 'get_db_conn', lambda: FakeConn(rows, queries, gate))
+    return rows, queries, gate
+
+
+def stored_row(itinerary_id, **kwargs):
+    stored = trip(**kwargs)
+    return dict(stored, id=itinerary_id, preferences=json.dumps(stored['preferences']))
+
+
+def test_identical_trip_matches_with_full_score():
+    index = loaded_index()
+    index.add(1, trip())
+    itinerary_id, score = index.find(trip())
+    assert itinerary_id == 1
+    assert score == pytest.approx(1.0)
+
+
+def test_route_is_normalised_and_must_match():
+    index = loaded_index()
+    index.add(1, trip())
+    assert index.find(trip(source='  paris ', destination='ROME'))[0] == 1
+    assert index.find(trip(destination='Milan')) is None
+
+
+def test_closest_candidate_wins():
+    index = loaded_index()
+    index.add(1, trip(budget=2000))
+    index.add(2, trip(budget=1100))
+    assert index.find(trip())[0] == 2
+
+
+def test_day_delta_beyond_the_limit_never_matches():
+    index = loaded_index(threshold=0, max_day_delta=1)
+    index.add(1, trip(days=5))
+    assert index.find(trip(days=3)) is None
+    assert index.find(trip(days=4))[0] == 1
+
+
+def test_score_below_threshold_is_no_match():
+    index = loaded_index(threshold=0.85)
+    index.add(1, trip(budget=1000, preferences=('Beaches',)))
+    # Same days, same budget, disjoint preferences: 0.3 + 0.3 + 0
+    assert index.find(trip(budget=1000)) is None
+    index.threshold = 0.5
+    assert index.find(trip(budget=1000))[1] == pytest.approx(0.6)
+
+
+def test_first_find_loads_in_the_background(table):
+    rows, queries, gate = table
+    rows.append(stored_row(1))
+    gate.clear()
+    index = ItineraryIndex()
+    # The load is waiting on the database, and find() does not
+    assert index.find(trip()) is None
+    gate.set()
+    index._loader.join(1)
+    assert index.find(trip())[0] == 1
+    assert index.stats()['loaded']
+
+
+def test_failed_load_is_retried_after_the_interval(monkeypatch):
+    attempts = []
+
+    def unavailable():
+        attempts.append(1)
+        raise RuntimeError('database down')
+
+    monkeypatch.setattr(itinerary_index, 'get_db_conn', unavailable)
+    index = ItineraryIndex(refresh_interval=60)
+    index.start()
+    index._loader.join(1)
+    index.find(trip())
+    assert len(attempts) == 1
+    index._retry_at = 0.0
+    index.find(trip())
+    index._loader.join(1)
+    assert len(attempts) == 2
+
+
+def test_expired_index_refreshes_once(table):
+    rows, queries, gate = table
+    index = ItineraryIndex(refresh_interval=0)
+    index.refresh()
+    rows.append(stored_row(5))
+    queries.clear()
+    gate.clear()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(index.find(trip()))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.05)
+    gate.set()
+    for thread in threads:
+        thread.join(1)
+    # Only one caller refreshed; the rest matched what was loaded already
+    assert len(queries) == 1
+    assert queries[0][0] == 0
+    assert index.find(trip())[0] == 5
@@ -0,0 +1,47 @@
+import pytest
+
+from itinerary_repair import contiguous_ranges, salvage_days, tolerant_json_loads
+
+
+def test_strips_fences_and_trailing_commas():
+    assert tolerant_json_loads('```json\n{"a": [1, 2,], "b": {"c": 3,},}\n```') == {'a': [1, 2], 'b': {'c': 3}}
+
+
+def test_ignores_text_after_the_object():
+    assert tolerant_json_loads('Here you go: {"a": "}"} Enjoy!') == {'a': '}'}
+
+
+def test_truncated_output_keeps_finished_days():
+    text = '{"daily_itinerary": [{"day": 1, "activities": []}, {"day": 2, "activit'
+    assert tolerant_json_loads(text) == {'daily_itinerary': [{'day': 1, 'activities': []}]}
+
+
+def test_no_object_raises():
+    with pytest.raises(ValueError):
+        tolerant_json_loads('Sorry, I cannot help with that.')
+
+
+def test_salvage_maps_relative_day_numbers():
+    itinerary = {'daily_itinerary': [
+        {'day': 1, 'activities': ['a']},
+        {'day': 2, 'activities': ['b']},
+        {'day': 2, 'activities': ['duplicate']},
+        {'day': 'three', 'activities': []},
+        {'day': 3},
+    ]}
+    days = salvage_days(itinerary, 4, 6)
+    assert days == {4: {'day': 4, 'activities': ['a']}, 5: {'day': 5, 'activities': ['b']}}
+
+
+def test_salvage_keeps_absolute_day_numbers():
+    days = salvage_days({'daily_itinerary': [{'day': 5, 'activities': []}]}, 4, 6)
+    assert list(days) == [5]
+
+
+def test_salvage_of_non_object_is_empty():
+    assert salvage_days(['not', 'an', 'itinerary'], 1, 3) == {}
+
+
+def test_contiguous_ranges():
+    assert contiguous_ranges([5, 1, 2, 3, 7, 8]) == [(1, 3), (5, 5), (7, 8)]
+    assert contiguous_ranges([]) == []
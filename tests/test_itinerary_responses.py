@@ -0,0 +1,61 @@
+import json
+
+from admission import Rejected
+from itinerary_ai import ItineraryError
+from itinerary_responses import ItineraryEventStream, error_response, itinerary_events
+from jobs import QueueFull
+from singleflight import SingleFlightTimeout
+
+ITINERARY = {
+    'title': 'Rome',
+    'daily_itinerary': [{'day': 1, 'activities': []}, {'day': 2, 'activities': []}],
+    'tips': ['Book ahead'],
+}
+
+
+def parse_frames(frames):
+    events = []
+    for frame in frames:
+        event, data = frame.strip().split('\n')
+        events.append((event[len('event: '):], json.loads(data[len('data: '):])))
+    return events
+
+
+def test_replayed_itinerary_frames():
+    stream = ItineraryEventStream(json.dumps)
+    frames = [stream.on_event(*event) for event in itinerary_events(ITINERARY)]
+    frames = [frame for frame in frames if frame]
+    frames += stream.unsent_days()
+    frames.append(stream.done(7, True))
+    assert parse_frames(frames) == [
+        ('day', ITINERARY['daily_itinerary'][0]),
+        ('day', ITINERARY['daily_itinerary'][1]),
+        ('section', {'key': 'title', 'value': 'Rome'}),
+        ('section', {'key': 'tips', 'value': ['Book ahead']}),
+        ('done', {'id': 7, 'cached': True}),
+    ]
+    assert stream.itinerary is ITINERARY
+
+
+def test_repaired_days_are_sent_after_the_stream():
+    stream = ItineraryEventStream(json.dumps)
+    stream.on_event('item', 'daily_itinerary', ITINERARY['daily_itinerary'][0])
+    stream.on_event('itinerary', None, ITINERARY)
+    assert parse_frames(stream.unsent_days()) == [('day', ITINERARY['daily_itinerary'][1])]
+
+
+def test_stream_errors():
+    stream = ItineraryEventStream(json.dumps)
+    assert parse_frames([stream.error(ItineraryError('bad', details='x'))]) == [
+        ('error', {'error': 'bad', 'details': 'x'})
+    ]
+    assert parse_frames([stream.error(RuntimeError('boom'))]) == [('error', {'error': 'boom'})]
+
+
+def test_error_statuses():
+    assert error_response(Rejected('slow down', 429, 3)) == ({'error': 'slow down'}, 429, {'Retry-After': '3'})
+    assert error_response(QueueFull('full'))[1:] == (503, {'Retry-After': '5'})
+    assert error_response(SingleFlightTimeout('late'))[1] == 504
+    assert error_response(ValueError('days'))[:2] == ({'error': 'Invalid input: days'}, 400)
+    assert error_response(ItineraryError('bad'))[:2] == ({'error': 'bad'}, 500)
+    assert error_response(RuntimeError('boom'))[1] == 500
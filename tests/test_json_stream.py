@@ -0,0 +1,49 @@
+import json
+
+from json_stream import IncrementalObjectParser
+
+ITINERARY = {
+    'title': 'Goa, "beaches" {and} [forts]',
+    'daily_itinerary': [
+        {'day': 1, 'activities': [{'name': 'Fort'}]},
+        {'day': 2, 'activities': []},
+    ],
+    'total_cost': 12000,
+    'tips': ['pack light', 'carry cash'],
+}
+
+
+def feed_in_chunks(parser, text, size):
+    events = []
+    for start in range(0, len(text), size):
+        events.extend(parser.feed(text[start:start + size]))
+    return events
+
+
+def test_emits_items_and_fields_in_order():
+    text = '```json\n' + json.dumps(ITINERARY) + '\n```'
+    for size in (1, 3, 7, len(text)):
+        parser = IncrementalObjectParser(item_keys=('daily_itinerary',))
+        events = feed_in_chunks(parser, text, size)
+        assert events == [
+            ('field', 'title', ITINERARY['title']),
+            ('item', 'daily_itinerary', ITINERARY['daily_itinerary'][0]),
+            ('item', 'daily_itinerary', ITINERARY['daily_itinerary'][1]),
+            ('field', 'total_cost', 12000),
+            ('field', 'tips', ITINERARY['tips']),
+        ]
+        assert not parser.broken
+
+
+def test_item_is_emitted_before_the_object_closes():
+    parser = IncrementalObjectParser(item_keys=('daily_itinerary',))
+    events = parser.feed('{"daily_itinerary": [{"day": 1, "activities": []}, {"day"')
+    assert events == [('item', 'daily_itinerary', {'day': 1, 'activities': []})]
+
+
+def test_malformed_fragment_marks_broken_and_keeps_text():
+    parser = IncrementalObjectParser()
+    assert parser.feed('{"a": tru') == []
+    assert parser.feed('x, "b": 1}') == []
+    assert parser.broken
+    assert parser.text == '{"a": trux, "b": 1}'
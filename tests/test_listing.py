@@ -0,0 +1,49 @@
+from datetime import datetime
+
+import pytest
+
+from listing import (
+    MAX_PAGE_LIMIT, build_list_query, decode_post_cursor, encode_post_cursor, page_result, parse_fields,
+    parse_list_args
+)
+
+
+def test_post_cursor_round_trip():
+    post = {'created_at': datetime(2024, 5, 1, 9, 30, 15), 'id': 42}
+    assert decode_post_cursor(encode_post_cursor(post)) == (post['created_at'], 42)
+
+
+@pytest.mark.parametrize('cursor', ['', '42', 'yesterday_42', '2024-05-01T09:30:15_x'])
+def test_bad_post_cursor(cursor):
+    with pytest.raises(ValueError, match='next_after'):
+        decode_post_cursor(cursor)
+
+
+def test_fields_always_include_id():
+    assert parse_fields('posts', {'fields': 'title, creator_name,title'}) == ['id', 'title', 'creator_name']
+
+
+def test_unknown_field():
+    with pytest.raises(ValueError, match='pwd'):
+        parse_fields('tourists', {'fields': 'name,pwd'})
+
+
+@pytest.mark.parametrize('args', [{'after': 'x'}, {'limit': '0'}, {'limit': str(MAX_PAGE_LIMIT + 1)}])
+def test_bad_list_args(args):
+    with pytest.raises(ValueError):
+        parse_list_args('tourists', args)
+
+
+def test_keyset_direction_follows_order():
+    query, params = build_list_query('itineraries', ['id'], after=10, limit=5)
+    assert 'WHERE id < %s ORDER BY id DESC LIMIT %s' in query
+    assert params == [10, 6]
+    query, _ = build_list_query('posts', ['id'], after=10, limit=5)
+    assert 'WHERE p.id > %s ORDER BY p.id ASC' in query
+
+
+def test_page_result_uses_lookahead_row():
+    rows = [{'id': i} for i in range(1, 5)]
+    assert page_result(rows, 3)['next_after'] == 3
+    assert page_result(rows, 3)['count'] == 3
+    assert page_result(rows[:3], 3)['next_after'] is None
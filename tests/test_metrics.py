@@ -0,0 +1,86 @@
+import pytest
+from flask import Flask, Response
+
+import metrics
+from metrics import Counter, Histogram
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram('test_seconds', 'Test.', ('route',), buckets=(0.1, 1))
+    histogram.observe(0.05, '/a')
+    histogram.observe(0.5, '/a')
+    histogram.observe(5, '/a')
+    assert histogram.render()[2:] == [
+        'roamconnect_test_seconds_bucket{route="/a",le="0.1"} 1',
+        'roamconnect_test_seconds_bucket{route="/a",le="1.0"} 2',
+        'roamconnect_test_seconds_bucket{route="/a",le="+Inf"} 3',
+        'roamconnect_test_seconds_sum{route="/a"} 5.55',
+        'roamconnect_test_seconds_count{route="/a"} 3',
+    ]
+
+
+def test_label_values_are_escaped():
+    counter = Counter('test_total', 'Test.', ('name',))
+    counter.inc(2, 'a "b"\n')
+    assert counter.render()[-1] == 'roamconnect_test_total{name="a \\"b\\"\\n"} 2'
+
+
+def test_render_includes_numeric_component_stats():
+    text = metrics.render({'pool': lambda: {'size': 3, 'avg': 0.5, 'loaded': True, 'name': 'x'}})
+    assert text.endswith('\n')
+    lines = text.splitlines()
+    assert '# TYPE roamconnect_component_stat gauge' in lines
+    assert 'roamconnect_component_stat{component="pool",stat="size"} 3' in lines
+    assert 'roamconnect_component_stat{component="pool",stat="avg"} 0.5' in lines
+    assert not [line for line in lines if 'stat="loaded"' in line or 'stat="name"' in line]
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    metrics.init_app(app)
+
+    @app.route('/ok/<int:n>')
+    def ok(n):
+        metrics.record('db_execute', 0.25)
+        return {'n': n}
+
+    @app.route('/fail')
+    def fail():
+        raise RuntimeError('boom')
+
+    @app.route('/stream')
+    def stream():
+        def body():
+            metrics.record('openai', 0.5)
+            yield 'x'
+        return Response(body())
+
+    return app
+
+
+def series(histogram, *labels):
+    return histogram._series.get(labels)
+
+
+def test_requests_and_phases_are_observed_under_the_rule(app):
+    client = app.test_client()
+    client.get('/ok/1').close()
+    client.get('/ok/2').close()
+    counts, _ = series(metrics.request_seconds, 'GET', '/ok/<int:n>', '200')
+    assert sum(counts) == 2
+    assert series(metrics.phase_seconds, '/ok/<int:n>', 'db_execute')[1] == pytest.approx(0.5)
+
+
+def test_unhandled_errors_are_counted_as_500(app):
+    app.config['PROPAGATE_EXCEPTIONS'] = False
+    app.test_client().get('/fail').close()
+    assert series(metrics.request_seconds, 'GET', '/fail', '500') is not None
+
+
+def test_streamed_phases_count_for_their_route(app):
+    response = app.test_client().get('/stream')
+    assert response.get_data() == b'x'
+    response.close()
+    assert series(metrics.phase_seconds, '/stream', 'openai')[1] == pytest.approx(0.5)
+    assert series(metrics.phase_seconds, 'background', 'openai') is None
@@ -0,0 +1,107 @@
+import threading
+
+import httpx
+import pytest
+
+from routes.emergency_routes import PlacesCache, geohash_encode, nearest_place, place_cell
+
+OK = {'status': 'OK', 'results': []}
+
+
+def test_geohash_encode():
+    cell, (lat, lng) = geohash_encode(42.6, -5.6, 5)
+    assert cell == 'ezs42'
+    assert abs(lat - 42.6) < 0.03 and abs(lng - -5.6) < 0.03
+    assert geohash_encode(42.6, -5.6, 7)[0].startswith('ezs42')
+
+
+def test_points_in_one_cell_share_a_key():
+    key, centre = place_cell('12.97160', '77.59460', 'hospital')
+    assert place_cell(*centre, 'hospital') == (key, centre)
+    assert place_cell('12.97160', '77.59460', 'police')[0] != key
+    assert place_cell('12.99', '77.59460', 'hospital')[0] != key
+
+
+def fetcher(*responses):
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        response = responses[min(len(calls), len(responses)) - 1]
+        if isinstance(response, Exception):
+            raise response
+        return response
+    return fetch, calls
+
+
+def test_fresh_entries_are_served_from_memory():
+    cache = PlacesCache()
+    fetch, calls = fetcher(OK)
+    assert cache.get('k', fetch) is OK
+    assert cache.get('k', fetch) is OK
+    assert len(calls) == 1
+    assert cache.stats()['hits'] == 1
+
+
+def test_stale_entry_is_served_and_refreshed_once():
+    cache = PlacesCache(ttl=0, stale_ttl=60)
+    refreshed = {'status': 'OK', 'results': [1]}
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        if len(calls) == 1:
+            return OK
+        release.wait(1)
+        return refreshed
+
+    cache.get('k', fetch)
+    # Both are served the stale answer; only one refresh is started
+    assert cache.get('k', fetch) is OK
+    assert cache.get('k', fetch) is OK
+    release.set()
+    cache._executor.shutdown(wait=True)
+    assert len(calls) == 2
+    assert cache.stats()['refreshes'] == 1
+    assert cache._entries['k'][1] is refreshed
+
+
+def test_upstream_error_serves_an_expired_entry():
+    cache = PlacesCache(ttl=0, stale_ttl=0)
+    fetch, _ = fetcher(OK, httpx.ConnectError('down'))
+    cache.get('k', fetch)
+    assert cache.get('k', fetch) is OK
+    assert cache.stats()['upstream_errors'] == 1
+    with pytest.raises(httpx.ConnectError):
+        cache.get('other', fetch)
+
+
+def test_failed_answers_are_not_cached():
+    cache = PlacesCache()
+    denied = {'status': 'REQUEST_DENIED'}
+    fetch, calls = fetcher(denied, OK)
+    assert cache.get('k', fetch) is denied
+    assert cache.get('k', fetch) is OK
+    assert len(calls) == 2
+
+
+def test_lru_eviction():
+    cache = PlacesCache(max_entries=1)
+    fetch, _ = fetcher(OK)
+    cache.get('a', fetch)
+    cache.get('b', fetch)
+    assert list(cache._entries) == ['b']
+    assert cache.stats()['evictions'] == 1
+
+
+def place(name, lat, lng):
+    return {'name': name, 'vicinity': name, 'geometry': {'location': {'lat': lat, 'lng': lng}}}
+
+
+def test_nearest_place_is_closest_to_the_caller():
+    data = {'status': 'OK', 'results': [place('far', 13.0, 77.6), place('near', 12.9717, 77.5947)]}
+    body, status = nearest_place(data, '12.9716', '77.5946')
+    assert status == 200
+    assert body['data']['name'] == 'near'
+    assert nearest_place({'status': 'ZERO_RESULTS', 'results': []}, 0, 0)[1] == 404
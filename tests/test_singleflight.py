@@ -0,0 +1,110 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from singleflight import AsyncSingleFlight, SingleFlight, SingleFlightTimeout
+
+
+def run_concurrently(flight, fn, callers):
+    results = []
+    errors = []
+
+    def call():
+        try:
+            results.append(flight.do('key', fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    calls = []
+
+    def fn():
+        calls.append(1)
+        time.sleep(0.1)
+        return 'result'
+
+    results, errors = run_concurrently(flight, fn, 5)
+    assert calls == [1]
+    assert not errors
+    assert sorted(coalesced for _, coalesced in results) == [False, True, True, True, True]
+    assert all(value == 'result' for value, _ in results)
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_followers_get_the_leaders_exception():
+    flight = SingleFlight()
+
+    def fn():
+        time.sleep(0.1)
+        raise ValueError('upstream failed')
+
+    results, errors = run_concurrently(flight, fn, 3)
+    assert not results
+    assert len(errors) == 3
+    assert all(isinstance(e, ValueError) for e in errors)
+    assert flight.stats()['leader_failures'] == 1
+
+
+def test_follower_times_out():
+    flight = SingleFlight(timeout=0.05)
+    release = threading.Event()
+    leader = threading.Thread(target=flight.do, args=('key', release.wait))
+    leader.start()
+    while flight.stats()['in_flight'] == 0:
+        time.sleep(0.001)
+    with pytest.raises(SingleFlightTimeout):
+        flight.do('key', lambda: None)
+    release.set()
+    leader.join()
+
+
+def test_sequential_calls_run_again():
+    flight = SingleFlight()
+    assert flight.do('key', lambda: 1) == (1, False)
+    assert flight.do('key', lambda: 2) == (2, False)
+
+
+def test_async_calls_share_one_execution():
+    flight = AsyncSingleFlight()
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'result'
+
+    async def main():
+        return await asyncio.gather(*[flight.do('key', fn) for _ in range(4)])
+
+    results = asyncio.run(main())
+    assert calls == [1]
+    assert [value for value, _ in results] == ['result'] * 4
+    assert sum(coalesced for _, coalesced in results) == 3
+
+
+def test_async_follower_timeout_leaves_leader_running():
+    flight = AsyncSingleFlight(timeout=0.01)
+
+    async def fn():
+        await asyncio.sleep(0.05)
+        return 'result'
+
+    async def main():
+        leader = asyncio.create_task(flight.do('key', fn))
+        await asyncio.sleep(0)
+        with pytest.raises(SingleFlightTimeout):
+            await flight.do('key', fn)
+        return await leader
+
+    assert asyncio.run(main()) == ('result', False)
@@ -0,0 +1,86 @@
+import hashlib
+import io
+import os
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import storage
+from storage import delete_upload, save_upload, unreferenced, upload_path
+
+
+@pytest.fixture(autouse=True)
+def upload_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'UPLOAD_FOLDER', str(tmp_path))
+    return tmp_path
+
+
+class OneWayStream(io.BytesIO):
+    # Like a request body that has not been spooled
+    def seekable(self):
+        return False
+
+
+def upload(data, filename='photo.JPEG', stream=io.BytesIO):
+    return FileStorage(stream=stream(data), filename=filename)
+
+
+def test_upload_is_stored_under_its_digest(upload_folder):
+    url, created = save_upload(upload(b'pixels'))
+    assert created
+    assert url == f"/uploads/{hashlib.sha256(b'pixels').hexdigest()}.jpg"
+    assert (upload_folder / url.rsplit('/', 1)[1]).read_bytes() == b'pixels'
+
+
+@pytest.mark.parametrize('stream', [io.BytesIO, OneWayStream])
+def test_duplicate_upload_reuses_the_blob(upload_folder, stream):
+    url, _ = save_upload(upload(b'pixels'))
+    blob = upload_folder / url.rsplit('/', 1)[1]
+    os.utime(blob, (1, 1))
+
+    again, created = save_upload(upload(b'pixels', 'other.jpg', stream))
+    assert (again, created) == (url, False)
+    # The blob keeps its mtime, the reuse is recorded beside it
+    assert blob.stat().st_mtime == 1
+    assert (upload_folder / '.used' / blob.name).exists()
+    assert not [name for name in os.listdir(upload_folder) if name.endswith('.tmp')]
+
+
+def test_upload_path_rejects_other_urls():
+    assert upload_path('/uploads/../server.py') is None
+    assert upload_path('https://example.com/a.jpg') is None
+    assert upload_path('/uploads/') is None
+    assert upload_path('/uploads/a.jpg').endswith('a.jpg')
+
+
+class CountingCursor:
+    def __init__(self, refs):
+        self.refs = refs
+        self.params = []
+
+    def execute(self, query, params):
+        self.params.append(params[0])
+
+    def fetchone(self):
+        return {'refs': self.refs[self.params[-1]]}
+
+
+def test_unreferenced_checks_each_upload_once():
+    cursor = CountingCursor({'/uploads/a.jpg': 0, '/uploads/b.jpg': 2})
+    urls = ['/uploads/a.jpg', '/uploads/b.jpg', '/uploads/a.jpg', 'https://example.com/c.jpg']
+    assert unreferenced(cursor, urls) == ['/uploads/a.jpg']
+    assert cursor.params == ['/uploads/a.jpg', '/uploads/b.jpg']
+
+
+def test_delete_upload_waits_out_the_grace_period(upload_folder, monkeypatch):
+    url, _ = save_upload(upload(b'pixels'))
+    blob = upload_folder / url.rsplit('/', 1)[1]
+    assert delete_upload(url) == 0
+    assert blob.exists()
+
+    monkeypatch.setattr(storage, 'UPLOAD_DELETE_GRACE', 0)
+    save_upload(upload(b'pixels'))
+    assert delete_upload(url) == len(b'pixels')
+    assert not blob.exists()
+    assert not (upload_folder / '.used' / blob.name).exists()
+    assert delete_upload(url) == 0